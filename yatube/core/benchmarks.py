@@ -0,0 +1,18 @@
+import math
+
+from django.test.utils import override_settings
+
+
+def percentile(values, percent) -> float:
+    """Процентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def timed_settings():
+    """Настройки для замера задержек: без DEBUG, который копит запросы
+    в connection.queries, и без QueryBudgetMiddleware, которая
+    проходит по стеку на каждом запросе. Обработчик запросов нужно
+    создать внутри: набор middleware он читает один раз."""
+    return override_settings(DEBUG=False, QUERY_INSPECTION=False)
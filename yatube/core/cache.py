@@ -0,0 +1,375 @@
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from core.db import chunks
+
+MISSING = object()
+# Проверка размера файла стоит COUNT(*), поэтому не на каждой записи.
+CULL_EVERY_WRITES: int = 100
+# Сколько последних изменений помнит журнал; отставший сильнее процесс
+# сбрасывает свой LRU целиком.
+CHANGES_KEPT: int = 10000
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    # Журнал изменённых ключей; NULL — «все», как при clear().
+    'CREATE TABLE IF NOT EXISTS changes ('
+    ' seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT)',
+)
+
+# Первые уровни по LOCATION: Django создаёт бэкенд кэша в каждом потоке,
+# а LRU должен быть один на процесс, как хранилище LocMemCache.
+local_tiers = {}
+
+
+class LocalTier:
+    """Ограниченный LRU процесса с коротким временем жизни записей.
+
+    Хранит значения в pickle: каждый get получает свою копию объекта.
+    Здесь же позиция процесса в журнале изменений (seen, checked_at).
+    epoch растёт с каждым удалением: значение, прочитанное из файла до
+    удаления, не должно лечь в LRU после него.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.seen = None
+        self.checked_at = 0.0
+        self.epoch = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires = entry
+            if expires <= time.time():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires=None, epoch=None):
+        local_expires = time.time() + self.timeout
+        if expires is not None:
+            local_expires = min(local_expires, expires)
+        with self.lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            self.entries[key] = (value, local_expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.epoch += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+
+
+class TwoTierCache(BaseCache):
+    """Кэш в два уровня: LRU процесса перед общим SQLite-файлом.
+
+    Любая запись во второй уровень добавляет изменённые ключи в общий
+    журнал; процесс, прочитав журнал, убирает из своего первого уровня
+    только эти ключи, так что инвалидация доходит до всех воркеров и не
+    стоит им остального LRU.
+
+    OPTIONS: MAX_ENTRIES и CULL_FREQUENCY относятся к файлу,
+    LOCAL_MAX_ENTRIES и LOCAL_TIMEOUT — к LRU процесса, CHECK_INTERVAL —
+    как часто (в секундах) читать журнал: запись другого процесса видна
+    с такой задержкой, запись любого потока этого процесса — сразу.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        self.local = local_tiers.setdefault(location, LocalTier(
+            int(options.get('LOCAL_MAX_ENTRIES', 1000)),
+            float(options.get('LOCAL_TIMEOUT', 5)),
+        ))
+        self.check_interval = float(options.get('CHECK_INTERVAL', 1))
+        self.threads = threading.local()
+        self.writes = 0
+
+    @property
+    def connection(self):
+        connection = getattr(self.threads, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.location, timeout=30, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.threads.connection = connection
+        return connection
+
+    def _sync_local(self):
+        now = time.time()
+        if now - self.local.checked_at < self.check_interval:
+            return
+        self._catch_up(self.connection)
+        self.local.checked_at = now
+
+    def _catch_up(self, connection):
+        """Убирает из LRU ключи, изменённые после прочитанного журнала."""
+        local = self.local
+        with local.sync_lock:
+            if local.seen is None:
+                # LRU ещё пуст: хватит запомнить конец журнала.
+                local.seen = self._last_change(connection)
+                return
+            rows = connection.execute(
+                'SELECT seq, key FROM changes WHERE seq > ? ORDER BY seq '
+                'LIMIT ?', (local.seen, local.max_entries + 1)
+            ).fetchall()
+            if not rows:
+                return
+            if (rows[0][0] != local.seen + 1
+                    or len(rows) > local.max_entries
+                    or any(key is None for _, key in rows)):
+                # Журнал урезан, изменений больше, чем LRU, или был
+                # clear().
+                local.clear()
+                local.seen = self._last_change(connection)
+                return
+            for _, key in rows:
+                local.delete(key)
+            local.seen = rows[-1][0]
+
+    def _last_change(self, connection) -> int:
+        return connection.execute(
+            'SELECT COALESCE(MAX(seq), 0) FROM changes'
+        ).fetchone()[0]
+
+    def _write(self, statements, keys=None):
+        """Выполняет изменения одной транзакцией и пишет их в журнал.
+
+        keys — затронутые ключи; None значит «все», как при clear().
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(connection)
+            connection.executemany(
+                'INSERT INTO changes (key) VALUES (?)',
+                [(None,)] if keys is None else [(key,) for key in keys]
+            )
+            self.writes += 1
+            if self.writes % CULL_EVERY_WRITES == 0:
+                self._cull(connection)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        # Свои изменения и вклинившиеся чужие видны процессу сразу.
+        # После COMMIT: иначе другой поток успел бы вернуть в LRU
+        # прежнее значение из файла.
+        self._catch_up(connection)
+        return result
+
+    def _cull(self, connection):
+        connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+        )
+        connection.execute(
+            'DELETE FROM changes WHERE seq <= '
+            '(SELECT MAX(seq) FROM changes) - ?', (CHANGES_KEPT,)
+        )
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,)
+            )
+
+    def _dump(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _read(self, key):
+        self._sync_local()
+        epoch = self.local.epoch
+        blob = self.local.get(key)
+        if blob is MISSING:
+            row = self.connection.execute(
+                'SELECT value, expires FROM cache WHERE key = ? AND '
+                '(expires IS NULL OR expires > ?)',
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                return MISSING
+            blob, expires = row
+            self.local.set(key, blob, expires, epoch)
+        return pickle.loads(blob)
+
+    def _upsert(self, key, value, timeout, only_new):
+        expires = self.get_backend_timeout(timeout)
+        blob = self._dump(value)
+
+        def statements(connection):
+            if only_new:
+                connection.execute(
+                    'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                    (key, time.time())
+                )
+                inserted = connection.execute(
+                    'INSERT OR IGNORE INTO cache (key, value, expires) '
+                    'VALUES (?, ?, ?)', (key, blob, expires)
+                ).rowcount
+            else:
+                inserted = connection.execute(
+                    'INSERT OR REPLACE INTO cache (key, value, expires) '
+                    'VALUES (?, ?, ?)', (key, blob, expires)
+                ).rowcount
+            return bool(inserted)
+        return self._write(statements, [key])
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._upsert(key, value, timeout, only_new=True)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = self._read(key)
+        return default if value is MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._upsert(key, value, timeout, only_new=False)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        expires = self.get_backend_timeout(timeout)
+        return self._write(lambda connection: bool(connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND '
+            '(expires IS NULL OR expires > ?)',
+            (expires, key, time.time())
+        ).rowcount), [key])
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write(lambda connection: connection.execute(
+            'DELETE FROM cache WHERE key = ?', (key,)
+        ), [key])
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._read(key) is not MISSING
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        def statements(connection):
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND '
+                '(expires IS NULL OR expires > ?)', (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (self._dump(value), key)
+            )
+            return value
+        return self._write(statements, [key])
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = {}
+        self._sync_local()
+        epoch = self.local.epoch
+        for key in keys:
+            cache_key = self.make_key(key, version=version)
+            self.validate_key(cache_key)
+            blob = self.local.get(cache_key)
+            if blob is MISSING:
+                missing[cache_key] = key
+            else:
+                found[key] = pickle.loads(blob)
+        for part in chunks(missing, 500):
+            rows = self.connection.execute(
+                'SELECT key, value, expires FROM cache WHERE key IN ({}) '
+                'AND (expires IS NULL OR expires > ?)'.format(
+                    ', '.join('?' * len(part))
+                ),
+                [*part, time.time()]
+            )
+            for cache_key, blob, expires in rows:
+                self.local.set(cache_key, blob, expires, epoch)
+                found[missing[cache_key]] = pickle.loads(blob)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = []
+        for key, value in data.items():
+            cache_key = self.make_key(key, version=version)
+            self.validate_key(cache_key)
+            rows.append((cache_key, self._dump(value), expires))
+
+        def statements(connection):
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)', rows
+            )
+        self._write(statements, [row[0] for row in rows])
+        return []
+
+    def delete_many(self, keys, version=None):
+        cache_keys = []
+        for key in keys:
+            cache_key = self.make_key(key, version=version)
+            self.validate_key(cache_key)
+            cache_keys.append((cache_key,))
+        self._write(lambda connection: connection.executemany(
+            'DELETE FROM cache WHERE key = ?', cache_keys
+        ), [row[0] for row in cache_keys])
+
+    def keys(self, prefix='', version=None) -> list:
+        """Живые ключи второго уровня, начинающиеся с prefix."""
+        full_prefix = self.make_key(prefix, version=version)
+        start = len(full_prefix) - len(prefix)
+        rows = self.connection.execute(
+            'SELECT key FROM cache WHERE substr(key, 1, ?) = ? AND '
+            '(expires IS NULL OR expires > ?)',
+            (len(full_prefix), full_prefix, time.time())
+        )
+        return [key[start:] for key, in rows]
+
+    def clear(self):
+        self._write(lambda connection: connection.execute(
+            'DELETE FROM cache'
+        ))
+
+    def close(self, **kwargs):
+        # Соединения живут в потоках и переиспользуются между запросами.
+        pass
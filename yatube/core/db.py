@@ -0,0 +1,46 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def chunks(iterable, size):
+    """Списки по size элементов из любого итерируемого, лениво."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def last_ids(queryset, count) -> list:
+    """id последних count строк выборки по возрастанию.
+
+    Так узнают id только что вставленных пачкой строк, когда база не
+    возвращает их из INSERT (SQLite): запись в SQLite идёт по одной
+    транзакции за раз, и чужие строки между нашими не вклиниваются.
+    """
+    return sorted(
+        queryset.order_by('-pk').values_list('pk', flat=True)[:count]
+    )
+
+
+def pragma_statements(pragmas) -> list:
+    return [f'PRAGMA {name} = {value}' for name, value in pragmas.items()]
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Настраивает новое соединение с SQLite по PRAGMAS базы или
+    SQLITE_PRAGMAS.
+
+    Команды идут в сам sqlite3, мимо курсора Django: их не видят
+    счётчики запросов.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS', settings.SQLITE_PRAGMAS)
+    for statement in pragma_statements(pragmas):
+        connection.connection.execute(statement)
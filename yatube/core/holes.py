@@ -0,0 +1,35 @@
+import re
+from urllib.parse import quote, unquote
+
+from django.template.loader import render_to_string
+
+HOLE_RE = re.compile(r'<!--hole:(\w+)((?::[^:>]*)*)-->')
+
+# Имя дырки -> (шаблон, функция контекста от request и аргументов).
+registry = {}
+
+
+def register(name, template_name, get_context=None) -> None:
+    """Регистрирует персональный фрагмент страницы."""
+    registry[name] = (template_name, get_context)
+
+
+def marker(name, args) -> str:
+    """Метка дырки, которую кэшируемая страница несёт вместо фрагмента."""
+    return '<!--hole:{}{}-->'.format(
+        name, ''.join(':' + quote(str(arg), safe='') for arg in args)
+    )
+
+
+def render_hole(request, name, args) -> str:
+    template_name, get_context = registry[name]
+    context = get_context(request, *args) if get_context else {}
+    return render_to_string(template_name, context, request=request)
+
+
+def fill_holes(request, content) -> str:
+    """Заполняет метки дырок фрагментами для текущего пользователя."""
+    def replace(match):
+        args = [unquote(arg) for arg in match.group(2).split(':')[1:]]
+        return render_hole(request, match.group(1), args)
+    return HOLE_RE.sub(replace, content)
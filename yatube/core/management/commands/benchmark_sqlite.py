@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.db import pragma_statements
+
+SCHEMA = (
+    'CREATE TABLE post (id INTEGER PRIMARY KEY, author_id INTEGER, '
+    'text TEXT, pub_date REAL)',
+    'CREATE INDEX post_author_pub_date ON post (author_id, pub_date, id)',
+)
+FEED_SQL: str = (
+    'SELECT id, text, pub_date FROM post WHERE author_id = ? '
+    'ORDER BY pub_date DESC, id DESC LIMIT 10'
+)
+AUTHORS: int = 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает чтение ленты из SQLite во время записи: настройки '
+        'по умолчанию против SQLITE_PRAGMAS. База создаётся во временной '
+        'папке.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=1)
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def connect(self, path, pragmas):
+        connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        for statement in pragma_statements(pragmas):
+            connection.execute(statement)
+        return connection
+
+    def populate(self, path, pragmas, rows):
+        connection = self.connect(path, pragmas)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO post (author_id, text, pub_date) VALUES (?, ?, ?)',
+            ((i % AUTHORS, 'Текст поста ' * 20, time.time() + i)
+             for i in range(rows))
+        )
+        connection.execute('COMMIT')
+        connection.close()
+
+    def write(self, connection, stop, result):
+        author_id = 0
+        while not stop.is_set():
+            author_id = (author_id + 1) % AUTHORS
+            try:
+                # Пост и счётчики в одной транзакции, как post_create.
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute(
+                    'INSERT INTO post (author_id, text, pub_date) '
+                    'VALUES (?, ?, ?)',
+                    (author_id, 'Новый пост ' * 20, time.time())
+                )
+                connection.execute(
+                    'SELECT COUNT(*) FROM post WHERE author_id = ?',
+                    (author_id,)
+                ).fetchone()
+                connection.execute('COMMIT')
+                result['writes'] += 1
+            except sqlite3.OperationalError:
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+                result['errors'] += 1
+
+    def read(self, connection, stop, result):
+        author_id = 0
+        while not stop.is_set():
+            author_id = (author_id + 7) % AUTHORS
+            started = time.perf_counter()
+            try:
+                connection.execute(FEED_SQL, (author_id,)).fetchall()
+            except sqlite3.OperationalError:
+                result['errors'] += 1
+                continue
+            result['latencies'].append(time.perf_counter() - started)
+
+    def run(self, pragmas, options) -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            self.populate(path, pragmas, options['rows'])
+            stop = threading.Event()
+            result = {'writes': 0, 'errors': 0, 'latencies': []}
+            workers = [
+                (self.write, options['writers']),
+                (self.read, options['readers']),
+            ]
+            threads = []
+            connections = []
+            for target, count in workers:
+                for _ in range(count):
+                    connection = self.connect(path, pragmas)
+                    connections.append(connection)
+                    threads.append(threading.Thread(
+                        target=target, args=(connection, stop, result)
+                    ))
+            for thread in threads:
+                thread.start()
+            time.sleep(options['seconds'])
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for connection in connections:
+                connection.close()
+        latencies = sorted(result['latencies']) or [0]
+        seconds = options['seconds']
+        return {
+            'reads/s': len(result['latencies']) / seconds,
+            'writes/s': result['writes'] / seconds,
+            'errors': result['errors'],
+            'p50 ms': statistics.median(latencies) * 1000,
+            'p95 ms': latencies[int(len(latencies) * 0.95)] * 1000,
+        }
+
+    def handle(self, *args, **options):
+        profiles = {
+            'default': {},
+            'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS,
+        }
+        columns = ['reads/s', 'writes/s', 'errors', 'p50 ms', 'p95 ms']
+        self.stdout.write(
+            'profile'.ljust(16)
+            + ''.join(column.rjust(12) for column in columns)
+        )
+        for name, pragmas in profiles.items():
+            row = self.run(pragmas, options)
+            self.stdout.write(
+                name.ljust(16)
+                + ''.join(f'{row[column]:12.1f}' for column in columns)
+            )
@@ -0,0 +1,316 @@
+import http.client
+import json
+import os
+import random
+import signal
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from core.benchmarks import percentile, timed_settings
+from posts.models import Group, Post, User
+
+DEFAULT_MIX: str = (
+    'index=40,group=15,profile=15,post=20,follow=5,comment=3,create=2'
+)
+ENDPOINTS = ('index', 'group', 'profile', 'post', 'follow', 'comment',
+             'create')
+LOGIN_REQUIRED = frozenset({'follow', 'comment', 'create'})
+TARGETS: int = 1000
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(text) -> dict:
+    """Смесь трафика «адрес=вес,...» в {адрес: вес}."""
+    mix = {}
+    for part in filter(None, text.split(',')):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise CommandError(f'Неизвестный адрес {name}: {ENDPOINTS}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f'Вес {name} — не число: {weight}')
+        if mix[name] < 0:
+            raise CommandError(f'Отрицательный вес {name}')
+    if not any(mix.values()):
+        raise CommandError('Пустая смесь трафика')
+    return mix
+
+
+def summarize(results, elapsed) -> dict:
+    """Сводка по (адрес, статус, мс): пропускная способность, доля
+    ошибок и хвосты задержек, всего и по адресам. Статус 0 — ответа
+    нет вовсе, ошибки — он и всё от 400."""
+    def latencies(rows) -> dict:
+        timings = [milliseconds for _, _, milliseconds in rows]
+        return {
+            f'p{percent}_ms': round(percentile(timings, percent), 3)
+            for percent in PERCENTILES
+        }
+
+    def errors(rows) -> int:
+        return sum(1 for _, status, _ in rows if not 0 < status < 400)
+
+    by_endpoint = defaultdict(list)
+    for row in results:
+        by_endpoint[row[0]].append(row)
+    return {
+        'requests': len(results),
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'error_rate': round(errors(results) / max(len(results), 1), 4),
+        'statuses': dict(Counter(str(status) for _, status, _ in results)),
+        'latency_ms': {
+            **(latencies(results) if results else {}),
+            'max_ms': round(max(
+                (milliseconds for _, _, milliseconds in results), default=0
+            ), 3),
+        },
+        'endpoints': {
+            endpoint: {
+                'requests': len(rows),
+                'errors': errors(rows),
+                **latencies(rows),
+            }
+            for endpoint, rows in sorted(by_endpoint.items())
+        },
+    }
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Поднимает приложение (без DEBUG и перехвата запросов) на '
+        'локальном многопоточном WSGI-сервере в нескольких процессах и '
+        'гоняет по нему смесь запросов анонимов и вошедших '
+        'пользователей из пула потоков. '
+        'Отчёт — пропускная способность, доля ошибок и хвосты задержек '
+        'в JSON. Запросы пишут в базу: запускайте на засеянной копии.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument(
+            '--logged-in', type=float, default=0.5,
+            help='Доля клиентов, вошедших на сайт'
+        )
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help=f'Веса адресов из {", ".join(ENDPOINTS)}'
+        )
+        parser.add_argument(
+            '--think', type=float, default=0,
+            help='Пауза клиента между запросами, мс'
+        )
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для JSON')
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError('Нужна ОС с fork()')
+        self.options = options
+        mix = parse_mix(options['mix'])
+        self.targets = self.load_targets()
+        logged_in = round(options['clients'] * options['logged_in'])
+        sessions = self.sessions(logged_in)
+        # Дочерние процессы сервера получают настройки при fork().
+        with timed_settings():
+            server, workers = self.start_server(options['processes'])
+        self.address = server.server_address[:2]
+        try:
+            clients = [
+                self.client_state(index, sessions[index]
+                                  if index < len(sessions) else None, mix)
+                for index in range(options['clients'])
+            ]
+            started = time.monotonic()
+            deadline = started + options['duration']
+            with ThreadPoolExecutor(options['clients']) as pool:
+                batches = list(pool.map(
+                    lambda state: self.replay(state, deadline), clients
+                ))
+            elapsed = time.monotonic() - started
+        finally:
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            server.server_close()
+        report = {
+            'server': {
+                'processes': options['processes'],
+                'clients': options['clients'],
+                'logged_in': len(sessions),
+                'mix': mix,
+            },
+            **summarize([row for batch in batches for row in batch],
+                        elapsed),
+        }
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text)
+        else:
+            self.stdout.write(text)
+
+    def load_targets(self) -> dict:
+        posts = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        )[:TARGETS])
+        if not posts:
+            raise CommandError('Постов нет: сначала manage.py seed')
+        return {
+            'posts': posts,
+            'groups': list(Group.objects.values_list(
+                'slug', flat=True
+            )[:TARGETS]),
+            'authors': list(User.objects.filter(
+                pk__in=Post.objects.values('author')[:TARGETS]
+            ).values_list('username', flat=True)),
+        }
+
+    def sessions(self, count) -> list:
+        """Куки сессий вошедших клиентов: сначала у читателей лент."""
+        users = list(User.objects.filter(
+            follower__isnull=False
+        ).distinct()[:count])
+        if len(users) < count:
+            users += User.objects.exclude(
+                pk__in=[user.pk for user in users]
+            )[:count - len(users)]
+        cookies = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            cookies.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+        return cookies
+
+    def start_server(self, processes):
+        """Слушающий сокет создаётся здесь, а запросы из него принимают
+        дочерние процессы: у каждого свои потоки, соединения с базой и
+        локальный кэш."""
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+        server.set_app(WSGIHandler())
+        # Соединения родителя не должны достаться детям.
+        connections.close_all()
+        workers = []
+        for _ in range(max(processes, 1)):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)
+            workers.append(pid)
+        return server, workers
+
+    def send(self, method, path, cookies, data=None):
+        """(статус, Set-Cookie) или (0, []), если ответа нет."""
+        connection = http.client.HTTPConnection(
+            *self.address, timeout=self.options['timeout']
+        )
+        headers = {}
+        if cookies:
+            headers['Cookie'] = '; '.join(
+                f'{name}={value}' for name, value in cookies.items()
+            )
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = cookies.get(settings.CSRF_COOKIE_NAME)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status, response.msg.get_all('Set-Cookie') or []
+        except (OSError, http.client.HTTPException):
+            return 0, []
+        finally:
+            connection.close()
+
+    def client_state(self, index, session, mix) -> dict:
+        cookies = {}
+        if session is not None:
+            cookies[settings.SESSION_COOKIE_NAME] = session
+            # Токен CSRF — из куки, которую ставит страница с формой.
+            _, set_cookies = self.send(
+                'GET', reverse('posts:post_create'), cookies
+            )
+            for header in set_cookies:
+                for name, morsel in SimpleCookie(header).items():
+                    cookies[name] = morsel.value
+        endpoints = [
+            name for name, weight in mix.items()
+            if weight
+            and (session is not None or name not in LOGIN_REQUIRED)
+            and (name != 'group' or self.targets['groups'])
+        ]
+        return {
+            'random': random.Random(self.options['seed'] + index),
+            'cookies': cookies,
+            'endpoints': endpoints,
+            'weights': [mix[name] for name in endpoints],
+        }
+
+    def request(self, endpoint, choose):
+        """Метод, путь и данные формы запроса к адресу."""
+        targets = self.targets
+        if endpoint == 'index':
+            return 'GET', reverse('posts:index'), None
+        if endpoint == 'group':
+            return 'GET', reverse('posts:group_list', kwargs={
+                'slug': choose(targets['groups'])
+            }), None
+        if endpoint == 'profile':
+            return 'GET', reverse('posts:profile', kwargs={
+                'username': choose(targets['authors'])
+            }), None
+        if endpoint == 'follow':
+            return 'GET', reverse('posts:follow_index'), None
+        if endpoint == 'comment':
+            return 'POST', reverse('posts:add_comment', kwargs={
+                'post_id': choose(targets['posts'])
+            }), {'text': 'Нагрузочный комментарий'}
+        if endpoint == 'create':
+            return 'POST', reverse('posts:post_create'), {
+                'text': 'Нагрузочный пост'
+            }
+        return 'GET', reverse('posts:post_detail', kwargs={
+            'post_id': choose(targets['posts'])
+        }), None
+
+    def replay(self, state, deadline) -> list:
+        rows = []
+        rng = state['random']
+        while time.monotonic() < deadline and state['endpoints']:
+            endpoint = rng.choices(
+                state['endpoints'], weights=state['weights']
+            )[0]
+            method, path, data = self.request(endpoint, rng.choice)
+            started = time.perf_counter()
+            status, _ = self.send(method, path, state['cookies'], data)
+            rows.append(
+                (endpoint, status, (time.perf_counter() - started) * 1000)
+            )
+            if self.options['think']:
+                time.sleep(self.options['think'] / 1000)
+        return rows
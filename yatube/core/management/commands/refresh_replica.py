@@ -0,0 +1,59 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.routers import replica_generation_key
+from posts.caching import FEED_PAGES, get_generation
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу в файлы реплик через online backup API '
+        'SQLite и отмечает поколение лент, с которого снята копия.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aliases', nargs='*',
+            help='Реплики из DATABASE_REPLICAS, по умолчанию все'
+        )
+        parser.add_argument(
+            '--output',
+            help='Записать отдельную копию в файл; реплика не отмечается'
+        )
+        parser.add_argument(
+            '--pages', type=int, default=-1,
+            help='Страниц за шаг копирования; -1 — всё за один шаг'
+        )
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        unknown = set(aliases) - set(settings.DATABASE_REPLICAS)
+        if unknown:
+            raise CommandError(f'Не реплики: {", ".join(sorted(unknown))}')
+        source = connections[DEFAULT_DB_ALIAS]
+        source.ensure_connection()
+        for alias in aliases:
+            path = options['output'] or settings.DATABASES[alias]['NAME']
+            # Поколение берём до копирования: запись во время копирования
+            # оставит реплику «отставшей», а не закрепит её как свежую.
+            generation = get_generation(FEED_PAGES)
+            started = time.perf_counter()
+            target = sqlite3.connect(path)
+            try:
+                source.connection.backup(target, pages=options['pages'])
+            finally:
+                target.close()
+            if not options['output']:
+                cache.set(
+                    replica_generation_key(alias),
+                    (generation, time.time()), None
+                )
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(self.style.SUCCESS(
+                f'{alias}: {path} обновлена за {elapsed:.0f} мс'
+            ))
@@ -0,0 +1,139 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from core.holes import fill_holes
+from core.queries import QueryBudgetExceeded, capture_queries
+from core.routers import PIN_COOKIE, is_pinned
+from posts.caching import FEED_PAGES, get_generation, page_etag, page_key
+from posts.caching import serve_cached
+
+logger = logging.getLogger(__name__)
+
+
+class PageCacheMiddleware:
+    """Кэширует GET-страницы целиком: одна копия на всех анонимов и одна
+    на всех вошедших. Персональные фрагменты шаблонов (тег hole)
+    хранятся метками и заполняются для каждого запроса.
+
+    Не кэшируются ответы с Cache-Control: private/no-cache/no-store и
+    страницы, использовавшие CSRF-токен вне дырок. Закреплённые за
+    основной базой после записи идут мимо кэша: им нужны свои правки.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD') or request.path.startswith(
+            tuple(settings.PAGE_CACHE_EXCLUDE)
+        ) or is_pinned(request):
+            return self.get_response(request)
+
+        request.punch_holes = True
+        response = serve_cached(
+            page_key(request, 'pages'),
+            get_generation(FEED_PAGES),
+            lambda: self.render(request),
+            lambda response: self.storable(request, response),
+        )
+        # ETag по поколению копии, а не текущему; свой ETag вьюхи
+        # остаётся как есть.
+        generation = getattr(response, 'page_generation', None)
+        etag = None
+        if generation is not None and not response.has_header('ETag'):
+            etag = page_etag(request, generation)
+        if etag is not None:
+            etag = quote_etag(etag)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+            response['ETag'] = etag
+        if 'text/html' in response.get('Content-Type', ''):
+            response.content = fill_holes(
+                request, response.content.decode(response.charset)
+            )
+        return response
+
+    def render(self, request):
+        response = self.get_response(request)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        replica_generation = getattr(request, 'replica_generation', None)
+        if replica_generation is not None:
+            response.content_generation = replica_generation
+        return response
+
+    def storable(self, request, response) -> bool:
+        cache_control = response.get('Cache-Control', '')
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and 'text/html' in response.get('Content-Type', '')
+            and not request.META.get('CSRF_COOKIE_USED')
+            and not response.cookies
+            and not any(
+                directive in cache_control
+                for directive in ('private', 'no-cache', 'no-store')
+            )
+        )
+
+
+class QueryBudgetMiddleware:
+    """Считает запросы к базе за время обработки запроса.
+
+    Пишет в лог повторяющиеся запросы одной формы с местами вызова и
+    превышения бюджета QUERY_BUDGETS (по имени маршрута); при
+    QUERY_BUDGET_STRICT превышение бюджета — исключение.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture_queries() as log:
+            response = self.get_response(request)
+        report = log.report(settings.QUERY_REPEAT_THRESHOLD)
+        if report:
+            logger.warning('Повторяющиеся запросы на %s:\n%s',
+                           request.path, report)
+        view_name = getattr(request.resolver_match, 'view_name', None)
+        budget = settings.QUERY_BUDGETS.get(view_name)
+        if budget is not None and len(log) > budget:
+            message = (
+                f'{request.path} ({view_name}): {len(log)} запросов '
+                f'при бюджете {budget}'
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        response['X-Query-Count'] = len(log)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """После записи закрепляет пользователя за основной базой на
+    REPLICA_PIN_SECONDS: так он сразу видит свои изменения."""
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and (
+            response.status_code < 400
+        ):
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,84 @@
+import os
+import re
+import sys
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+# Списки IN и VALUES разной длины дают один и тот же запрос.
+IN_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+THIS_FILE: str = os.path.abspath(__file__)
+
+
+def query_shape(sql) -> str:
+    """SQL без значений параметров: одинаков у запросов одной формы."""
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+def query_location() -> str:
+    """Ближайшее к запросу место в проекте: строка шаблона или кода."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        # type(), а не isinstance(): ленивый request.user при проверке
+        # класса сам пошёл бы в базу.
+        if issubclass(type(node), Node) and getattr(node, 'token', None):
+            origin = node.origin
+            name = origin.template_name or origin.name
+            return f'{name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if filename.startswith(settings.BASE_DIR) and filename != THIS_FILE:
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            return f'{path}:{frame.f_lineno}'
+        frame = frame.f_back
+    return '?'
+
+
+class QueryLog:
+    """Запросы, выполненные внутри capture_queries(), с местами вызова."""
+
+    def __init__(self):
+        self.queries = []
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((query_shape(sql), query_location()))
+        self.statements.append((context['connection'].alias, sql, params))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold) -> list:
+        """Формы запросов, выполненные не меньше threshold раз (N+1)."""
+        locations = defaultdict(list)
+        for shape, location in self.queries:
+            locations[shape].append(location)
+        return [
+            (shape, len(places), sorted(set(places)))
+            for shape, places in locations.items()
+            if len(places) >= threshold
+        ]
+
+    def report(self, threshold) -> str:
+        return '\n'.join(
+            f'{count} раз из {", ".join(places)}: {shape}'
+            for shape, count, places in self.repeated(threshold)
+        )
+
+
+@contextmanager
+def capture_queries():
+    """Записывает запросы ко всем базам в текущем потоке."""
+    log = QueryLog()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(log))
+        yield log
+
+
+class QueryBudgetExceeded(Exception):
+    pass
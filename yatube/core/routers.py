@@ -0,0 +1,100 @@
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from posts.caching import FEED_PAGES, generation_key
+
+PIN_COOKIE: str = 'pin_primary'
+
+local = threading.local()
+
+
+def replica_generation_key(alias) -> str:
+    return f'replica:{alias}:generation'
+
+
+def replica_aliases() -> list:
+    """Реплики, кроме зеркал основной базы (TEST MIRROR в тестах)."""
+    primary = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if connections[alias].settings_dict['NAME'] != primary
+    ]
+
+
+def choose_replica():
+    """Случайная реплика и поколение лент, с которого она снята.
+
+    Вернёт (None, None), если реплик нет, выбранная ещё ни разу не
+    обновлялась командой refresh_replica или отстала: пропустила запись
+    и обновлялась больше REPLICA_MAX_LAG секунд назад. Тогда чтения идут
+    в основную базу, и страницы кэшируются как обычно.
+    """
+    aliases = replica_aliases()
+    if not aliases:
+        return None, None
+    alias = random.choice(aliases)
+    state = cache.get(replica_generation_key(alias))
+    if state is None:
+        return None, None
+    generation, refreshed_at = state
+    if (generation != cache.get(generation_key(FEED_PAGES))
+            and time.time() - refreshed_at > settings.REPLICA_MAX_LAG):
+        return None, None
+    return alias, generation
+
+
+def is_pinned(request) -> bool:
+    """Пользователь недавно писал и читает только с основной базы."""
+    return PIN_COOKIE in request.COOKIES
+
+
+def read_from_replica(view):
+    """Отправляет чтения GET-запроса вьюхи на реплику.
+
+    На request.replica_generation остаётся поколение реплики: фрагменты
+    шаблонов кэшируются под ним, а не под текущим.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or is_pinned(request):
+            return view(request, *args, **kwargs)
+        alias, generation = choose_replica()
+        if alias is None:
+            return view(request, *args, **kwargs)
+        request.replica_generation = generation
+        local.alias = alias
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            local.alias = None
+    return wrapper
+
+
+class ReplicaRouter:
+    """Чтения внутри read_from_replica идут на реплику, всё прочее — на
+    основную базу. Реплики не мигрируются: это копии основной базы."""
+
+    def db_for_read(self, model, **hints):
+        # Явно основная база: иначе Django взял бы базу объекта из
+        # подсказки, а объект мог прийти с шарда постов.
+        return getattr(local, 'alias', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
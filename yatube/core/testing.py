@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.urls import resolve
+
+from core.queries import capture_queries
+
+
+class QueryBudgetMixin:
+    """Проверки числа запросов для TestCase."""
+
+    @contextmanager
+    def assertQueryBudget(self, budget, threshold=None):
+        """Падает, если запросов больше budget или есть N+1."""
+        if threshold is None:
+            threshold = settings.QUERY_REPEAT_THRESHOLD
+        with capture_queries() as log:
+            yield log
+        self.assertLessEqual(
+            len(log), budget,
+            f'{len(log)} запросов при бюджете {budget}:\n'
+            + '\n'.join(f'{place}: {shape}' for shape, place in log.queries)
+        )
+        report = log.report(threshold)
+        self.assertFalse(report, f'Повторяющиеся запросы:\n{report}')
+
+    def assertWithinBudget(self, client, path, **kwargs):
+        """GET-запрос в пределах бюджета маршрута из QUERY_BUDGETS."""
+        view_name = resolve(path.split('?')[0]).view_name
+        with self.assertQueryBudget(settings.QUERY_BUDGETS[view_name]):
+            response = client.get(path, **kwargs)
+        return response
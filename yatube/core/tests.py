@@ -1,9 +1,431 @@
-from django.test import TestCase
+import os
+import sqlite3
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, router
+from django.http import HttpResponse
+from django.template import Context, Origin, Template
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
 from http import HTTPStatus
 
+from core.cache import MISSING, TwoTierCache
+from core.management.commands.load_replay import parse_mix, summarize
+from core.middleware import PageCacheMiddleware
+from core.queries import QueryBudgetExceeded, capture_queries
+from core.routers import (PIN_COOKIE, choose_replica, read_from_replica,
+                          replica_generation_key)
+from core.writes import serialized_write
+from posts.caching import FEED_PAGES, feed_etag, get_generation
+from posts.models import Follow, Post
+
+User = get_user_model()
+
 
 class ViewTestClass(TestCase):
     def test_error_page(self):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class PageCacheMiddlewareTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.other = User.objects.create_user(username='other')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(PageCacheMiddlewareTest.reader)
+        self.other_client = Client()
+        self.other_client.force_login(PageCacheMiddlewareTest.other)
+
+    def test_shared_page_with_personal_holes(self):
+        """Вошедшие делят копию страницы, но видят свои фрагменты."""
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        response = self.reader_client.get(url)
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Пользователь: reader')
+        self.assertContains(response, 'Отписаться')
+
+        response = self.other_client.get(url)
+        self.assertTemplateNotUsed(response, 'posts/profile.html')
+        self.assertContains(response, 'Пользователь: other')
+        self.assertContains(response, 'Подписаться')
+        self.assertNotContains(response, 'reader')
+
+    def test_comment_form_and_edit_link_holes(self):
+        """Форма комментария и ссылка правки заполняются для запроса."""
+        author_client = Client()
+        author_client.force_login(PageCacheMiddlewareTest.author)
+        url = reverse(
+            'posts:post_detail',
+            kwargs={'post_id': PageCacheMiddlewareTest.post.pk}
+        )
+        edit_url = reverse(
+            'posts:post_edit',
+            kwargs={'post_id': PageCacheMiddlewareTest.post.pk}
+        )
+        self.assertContains(author_client.get(url), edit_url)
+        response = self.reader_client.get(url)
+        self.assertTemplateNotUsed(response, 'posts/post_detail.html')
+        self.assertNotContains(response, edit_url)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertNotContains(Client().get(url), 'csrfmiddlewaretoken')
+
+    def test_view_etag_kept(self):
+        """ETag, выставленный вьюхой, не заменяется ETag кэша страниц."""
+        def view(request):
+            response = HttpResponse('Страница')
+            response['ETag'] = '"view"'
+            return response
+
+        request = RequestFactory().get('/page/')
+        request.user = AnonymousUser()
+        response = PageCacheMiddleware(view)(request)
+        self.assertEqual(response['ETag'], '"view"')
+
+    def test_lagging_replica_page_not_fresh(self):
+        """Страница с отставшей реплики не выдаётся за текущую."""
+        contents = ['Старая', 'Новая']
+
+        def view(request):
+            content = contents.pop(0)
+            if content == 'Старая':
+                request.replica_generation = get_generation(FEED_PAGES) - 1
+            return HttpResponse(content)
+
+        middleware = PageCacheMiddleware(view)
+        for expected in ('Старая', 'Новая'):
+            request = RequestFactory().get('/page/')
+            request.user = AnonymousUser()
+            with self.subTest(content=expected):
+                self.assertContains(middleware(request), expected)
+
+    def test_pinned_user_bypasses_cache(self):
+        """Закреплённый после записи пользователь не получает копию."""
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        self.reader_client.get(url)
+        self.reader_client.cookies[PIN_COOKIE] = '1'
+        response = self.reader_client.get(url)
+        self.assertTemplateUsed(response, 'posts/profile.html')
+
+    def test_private_pages_not_shared(self):
+        """Лента подписок не попадает в общий кэш."""
+        url = reverse('posts:follow_index')
+        self.reader_client.get(url)
+        response = self.other_client.get(url)
+        self.assertIsNotNone(response.context)
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+
+class TwoTierCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        location = os.path.join(self.directory.name, 'cache.sqlite3')
+        params = {'OPTIONS': {'CHECK_INTERVAL': 0}}
+        self.worker = TwoTierCache(location, params)
+        # Другой процесс: свой LRU перед тем же файлом.
+        with mock.patch.dict('core.cache.local_tiers', clear=True):
+            self.other_worker = TwoTierCache(location, params)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cache_api(self):
+        """Бэкенд поддерживает API кэша Django."""
+        cache = self.worker
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertIsNone(cache.get('missing'))
+        self.assertFalse(cache.add('key', 2))
+        self.assertTrue(cache.add('new', 2))
+        self.assertEqual(cache.incr('new', 3), 5)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(
+            cache.get_many(['a', 'b', 'missing']), {'a': 1, 'b': 2}
+        )
+        self.assertEqual(sorted(cache.keys('')), ['a', 'b', 'key', 'new'])
+        self.assertEqual(cache.keys('n'), ['new'])
+        cache.delete_many(['a', 'b'])
+        self.assertEqual(cache.get_many(['a', 'b']), {})
+        cache.set('short', 1, 0.05)
+        time.sleep(0.1)
+        self.assertFalse(cache.has_key('short'))
+        cache.clear()
+        self.assertIsNone(cache.get('key'))
+
+    def test_local_tier_returns_copies(self):
+        """Изменение полученного объекта не портит кэш процесса."""
+        self.worker.set('key', ['value'])
+        self.worker.get('key').append('changed')
+        self.assertEqual(self.worker.get('key'), ['value'])
+
+    def test_invalidation_reaches_other_workers(self):
+        """Запись одного воркера сбрасывает LRU другого."""
+        self.worker.set('key', 'old')
+        self.assertEqual(self.other_worker.get('key'), 'old')
+        self.worker.set('key', 'new')
+        self.assertEqual(self.other_worker.get('key'), 'new')
+        self.worker.delete('key')
+        self.assertIsNone(self.other_worker.get('key'))
+
+    def test_threads_share_local_tier(self):
+        """Бэкенды потоков одного процесса делят LRU и видят записи
+        друг друга сразу, не дожидаясь чтения журнала."""
+        location = os.path.join(self.directory.name, 'threads.sqlite3')
+        params = {'OPTIONS': {'CHECK_INTERVAL': 60}}
+        thread_cache = TwoTierCache(location, params)
+        other_thread_cache = TwoTierCache(location, params)
+        self.assertIs(thread_cache.local, other_thread_cache.local)
+        thread_cache.set('key', 'old')
+        self.assertEqual(other_thread_cache.get('key'), 'old')
+        thread_cache.set('key', 'new')
+        self.assertEqual(other_thread_cache.get('key'), 'new')
+
+    def test_invalidation_drops_only_changed_keys(self):
+        """Чужая запись убирает из LRU только изменённый ключ."""
+        self.worker.set_many({'changed': 1, 'kept': 1})
+        self.assertEqual(self.other_worker.get_many(['changed', 'kept']),
+                         {'changed': 1, 'kept': 1})
+        self.worker.set('changed', 2)
+        self.assertEqual(self.other_worker.get('changed'), 2)
+        local = self.other_worker.local
+        self.assertIsNot(local.get(self.other_worker.make_key('kept')),
+                         MISSING)
+        self.worker.clear()
+        self.assertIsNone(self.other_worker.get('kept'))
+
+
+class QueryInspectionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(3)
+        ]
+        for author in cls.authors:
+            Post.objects.create(author=author, text='Пост')
+
+    def test_repeated_queries_reported_with_template_line(self):
+        """N+1 в шаблоне находится с номером строки шаблона."""
+        template = Template(
+            '{% for post in posts %}\n{{ post.author.username }}'
+            '{% endfor %}',
+            origin=Origin('posts.html', template_name='posts.html'),
+        )
+        posts = list(Post.objects.all())
+        with capture_queries() as log:
+            template.render(Context({'posts': posts}))
+        self.assertEqual(len(log), 3)
+        [(shape, count, places)] = log.repeated(3)
+        self.assertIn('auth_user', shape)
+        self.assertEqual(places, ['posts.html:2'])
+
+    def test_in_lists_share_shape(self):
+        """Списки IN разной длины считаются одной формой запроса."""
+        with capture_queries() as log:
+            for size in (1, 2, 3):
+                list(User.objects.filter(pk__in=range(size)))
+        self.assertEqual(len(log.repeated(3)), 1)
+
+    @override_settings(
+        QUERY_INSPECTION=True,
+        QUERY_BUDGET_STRICT=True,
+        QUERY_BUDGETS={'posts:index': 0},
+    )
+    def test_middleware_enforces_budget(self):
+        """В строгом режиме превышение бюджета — исключение."""
+        cache.clear()
+        with self.assertRaises(QueryBudgetExceeded):
+            Client().get(reverse('posts:index'))
+
+    @override_settings(QUERY_INSPECTION=True)
+    def test_middleware_reports_query_count(self):
+        """Число запросов отдаётся в заголовке X-Query-Count."""
+        cache.clear()
+        response = Client().get(reverse('posts:index'))
+        self.assertTrue(response['X-Query-Count'].isdigit())
+
+
+class SqlitePragmasTest(TestCase):
+    def test_pragmas_applied(self):
+        """Соединение с SQLite получает настройки SQLITE_PRAGMAS."""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            for name in ('busy_timeout', 'cache_size'):
+                cursor.execute(f'PRAGMA {name}')
+                with self.subTest(pragma=name):
+                    self.assertEqual(
+                        cursor.fetchone()[0], settings.SQLITE_PRAGMAS[name]
+                    )
+
+
+@override_settings(WRITE_RETRIES=2, WRITE_RETRY_BACKOFF=0)
+class SerializedWriteTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        self.request = RequestFactory().post('/create/')
+        self.calls = 0
+
+    def flaky_view(self, failures, error='database is locked'):
+        @serialized_write
+        def view(request):
+            self.calls += 1
+            Post.objects.create(author=self.author, text='Пост')
+            if self.calls <= failures:
+                raise OperationalError(error)
+            return HttpResponse('ok')
+        return view
+
+    def test_retries_locked_database(self):
+        """Запись повторяется, а неудачные попытки откатываются."""
+        response = self.flaky_view(failures=2)(self.request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertIn('write-lock;dur=', response['Server-Timing'])
+
+    def test_gives_up_with_503(self):
+        """Исчерпав попытки, вьюха отвечает 503 с Retry-After."""
+        with mock.patch('core.writes.time.sleep') as sleep:
+            response = self.flaky_view(failures=10)(self.request)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Post.objects.count(), 0)
+        # После последней попытки 503 отдаётся без паузы.
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_other_errors_not_retried(self):
+        """Прочие ошибки базы не повторяются."""
+        with self.assertRaises(OperationalError):
+            self.flaky_view(failures=1, error='no such table')(self.request)
+        self.assertEqual(self.calls, 1)
+
+
+class ReplicaRouterTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.seen = {}
+
+        @read_from_replica
+        def view(request):
+            self.seen['read'] = Post.objects.all().db
+            self.seen['etag'] = feed_etag(request)
+            return HttpResponse('ok')
+        self.view = view
+
+    def get(self, lag=0, age=0, **cookies):
+        """Запрос через реплику, снятую lag записей и age секунд назад."""
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.COOKIES.update(cookies)
+        cache.set(replica_generation_key('replica'), (
+            get_generation(FEED_PAGES) - lag, time.time() - age
+        ), None)
+        with mock.patch('core.routers.replica_aliases',
+                        return_value=['replica']):
+            return self.view(request)
+
+    def test_mirror_is_not_replica(self):
+        """Зеркало основной базы в тестах не выбирается репликой."""
+        cache.set(replica_generation_key('replica'), (1, time.time()))
+        self.assertEqual(choose_replica(), (None, None))
+
+    def test_reads_fresh_replica(self):
+        """Чтения GET-вьюхи идут на свежую реплику, записи — нет."""
+        self.get(age=60)
+        self.assertEqual(self.seen['read'], 'replica')
+        self.assertIsNotNone(self.seen['etag'])
+        self.assertEqual(Post.objects.all().db, 'default')
+        self.assertEqual(router.db_for_write(Post), 'default')
+
+    def test_recent_replica_tolerated(self):
+        """Недавно обновлённая реплика читается, даже пропустив запись,
+        но ETag страницы — по поколению реплики, а не текущему."""
+        self.get()
+        current = self.seen['etag']
+        self.get(lag=1)
+        self.assertEqual(self.seen['read'], 'replica')
+        self.assertNotEqual(self.seen['etag'], current)
+
+    def test_lagging_replica_skipped(self):
+        """Давно отставшая реплика не читается, страницы кэшируются."""
+        self.get(lag=1, age=60)
+        self.assertEqual(self.seen['read'], 'default')
+        self.assertIsNotNone(self.seen['etag'])
+
+    def test_pinned_after_write(self):
+        """После POST пользователь читает из основной базы."""
+        client = Client()
+        client.force_login(ReplicaRouterTest.author)
+        response = client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Комментарий'}
+        )
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.get(**{PIN_COOKIE: '1'})
+        self.assertEqual(self.seen['read'], 'default')
+
+
+class RefreshReplicaTest(TransactionTestCase):
+    def test_refresh_replica_command(self):
+        """refresh_replica копирует базу через backup API."""
+        author = User.objects.create_user(username='author')
+        Post.objects.create(author=author, text='Пост')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            call_command('refresh_replica', output=path, stdout=StringIO())
+            copy = sqlite3.connect(path)
+            count = copy.execute('SELECT COUNT(*) FROM posts_post').fetchone()
+            copy.close()
+        self.assertEqual(count[0], 1)
+
+
+class LoadReplayTest(TestCase):
+    def test_mix_and_summary(self):
+        """Смесь трафика разбирается, сводка считает ошибки и хвосты."""
+        self.assertEqual(
+            parse_mix('index=3,post=1.5'), {'index': 3.0, 'post': 1.5}
+        )
+        for mix in ('unknown=1', 'index=x', 'index=0'):
+            with self.subTest(mix=mix), self.assertRaises(CommandError):
+                parse_mix(mix)
+        results = [('index', 200, float(ms)) for ms in range(1, 99)]
+        results += [('post', 503, 200.0), ('post', 0, 300.0)]
+        report = summarize(results, 2)
+        self.assertEqual(report['throughput_rps'], 50)
+        self.assertEqual(report['error_rate'], 0.02)
+        self.assertEqual(report['statuses'], {'200': 98, '503': 1, '0': 1})
+        self.assertEqual(report['latency_ms']['p50_ms'], 50)
+        self.assertEqual(report['latency_ms']['p99_ms'], 200)
+        self.assertEqual(report['endpoints']['post']['errors'], 2)
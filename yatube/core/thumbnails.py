@@ -0,0 +1,30 @@
+from django.core.cache import caches
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.kvstores.base import KVStoreBase
+
+
+class KVStore(KVStoreBase):
+    """Хранилище sorl-thumbnail в кэше THUMBNAIL_CACHE, без таблицы.
+
+    Стандартное хранилище на промахе кэша читает базу по запросу на
+    каждую картинку и пишет туда же новые миниатюры: холодная лента
+    делала N+1. Здесь записи живут в постоянном TwoTierCache (LRU
+    процесса перед общим файлом); потерянная запись заводится заново
+    по уже лежащему файлу миниатюры.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.THUMBNAIL_CACHE]
+
+    def _get_raw(self, key):
+        return self.cache.get(key)
+
+    def _set_raw(self, key, value):
+        self.cache.set(key, value, None)
+
+    def _delete_raw(self, *keys):
+        self.cache.delete_many(keys)
+
+    def _find_keys_raw(self, prefix):
+        return self.cache.keys(prefix)
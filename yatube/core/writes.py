@@ -0,0 +1,106 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db import transaction
+from django.shortcuts import render
+
+logger = logging.getLogger(__name__)
+# Счётчики процесса: writes, retries, failures, lock_wait_ms.
+stats = Counter()
+
+# Повторный вход из того же потока (раскладка внутри записи вьюхи)
+# не должен ждать сам себя.
+_locks = defaultdict(threading.RLock)
+_locks_guard = threading.Lock()
+
+
+def writer_lock(using) -> threading.RLock:
+    with _locks_guard:
+        return _locks[using]
+
+
+def is_lock_error(error) -> bool:
+    return 'locked' in str(error)
+
+
+def backoff(attempt) -> float:
+    """Пауза перед повтором: случайная доля растущего окна."""
+    window = min(
+        settings.WRITE_RETRY_BACKOFF_MAX,
+        settings.WRITE_RETRY_BACKOFF * 2 ** attempt
+    )
+    return random.uniform(0, window)
+
+
+def run_serialized(write, using=DEFAULT_DB_ALIAS):
+    """Выполняет write() одной транзакцией в очереди писателей базы
+    using и возвращает результат. При «database is locked» повторяет,
+    как serialized_write, а исчерпав попытки, пробрасывает ошибку."""
+    for attempt in range(settings.WRITE_RETRIES + 1):
+        with writer_lock(using):
+            try:
+                with transaction.atomic(using=using):
+                    return write()
+            except OperationalError as error:
+                if not is_lock_error(error) or (
+                    attempt == settings.WRITE_RETRIES
+                ):
+                    raise
+                stats['retries'] += 1
+        time.sleep(backoff(attempt))
+
+
+def serialized_write(view=None, using=DEFAULT_DB_ALIAS, methods=None):
+    """Проводит запись вьюхи через очередь писателей базы using.
+
+    В процессе в базу пишет одна вьюха за раз; при «database is locked»
+    (запись из другого процесса) транзакция откатывается и вьюха
+    повторяется после паузы, а исчерпав WRITE_RETRIES попыток, отвечает
+    503 с Retry-After. methods — методы, которым нужна очередь (по
+    умолчанию все). Ожидание очереди уходит в заголовок Server-Timing.
+    """
+    if view is None:
+        return lambda view: serialized_write(view, using, methods)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if connections[using].vendor != 'sqlite' or (
+            methods is not None and request.method not in methods
+        ):
+            return view(request, *args, **kwargs)
+        waited = 0.0
+        for attempt in range(settings.WRITE_RETRIES + 1):
+            started = time.perf_counter()
+            with writer_lock(using):
+                waited += time.perf_counter() - started
+                try:
+                    with transaction.atomic(using=using):
+                        response = view(request, *args, **kwargs)
+                except OperationalError as error:
+                    if not is_lock_error(error):
+                        raise
+                    stats['retries'] += 1
+                    logger.warning(
+                        'База %s занята, попытка %d: %s',
+                        using, attempt + 1, request.path
+                    )
+                else:
+                    break
+            if attempt < settings.WRITE_RETRIES:
+                time.sleep(backoff(attempt))
+        else:
+            stats['failures'] += 1
+            response = render(request, 'core/500.html', status=503)
+            response['Retry-After'] = 1
+        waited_ms = waited * 1000
+        stats['writes'] += 1
+        stats['lock_wait_ms'] += waited_ms
+        response['Server-Timing'] = f'write-lock;dur={waited_ms:.1f}'
+        return response
+    return wrapper
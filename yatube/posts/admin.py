@@ -1,30 +1,154 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from . import bulk
 from .models import Post, Group, Comment, Follow
+from .paginators import EstimatedCountPaginator
+from .search import is_available, match_condition
 
 
-class PostAdmin(admin.ModelAdmin):
+class UsernameFilter(admin.SimpleListFilter):
+    """Фильтр по точному имени пользователя: поле ввода вместо списка
+    всех пользователей в боковой панели."""
+    template = 'admin/posts/username_filter.html'
+    field_name = None
+
+    def lookups(self, request, model_admin):
+        # Непустой список нужен, чтобы панель показала фильтр.
+        return [(None, '')]
+
+    def choices(self, changelist):
+        yield {
+            'parameter_name': self.parameter_name,
+            'value': self.value() or '',
+            'hidden': [
+                (name, value) for name, value in changelist.params.items()
+                if name not in (self.parameter_name, 'p')
+            ],
+        }
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(
+                **{f'{self.field_name}__username': self.value()}
+            )
+        return queryset
+
+
+class UserFilter(UsernameFilter):
+    title = 'пользователю'
+    parameter_name = 'user'
+    field_name = 'user'
+
+
+class AuthorFilter(UsernameFilter):
+    title = 'автору'
+    parameter_name = 'author'
+    field_name = 'author'
+
+
+class GroupActionForm(ActionForm):
+    group = forms.ModelChoiceField(
+        Group.objects.all(), required=False, label='Группа'
+    )
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Списки без точного COUNT(*) и без второго COUNT(*) всей таблицы.
+
+    Вместо delete_selected, удаляющего объекты по одному с сигналами,
+    — свои действия в posts.bulk.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class PostAdmin(ScalableAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group')
-    list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+    action_form = GroupActionForm
+    actions = ('move_to_group', 'delete_posts')
+
+    def move_to_group(self, request, queryset):
+        group_id = request.POST.get('group')
+        group = Group.objects.filter(pk=group_id).first() if group_id else None
+        if group is None:
+            self.message_user(
+                request, 'Выберите группу для переноса', messages.ERROR
+            )
+            return
+        moved = bulk.move_posts(queryset, group)
+        self.message_user(request, f'Перенесено в «{group}»: {moved}')
+    move_to_group.short_description = 'Перенести в группу'
+
+    def delete_posts(self, request, queryset):
+        deleted = bulk.delete_posts(queryset)
+        self.message_user(request, f'Удалено постов: {deleted}')
+    delete_posts.short_description = 'Удалить выбранные посты'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по FTS-индексу вместо LIKE '%...%' по всей таблице.
+        if not search_term or not is_available(queryset.db):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        condition, params = match_condition(search_term)
+        if not params[0]:
+            return queryset.none(), False
+        return queryset.extra(where=[condition], params=params), False
 
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('pk', 'title', 'slug', 'description')
-    search_fields = ('description',)
+    search_fields = ('title', 'description')
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdmin):
     list_display = ('pk', 'text', 'created', 'author', 'post')
+    list_select_related = ('author', 'post')
+    autocomplete_fields = ('author', 'post')
     search_fields = ('text',)
-    list_filter = ('created',)
+    list_filter = ('created', AuthorFilter)
+    # Порядок по id идёт по первичному ключу, без сортировки таблицы.
+    ordering = ('-pk',)
+    actions = ('delete_comments', 'purge_by_authors')
+
+    def delete_comments(self, request, queryset):
+        deleted = bulk.delete_comments(queryset)
+        self.message_user(request, f'Удалено комментариев: {deleted}')
+    delete_comments.short_description = 'Удалить выбранные комментарии'
 
+    def purge_by_authors(self, request, queryset):
+        authors = set(queryset.values_list('author_id', flat=True))
+        purged = bulk.purge_comments(authors)
+        self.message_user(request, f'Удалено комментариев: {purged}')
+    purge_by_authors.short_description = (
+        'Удалить все комментарии авторов выбранных'
+    )
 
-class FollowAdmin(admin.ModelAdmin):
+
+class FollowAdmin(ScalableAdmin):
     list_display = ('pk', 'user', 'author')
-    list_filter = ('user', 'author',)
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    list_filter = (UserFilter, AuthorFilter)
+    ordering = ('-pk',)
+    actions = ('remove_follows',)
+
+    def remove_follows(self, request, queryset):
+        removed = bulk.remove_follows(queryset)
+        self.message_user(request, f'Удалено подписок: {removed}')
+    remove_follows.short_description = 'Удалить выбранные подписки'
 
 
 admin.site.register(Post, PostAdmin)
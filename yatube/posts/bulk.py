@@ -0,0 +1,237 @@
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from core.db import chunks, last_ids
+from core.writes import run_serialized
+from . import caching, counters, feeds, shards, timelines
+from .models import Comment, FeedEntry, Follow, Post, PostKey
+
+
+def batches(queryset, fields, size=None):
+    """Строки выборки пачками по возрастанию pk: (pk, *fields).
+
+    Следующая пачка ищется по ключу после последнего pk, поэтому
+    изменение или удаление строк прошлой пачки не сбивает обход.
+    """
+    size = size or settings.BULK_BATCH_SIZE
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(page.values_list('pk', *fields)[:size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def move_posts(queryset, group) -> int:
+    """Переносит посты выборки в группу на всех шардах, одним UPDATE на
+    пачку."""
+    moved = 0
+    for alias in settings.POST_SHARDS:
+        posts = queryset.using(alias).exclude(group=group)
+        for rows in batches(posts, ('group_id',)):
+            left = Counter(group_id for _, group_id in rows)
+            deltas = {
+                counters.group_key(group_id): -count
+                for group_id, count in left.items() if group_id is not None
+            }
+            deltas[counters.group_key(group.pk)] = len(rows)
+
+            def write():
+                Post.objects.using(alias).filter(
+                    pk__in=[pk for pk, _ in rows]
+                ).update(group=group)
+                # Счётчики — в основной базе, своей записью в её очереди.
+                run_serialized(lambda: counters.change_counts(deltas))
+            run_serialized(write, alias)
+            caching.drop_generations([
+                caching.group_version(group_id)
+                for group_id in {*left, group.pk}
+            ])
+            caching.bump_generation(caching.FEED_PAGES)
+            moved += len(rows)
+    return moved
+
+
+def delete_posts(queryset) -> int:
+    """Удаляет посты выборки на всех шардах, одним DELETE на пачку.
+
+    Строки удаляются без сигналов, вместе с комментариями, записями в
+    лентах и ключами шардов; счётчики, ленты авторов и версии кэша
+    поправляются один раз на пачку.
+    """
+    deleted = 0
+    for alias in settings.POST_SHARDS:
+        for rows in batches(queryset.using(alias), ('author_id', 'group_id')):
+            post_ids = [pk for pk, _, _ in rows]
+            deltas = Counter(
+                key for _, author_id, group_id in rows
+                for key in counters.post_keys(author_id, group_id)
+            )
+
+            def forget():
+                FeedEntry.objects.filter(post_id__in=post_ids).delete()
+                if shards.is_sharded():
+                    PostKey.objects.filter(pk__in=post_ids).delete()
+                counters.change_counts(
+                    {key: -count for key, count in deltas.items()}
+                )
+
+            def write():
+                Comment.objects.using(alias).filter(
+                    post_id__in=post_ids
+                )._raw_delete(alias)
+                Post.objects.using(alias).filter(
+                    pk__in=post_ids
+                )._raw_delete(alias)
+                # Ленты, ключи и счётчики — в основной базе, своей
+                # записью в её очереди.
+                run_serialized(forget)
+            run_serialized(write, alias)
+            authors = {author_id for _, author_id, _ in rows}
+            timelines.invalidate_many(authors)
+            caching.drop_generations([
+                *(caching.post_version(post_id) for post_id in post_ids),
+                *(caching.author_version(author_id) for author_id in authors),
+            ])
+            caching.bump_generation(caching.FEED_PAGES)
+            deleted += len(rows)
+    return deleted
+
+
+def delete_comments(queryset) -> int:
+    """Удаляет комментарии выборки на всех шардах.
+
+    Строки удаляются без сигналов; Post.comment_count и версии постов
+    поправляются один раз на пачку.
+    """
+    purged = 0
+    for alias in settings.POST_SHARDS:
+        comments = queryset.using(alias)
+        for rows in batches(comments, ('post_id',)):
+            per_post = Counter(post_id for _, post_id in rows)
+
+            def write():
+                Comment.objects.using(alias).filter(
+                    pk__in=[pk for pk, _ in rows]
+                )._raw_delete(alias)
+                counters.change_comment_counts(
+                    {post_id: -count for post_id, count in per_post.items()},
+                    alias
+                )
+            run_serialized(write, alias)
+            caching.drop_generations(
+                [caching.post_version(post_id) for post_id in per_post]
+            )
+            caching.bump_generation(caching.FEED_PAGES)
+            purged += len(rows)
+    return purged
+
+
+def purge_comments(author_ids) -> int:
+    """Удаляет все комментарии авторов на всех шардах."""
+    return delete_comments(Comment.objects.filter(author_id__in=author_ids))
+
+
+def remove_follows(queryset) -> int:
+    """Удаляет подписки выборки и их записи в лентах, пачками."""
+    removed = 0
+    for rows in batches(queryset, ('user_id', 'author_id')):
+        readers = defaultdict(list)
+        for _, user_id, author_id in rows:
+            readers[author_id].append(user_id)
+
+        def write():
+            follows = Follow.objects.filter(pk__in=[pk for pk, _, _ in rows])
+            follows._raw_delete(follows.db)
+            for author_id, user_ids in readers.items():
+                FeedEntry.objects.filter(
+                    user_id__in=user_ids,
+                    post_id__in=shards.author_post_ids(author_id)
+                ).delete()
+        run_serialized(write)
+        caching.bump_generation(caching.FEED_PAGES)
+        removed += len(rows)
+    return removed
+
+
+def insert_raw(objs, using) -> None:
+    """Вставляет объекты одной модели со значениями полей как есть.
+
+    В отличие от bulk_create() не вызывает pre_save(), и auto_now_add
+    не заменяет даты из объектов текущим временем. Объекты без pk
+    получают новые id от базы, но в объекты они не возвращаются.
+    """
+    model = type(objs[0])
+    fields = model._meta.concrete_fields
+    for group, group_fields in (
+        ([obj for obj in objs if obj.pk is not None], fields),
+        ([obj for obj in objs if obj.pk is None],
+         [field for field in fields if not field.primary_key]),
+    ):
+        if not group:
+            continue
+        size = max(
+            connections[using].ops.bulk_batch_size(group_fields, group), 1
+        )
+        for chunk in chunks(group, size):
+            model.objects.using(using)._insert(
+                chunk, fields=group_fields, raw=True, using=using
+            )
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = using
+
+
+def insert_posts(posts) -> list:
+    """Сохраняет новые посты пачкой — с ключами шардов, счётчиками, лентами
+    подписчиков и сбросом кэшей, как save(), но без сигналов.
+
+    pub_date берётся из постов (пустая — текущее время), так что
+    перенесённые записи сохраняют даты. Основная база и шарды пишутся
+    во вложенных транзакциях и фиксируются вместе в конце.
+    """
+    if not posts:
+        return posts
+    now = timezone.now()
+    for post in posts:
+        post.pub_date = post.pub_date or now
+    by_shard = defaultdict(list)
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic())
+        if shards.is_sharded():
+            post_ids = shards.allocate_post_ids(
+                [post.author_id for post in posts]
+            )
+            for post, post_id in zip(posts, post_ids):
+                post.pk = post_id
+                by_shard[shards.shard_for(post.author_id)].append(post)
+            for alias, shard_posts in by_shard.items():
+                stack.enter_context(transaction.atomic(using=alias))
+                insert_raw(shard_posts, alias)
+        else:
+            insert_raw(posts, DEFAULT_DB_ALIAS)
+            post_ids = last_ids(
+                Post.objects.using(DEFAULT_DB_ALIAS), len(posts)
+            )
+            for post, post_id in zip(posts, post_ids):
+                post.pk = post_id
+        counters.change_counts(Counter(
+            key for post in posts
+            for key in counters.post_keys(post.author_id, post.group_id)
+        ))
+        feeds.fan_out_many(posts)
+    authors = {post.author_id for post in posts}
+    timelines.invalidate_many(authors)
+    # Версии самих постов не трогаем: их id выданы впервые.
+    caching.drop_generations(
+        [caching.author_version(author_id) for author_id in authors]
+    )
+    caching.bump_generation(caching.FEED_PAGES)
+    return posts
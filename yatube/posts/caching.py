@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import shards
+from .models import Post
+
+FEED_PAGES: str = 'feed_pages'
+
+logger = logging.getLogger(__name__)
+# Счётчики процесса: hit, stale, wait, rebuild, rebuild_ms, wait_ms.
+stats = Counter()
+
+
+def generation_key(namespace) -> str:
+    return f'generation:{namespace}'
+
+
+def get_generation(namespace) -> int:
+    """Текущее поколение кэша пространства имён.
+
+    Потерянный счётчик начинается с текущего времени в миллисекундах,
+    чтобы не совпасть с поколениями, записи которых ещё лежат в кэше.
+    """
+    key = generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_generations(*namespaces) -> list:
+    """Поколения нескольких пространств имён за один get_many."""
+    keys = [generation_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    return [
+        found[key] if key in found else get_generation(namespace)
+        for key, namespace in zip(keys, namespaces)
+    ]
+
+
+def bump_generation(namespace) -> None:
+    """Делает все записи пространства имён устаревшими."""
+    try:
+        cache.incr(generation_key(namespace))
+    except ValueError:
+        get_generation(namespace)
+
+
+def drop_generations(namespaces) -> None:
+    """Устаревание многих пространств имён одной записью в кэш.
+
+    Удалённое поколение заводится заново от текущего времени, то есть
+    больше прежнего — записи со старым поколением больше не подходят.
+    """
+    cache.delete_many([generation_key(namespace) for namespace in namespaces])
+
+
+def _bucket(request) -> str:
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return 'anon'
+
+
+def content_generation(request) -> int:
+    """Поколение лент, которому соответствуют данные запроса.
+
+    Страница, прочитанная с реплики, соответствует поколению реплики, а
+    не текущему.
+    """
+    replica_generation = getattr(request, 'replica_generation', None)
+    if replica_generation is not None:
+        return replica_generation
+    return get_generation(FEED_PAGES)
+
+
+def _etag(request, versions) -> str:
+    # CSRF-токен входит в ETag: формы из закэшированной у клиента
+    # страницы должны проходить проверку после смены токена.
+    raw = ':'.join([
+        _bucket(request),
+        request.META.get('CSRF_COOKIE', ''),
+        request.get_full_path(),
+        *map(str, versions),
+    ])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def feed_etag(request, *args, **kwargs) -> str:
+    """ETag лент: меняется с любым изменением постов, групп,
+    комментариев и подписок. Страница с реплики получает поколение
+    реплики: отставшая копия не должна закрепиться у клиента."""
+    return page_etag(request, content_generation(request))
+
+
+def page_etag(request, generation) -> str:
+    """ETag страницы, собранной при поколении лент generation."""
+    return _etag(request, [generation])
+
+
+def post_etag(request, post_id) -> str:
+    """ETag страницы поста по версиям поста, его автора и группы."""
+    post = Post.objects.using(shards.post_shard(post_id)).filter(
+        pk=post_id
+    ).values('author_id', 'group_id').first()
+    if post is None:
+        return None
+    return _etag(request, get_generations(
+        post_version(post_id),
+        author_version(post['author_id']),
+        group_version(post['group_id']),
+    ))
+
+
+def post_version(post_id) -> str:
+    return f'post:{post_id}'
+
+
+def author_version(author_id) -> str:
+    return f'author:{author_id}'
+
+
+def group_version(group_id) -> str:
+    return f'group:{group_id}'
+
+
+def page_key(request, namespace) -> str:
+    """Ключ страницы: общий для всех анонимов и для всех вошедших."""
+    bucket = 'auth' if request.user.is_authenticated else 'anon'
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page:{namespace}:{bucket}:{path}'
+
+
+def _from_entry(entry, generation) -> HttpResponse:
+    response = HttpResponse(
+        entry['content'],
+        content_type=entry['content_type'],
+        status=entry['status'],
+    )
+    response.page_cached = True
+    # Поколение, при котором собрана страница, для ETag; у устаревшей
+    # копии его нет — она не должна закрепиться у клиента.
+    response.page_generation = None
+    if _is_fresh(entry, generation):
+        response.page_generation = entry['generation']
+    return response
+
+
+def _is_fresh(entry, generation) -> bool:
+    return (
+        entry['generation'] == generation
+        and entry['fresh_until'] > time.time()
+    )
+
+
+def _rebuild(build, storable, key, generation):
+    started = time.perf_counter()
+    response = build()
+    # Страница с отставшей реплики хранится под её поколением, то есть
+    # устаревшей.
+    generation = getattr(response, 'content_generation', generation)
+    if storable(response):
+        cache.set(key, {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'status': response.status_code,
+            'generation': generation,
+            'fresh_until': time.time() + settings.FEED_CACHE_FRESH,
+        }, settings.PAGE_CACHE_TIMEOUT)
+        response.page_cached = True
+        response.page_generation = generation
+    elapsed = (time.perf_counter() - started) * 1000
+    stats['rebuild'] += 1
+    stats['rebuild_ms'] += elapsed
+    logger.info('Пересобрана страница %s за %.1f мс', key, elapsed)
+    return response
+
+
+def serve_cached(key, generation, build, storable):
+    """Отдаёт страницу из кэша с защитой от лавины промахов.
+
+    Пересобирает страницу через build() только запрос, взявший
+    блокировку в кэше; остальные получают устаревшую копию или ждут
+    свежую. storable(response) решает, можно ли сохранить ответ, а
+    response.content_generation, если есть, — поколение его данных.
+    """
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry, generation):
+        stats['hit'] += 1
+        return _from_entry(entry, generation)
+
+    lock_key = f'lock:{key}'
+    if cache.add(lock_key, 1, settings.FEED_CACHE_LOCK_TIMEOUT):
+        try:
+            return _rebuild(build, storable, key, generation)
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        stats['stale'] += 1
+        logger.info('Отдана устаревшая копия %s', key)
+        return _from_entry(entry, generation)
+
+    started = time.perf_counter()
+    deadline = time.time() + settings.FEED_CACHE_LOCK_WAIT
+    while time.time() < deadline and cache.get(lock_key):
+        time.sleep(0.05)
+    entry = cache.get(key)
+    elapsed = (time.perf_counter() - started) * 1000
+    stats['wait'] += 1
+    stats['wait_ms'] += elapsed
+    logger.info('Ожидание блокировки %s: %.1f мс', key, elapsed)
+    if entry is not None:
+        return _from_entry(entry, generation)
+    return build()
@@ -0,0 +1,172 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Counter, Post
+
+POSTS_KEY: str = 'posts'
+
+
+def author_key(author_id) -> str:
+    return f'posts:author:{author_id}'
+
+
+def group_key(group_id) -> str:
+    return f'posts:group:{group_id}'
+
+
+def post_keys(author_id, group_id) -> list:
+    """Счётчики, в которые входит пост с таким автором и группой."""
+    keys = [POSTS_KEY, author_key(author_id)]
+    if group_id is not None:
+        keys.append(group_key(group_id))
+    return keys
+
+
+def get_count(key, queryset) -> int:
+    """Читает счётчик; отсутствующий заполняется одним COUNT(*)."""
+    values = Counter.objects.filter(name=key).values_list('value', flat=True)
+    value = values.first()
+    if value is None:
+        # Считаем по основной базе: отставшая реплика заложила бы
+        # в счётчик неверное начало.
+        if queryset.db in settings.DATABASE_REPLICAS:
+            queryset = queryset.using(router.db_for_write(queryset.model))
+        fill_count(key, queryset)
+        # Читаем оттуда, куда записали: реплика строки ещё не видит.
+        value = values.using(router.db_for_write(Counter)).first()
+    return value
+
+
+def fill_count(key, queryset) -> None:
+    """Заводит счётчик key с числом строк queryset, если его ещё нет.
+
+    В одной базе счёт и вставка — один INSERT ... SELECT: пост,
+    записанный до него, посчитан, а после — найдёт строку своим
+    change_count. Строки с другого шарда пересчитываются после вставки:
+    так теряются только посты, записанные между пересчётом и их
+    change_count.
+    """
+    queryset = queryset.order_by()
+    using = router.db_for_write(Counter)
+    if queryset.db == using:
+        connection = connections[using]
+        table = connection.ops.quote_name(Counter._meta.db_table)
+        rows_sql, params = queryset.values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (name, value) '
+                f'SELECT %s, COUNT(*) FROM ({rows_sql}) '
+                f'WHERE true ON CONFLICT (name) DO NOTHING',
+                [key, *params]
+            )
+        return
+    _, created = Counter.objects.get_or_create(
+        name=key, defaults={'value': queryset.count()}
+    )
+    if created:
+        Counter.objects.filter(name=key).update(value=queryset.count())
+
+
+def change_count(keys, delta) -> None:
+    """Сдвигает уже заведённые счётчики одним UPDATE."""
+    if keys and delta:
+        Counter.objects.filter(name__in=keys).update(
+            value=F('value') + delta
+        )
+
+
+def change_counts(deltas) -> None:
+    """Сдвигает много счётчиков: {ключ: delta}, по UPDATE на каждое
+    различное значение сдвига."""
+    by_delta = defaultdict(list)
+    for key, delta in deltas.items():
+        by_delta[delta].append(key)
+    for delta, keys in by_delta.items():
+        change_count(keys, delta)
+
+
+def drop_count(key) -> None:
+    Counter.objects.filter(name=key).delete()
+
+
+def rebuild_counts() -> int:
+    """Пересчитывает все счётчики постов с нуля, суммируя шарды."""
+    totals = defaultdict(int)
+    for alias in settings.POST_SHARDS:
+        posts = Post.objects.using(alias)
+        totals[POSTS_KEY] += posts.count()
+        by_author = posts.order_by().values('author').annotate(
+            total=Count('id')
+        )
+        for row in by_author:
+            totals[author_key(row['author'])] += row['total']
+        by_group = posts.filter(group__isnull=False).order_by().values(
+            'group'
+        ).annotate(total=Count('id'))
+        for row in by_group:
+            totals[group_key(row['group'])] += row['total']
+    counters = [Counter(name=name, value=value)
+                for name, value in totals.items()]
+    with transaction.atomic():
+        Counter.objects.filter(name__startswith=POSTS_KEY).delete()
+        Counter.objects.bulk_create(counters)
+    return len(counters)
+
+
+def change_comment_count(post_id, delta, using=None) -> None:
+    """Сдвигает Post.comment_count одним UPDATE без чтения строки.
+
+    using — база (шард), где лежит пост. Разошедшийся счётчик не уходит
+    ниже нуля: его поправит reconcile_comment_counts().
+    """
+    Post.objects.using(using).filter(pk=post_id).update(
+        comment_count=Greatest(F('comment_count') + delta, 0)
+    )
+
+
+def change_comment_counts(deltas, using=None) -> None:
+    """Сдвигает comment_count многих постов: {post_id: delta}.
+
+    Один UPDATE на каждое различное значение сдвига.
+    """
+    by_delta = defaultdict(list)
+    for post_id, delta in deltas.items():
+        by_delta[delta].append(post_id)
+    for delta, post_ids in by_delta.items():
+        Post.objects.using(using).filter(pk__in=post_ids).update(
+            comment_count=Greatest(F('comment_count') + delta, 0)
+        )
+
+
+def actual_comment_counts(using=None):
+    """Посты с настоящим числом комментариев в поле actual."""
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values(
+        'post'
+    ).annotate(total=Count('id')).values('total')
+    return Post.objects.using(using).order_by().annotate(
+        actual=Coalesce(Subquery(comments), 0)
+    )
+
+
+def reconcile_comment_counts(batch_size=1000) -> int:
+    """Исправляет разошедшиеся Post.comment_count на всех шардах,
+    вернёт их число."""
+    total = 0
+    for alias in settings.POST_SHARDS:
+        drifted = actual_comment_counts(alias).exclude(
+            comment_count=F('actual')
+        ).values_list('pk', 'actual')
+        posts = [
+            Post(pk=pk, comment_count=actual)
+            for pk, actual in drifted.iterator()
+        ]
+        with transaction.atomic(using=alias):
+            Post.objects.using(alias).bulk_update(
+                posts, ['comment_count'], batch_size=batch_size
+            )
+        total += len(posts)
+    return total
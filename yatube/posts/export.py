@@ -0,0 +1,125 @@
+import csv
+import json
+import zlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.db import chunks
+from . import shards
+from .models import Comment, Follow, Group, Post, User
+
+FORMATS = ('jsonl', 'csv')
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+# Столбцы выгрузки. author и user — имена пользователей, group — slug:
+# выгрузку постов принимает import_posts.
+FIELDS = {
+    'posts': ('id', 'author', 'group', 'text', 'pub_date', 'comment_count'),
+    'comments': ('id', 'post', 'author', 'text', 'created'),
+    'follows': ('id', 'user', 'author'),
+}
+KINDS = tuple(FIELDS)
+USER_COLUMNS = {'posts': (1,), 'comments': (2,), 'follows': (1, 2)}
+
+
+def _sources(kind, user_id=None) -> list:
+    """Выборки строк по базам: посты и комментарии — по шардам."""
+    if kind == 'follows':
+        follows = Follow.objects.all()
+        if user_id is not None:
+            follows = follows.filter(user_id=user_id)
+        return [follows.order_by('pk').values_list(
+            'id', 'user_id', 'author_id'
+        )]
+    if kind == 'posts':
+        aliases = settings.POST_SHARDS
+        if user_id is not None:
+            aliases = [shards.shard_for(user_id)]
+        querysets = [Post.objects.using(alias) for alias in aliases]
+        fields = ('id', 'author_id', 'group_id', 'text', 'pub_date',
+                  'comment_count')
+    else:
+        querysets = [
+            Comment.objects.using(alias) for alias in settings.POST_SHARDS
+        ]
+        fields = ('id', 'post_id', 'author_id', 'text', 'created')
+    if user_id is not None:
+        querysets = [
+            queryset.filter(author_id=user_id) for queryset in querysets
+        ]
+    return [queryset.order_by('pk').values_list(*fields)
+            for queryset in querysets]
+
+
+def rows(kind, user_id=None, chunk_size=None):
+    """Строки выгрузки пачками по chunk_size, столбцы — FIELDS[kind].
+
+    Строки читаются курсором (iterator), а имена пользователей для
+    пачки — одним запросом, так что память не растёт с объёмом.
+    """
+    size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    columns = USER_COLUMNS[kind]
+    groups = {}
+    if kind == 'posts':
+        groups = dict(Group.objects.values_list('pk', 'slug'))
+    for queryset in _sources(kind, user_id):
+        for chunk in chunks(queryset.iterator(chunk_size=size), size):
+            names = dict(User.objects.filter(pk__in={
+                row[column] for row in chunk for column in columns
+            }).values_list('pk', 'username'))
+            resolved = []
+            for row in chunk:
+                row = list(row)
+                for column in columns:
+                    row[column] = names.get(row[column])
+                if kind == 'posts':
+                    row[2] = groups.get(row[2])
+                resolved.append(row)
+            yield resolved
+
+
+def _jsonl(kind, chunks):
+    fields = FIELDS[kind]
+    for chunk in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder,
+                       ensure_ascii=False) + '\n'
+            for row in chunk
+        )
+
+
+class _Echo:
+    """Файл для csv.writer, который просто отдаёт строку."""
+
+    def write(self, value):
+        return value
+
+
+def _csv(kind, chunks):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS[kind])
+    for chunk in chunks:
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def _gzipped(parts):
+    """Сжатие gzip на лету. Каждая часть сбрасывается из компрессора
+    сразу, чтобы клиент получал данные, не дожидаясь конца выгрузки."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for part in parts:
+        yield compressor.compress(part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream(kind, output_format='jsonl', compress=False, user_id=None,
+           chunk_size=None):
+    """Выгрузка kind в байтах, по части на пачку строк."""
+    serialize = _csv if output_format == 'csv' else _jsonl
+    parts = (
+        text.encode()
+        for text in serialize(kind, rows(kind, user_id, chunk_size))
+    )
+    return _gzipped(parts) if compress else parts
+
+
+def filename(kind, output_format, compress) -> str:
+    return f'{kind}.{output_format}' + ('.gz' if compress else '')
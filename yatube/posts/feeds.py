@@ -0,0 +1,165 @@
+import logging
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from core.db import chunks
+from core.writes import run_serialized
+from . import shards
+from .models import FeedEntry, Follow, PendingFanOut, Post
+
+AUTHORS_PER_QUERY: int = 500
+
+logger = logging.getLogger(__name__)
+# Посты, ждущие раскладки в фоне: (id, автор, дата публикации).
+_pending = queue.Queue()
+_worker = None
+_worker_guard = threading.Lock()
+
+
+def _write(entries) -> None:
+    # Каждая пачка — своя короткая запись в очереди писателей.
+    run_serialized(lambda: FeedEntry.objects.bulk_create(
+        entries, ignore_conflicts=True
+    ))
+
+
+def fan_out(post_id, author_id, pub_date) -> None:
+    """Раскладывает новый пост в ленты подписчиков пачками."""
+    size = settings.FEED_FANOUT_BATCH_SIZE
+    followers = Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True
+    ).iterator(chunk_size=size)
+    for batch in chunks(followers, size):
+        _write([
+            FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for user_id in batch
+        ])
+
+
+def fan_out_many(posts) -> None:
+    """Раскладывает в ленты много постов: подписчики их авторов
+    читаются одним запросом на AUTHORS_PER_QUERY авторов."""
+    size = settings.FEED_FANOUT_BATCH_SIZE
+    by_author = defaultdict(list)
+    for post in posts:
+        by_author[post.author_id].append((post.pk, post.pub_date))
+    for authors in chunks(by_author, AUTHORS_PER_QUERY):
+        follows = Follow.objects.filter(
+            author_id__in=authors
+        ).values_list('author_id', 'user_id').iterator(chunk_size=size)
+        entries = (
+            FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for author_id, user_id in follows
+            for post_id, pub_date in by_author[author_id]
+        )
+        for batch in chunks(entries, size):
+            _write(batch)
+
+
+def _fan_out_marked(post_id, author_id, pub_date) -> None:
+    fan_out(post_id, author_id, pub_date)
+    run_serialized(
+        lambda: PendingFanOut.objects.filter(post_id=post_id).delete()
+    )
+
+
+def _work() -> None:
+    while True:
+        args = _pending.get()
+        try:
+            _fan_out_marked(*args)
+        except Exception:
+            logger.exception('Пост %s не разложен по лентам', args[0])
+        finally:
+            close_old_connections()
+            _pending.task_done()
+
+
+def _enqueue(args) -> None:
+    global _worker
+    with _worker_guard:
+        # После fork() поток родителя в ребёнке не работает.
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_work, name='fan-out', daemon=True
+            )
+            _worker.start()
+    _pending.put(args)
+
+
+def wait_for_fan_out() -> None:
+    """Ждёт, пока фоновый поток разложит все поставленные посты."""
+    _pending.join()
+
+
+def schedule_fan_out(post) -> None:
+    """Раскладывает пост по лентам после коммита, в фоновом потоке
+    процесса: запись поста не ждёт подписчиков и не держит очередь
+    писателей. Без FEED_FANOUT_ASYNC — сразу, в той же транзакции.
+
+    Очередь живёт в памяти процесса, поэтому пост ещё и отмечается
+    строкой PendingFanOut: не разложенные к остановке процесса посты
+    раскладывает fan_out_pending().
+    """
+    args = (post.pk, post.author_id, post.pub_date)
+    if not settings.FEED_FANOUT_ASYNC:
+        fan_out(*args)
+        return
+    PendingFanOut.objects.create(
+        post_id=post.pk, author_id=post.author_id, pub_date=post.pub_date
+    )
+    transaction.on_commit(lambda: _enqueue(args))
+
+
+def fan_out_pending() -> int:
+    """Раскладывает посты, отмеченные PendingFanOut, и снимает отметки.
+
+    Отметки постов, которых нет (транзакция поста откатилась), просто
+    снимаются. Вернёт число разложенных постов.
+    """
+    done = 0
+    pending = PendingFanOut.objects.order_by('pk').values_list(
+        'post_id', 'author_id', 'pub_date'
+    )
+    # Обработанные отметки удаляются, так что каждый раз — первые.
+    while True:
+        rows = list(pending[:settings.FEED_FANOUT_BATCH_SIZE])
+        if not rows:
+            return done
+        for post_id, author_id, pub_date in rows:
+            if Post.objects.using(shards.shard_for(author_id)).filter(
+                pk=post_id
+            ).exists():
+                fan_out(post_id, author_id, pub_date)
+                done += 1
+        run_serialized(lambda: PendingFanOut.objects.filter(
+            post_id__in=[row[0] for row in rows]
+        ).delete())
+
+
+def backfill(user_id, author_id) -> None:
+    """Добавляет в ленту подписчика последние TIMELINE_LENGTH
+    опубликованных постов автора."""
+    size = settings.FEED_FANOUT_BATCH_SIZE
+    posts = Post.objects.using(shards.shard_for(author_id)).filter(
+        author_id=author_id
+    ).order_by('-pub_date', '-id').values_list(
+        'id', 'pub_date'
+    )[:settings.TIMELINE_LENGTH]
+    for batch in chunks(posts, size):
+        _write([
+            FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in batch
+        ])
+
+
+def trim(user_id, author_id) -> None:
+    """Убирает посты автора из ленты отписавшегося пользователя."""
+    FeedEntry.objects.filter(
+        user_id=user_id,
+        post_id__in=shards.author_post_ids(author_id)
+    ).delete()
@@ -0,0 +1,33 @@
+from core import holes
+
+from .forms import CommentForm
+from .models import Follow
+
+
+def follow_context(request, username) -> dict:
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user,
+        author__username=username
+    ).exists()
+    return {'username': username, 'following': following}
+
+
+def comment_form_context(request, post_id) -> dict:
+    return {'post_id': post_id, 'form': CommentForm()}
+
+
+def edit_link_context(request, post_id, author_id) -> dict:
+    return {
+        'post_id': post_id,
+        'is_author': str(request.user.pk) == str(author_id),
+    }
+
+
+holes.register('header_user', 'includes/holes/header_user.html')
+holes.register(
+    'follow_button', 'posts/holes/follow_button.html', follow_context
+)
+holes.register(
+    'comment_form', 'posts/holes/comment_form.html', comment_form_context
+)
+holes.register('edit_link', 'posts/holes/edit_link.html', edit_link_context)
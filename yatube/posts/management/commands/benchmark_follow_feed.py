@@ -0,0 +1,103 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.test import RequestFactory
+
+from posts.models import FeedEntry, Follow, Post
+from posts.views import (get_fanout_page, get_merged_page,
+                         number_of_last_records)
+
+User = get_user_model()
+
+
+def join_page(request):
+    post_list = Post.objects.filter(author__following__user=request.user)
+    paginator = Paginator(post_list, number_of_last_records)
+    return paginator.get_page(None)
+
+
+def merge_cold_page(request):
+    cache.clear()
+    return get_merged_page(request)
+
+
+ENGINES = {
+    'join': join_page,
+    'fanout': get_fanout_page,
+    'merge (cold)': merge_cold_page,
+    'merge (warm)': get_merged_page,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает движки ленты подписок с запросом через JOIN. '
+        'Данные создаются во временной транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--follows', type=int, nargs='+', default=[10, 1000, 10000]
+        )
+        parser.add_argument('--posts-per-author', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def populate(self, follows, posts_per_author):
+        prefix = f'bench_feed_{follows}_'
+        reader = User.objects.create_user(username=prefix + 'reader')
+        User.objects.bulk_create(
+            [User(username=f'{prefix}{i}') for i in range(follows)]
+        )
+        authors = list(User.objects.filter(
+            username__startswith=prefix
+        ).exclude(pk=reader.pk).values_list('pk', flat=True))
+        Post.objects.bulk_create(
+            [Post(author_id=author_id, text=f'Пост {i}')
+             for author_id in authors for i in range(posts_per_author)]
+        )
+        Follow.objects.bulk_create(
+            [Follow(user=reader, author_id=author_id)
+             for author_id in authors]
+        )
+        followed = Post.objects.filter(author_id__in=authors).values_list(
+            'id', 'pub_date'
+        )
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user=reader, post_id=post_id, pub_date=pub_date)
+             for post_id, pub_date in followed.iterator()]
+        )
+        return reader
+
+    def measure(self, request, engine, repeat) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(engine(request))
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            'follows'.ljust(10)
+            + ''.join(name.rjust(16) for name in ENGINES)
+        )
+        for follows in options['follows']:
+            with transaction.atomic():
+                reader = self.populate(follows, options['posts_per_author'])
+                request = RequestFactory().get('/follow/')
+                request.user = reader
+                results = [
+                    self.measure(request, engine, options['repeat'])
+                    for engine in ENGINES.values()
+                ]
+                transaction.set_rollback(True)
+            self.stdout.write(
+                str(follows).ljust(10)
+                + ''.join(f'{ms:13.2f} ms' for ms in results)
+            )
+        cache.clear()
@@ -0,0 +1,265 @@
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (override_settings, setup_databases,
+                               teardown_databases)
+from django.urls import reverse
+
+from core.benchmarks import percentile, timed_settings
+from core.queries import capture_queries
+from posts import feeds
+from posts.models import Follow, Post, User
+
+VIEWS = (
+    'index', 'group_posts', 'profile', 'post_detail', 'follow_index',
+    'post_create', 'add_comment',
+)
+PERCENTILES = (50, 95, 99)
+# Запросы и память снимаются отдельным проходом: перехват запросов и
+# tracemalloc сами замедляют запрос и испортили бы задержки.
+INSPECTED_REQUESTS: int = 5
+
+
+def compare(baseline, results, threshold) -> list:
+    """Регрессии results относительно baseline: рост задержки и памяти
+    больше чем в 1 + threshold раз, любой рост числа запросов."""
+    regressions = []
+    for scale, views in results['results'].items():
+        for view, metrics in views.items():
+            before = baseline['results'].get(scale, {}).get(view, {})
+            for metric, value in metrics.items():
+                old = before.get(metric)
+                if old is None:
+                    continue
+                limit = old if metric == 'queries' else old * (1 + threshold)
+                if value > limit:
+                    regressions.append(
+                        f'{view} на {scale} постов, {metric}: {old} → {value}'
+                    )
+    return regressions
+
+
+def used_databases() -> set:
+    return {DEFAULT_DB_ALIAS, *settings.POST_SHARDS}
+
+
+@contextmanager
+def throwaway_databases(directory):
+    """Пустые базы с миграциями вместо default и шардов на время блока.
+
+    Как у тестов, но SQLite лежит файлами в directory, а не в памяти:
+    записи в замере фиксируются с настоящим коммитом. Реплики-зеркала
+    смотрят в копию default.
+    """
+    names = {}
+    for alias in used_databases():
+        test = connections[alias].settings_dict['TEST']
+        if connections[alias].vendor == 'sqlite':
+            names[alias] = test['NAME']
+            test['NAME'] = os.path.join(directory, f'{alias}.sqlite3')
+    try:
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=used_databases()
+        )
+        try:
+            yield
+        finally:
+            # Фоновая раскладка не должна писать в базу после подмены.
+            feeds.wait_for_fan_out()
+            teardown_databases(old_config, verbosity=0)
+    finally:
+        for alias, name in names.items():
+            connections[alias].settings_dict['TEST']['NAME'] = name
+
+
+def throwaway_caches(directory):
+    """Кэши в файлах directory: замер и --cold не трогают кэш сайта."""
+    return override_settings(CACHES={
+        alias: {
+            **config,
+            'LOCATION': os.path.join(directory, f'{alias}.cache.sqlite3'),
+        }
+        for alias, config in settings.CACHES.items()
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет вьюхи постов через тестовый клиент на данных seed '
+        'разного объёма: p50/p95/p99 задержки, число запросов и пик '
+        'выделенной памяти, в JSON. Данные засеваются во временные '
+        'базы, кэш тоже временный: настоящие не меняются. С --compare '
+        'ищет регрессии относительно сохранённого результата.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', type=int, nargs='+', default=[1000, 10000],
+            help='Число постов в наборах данных'
+        )
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--views', nargs='+', choices=VIEWS)
+        parser.add_argument('--output', help='Файл для JSON')
+        parser.add_argument(
+            '--compare', metavar='BASELINE',
+            help='JSON прошлого замера для поиска регрессий'
+        )
+        parser.add_argument('--threshold', type=float, default=0.25)
+
+    def handle(self, *args, **options):
+        self.options = options
+        results = {
+            'meta': {
+                'requests': options['requests'],
+                'cold': options['cold'],
+                'seed': options['seed'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'results': {},
+        }
+        # Клиент создаётся в targets(), уже при timed_settings().
+        with tempfile.TemporaryDirectory() as directory, throwaway_caches(
+            directory
+        ), throwaway_databases(directory), timed_settings():
+            for scale in options['scales']:
+                self.stderr.write(f'Данные на {scale} постов…')
+                self.reset()
+                call_command(
+                    'seed', posts=scale, users=max(scale // 10, 10),
+                    comments=scale, follows=scale, seed=options['seed'],
+                    stdout=StringIO()
+                )
+                results['results'][str(scale)] = self.measure_views()
+        report = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
+        if options['compare']:
+            with open(options['compare']) as source:
+                baseline = json.load(source)
+            regressions = compare(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Регрессии:\n' + '\n'.join(regressions)
+                )
+            self.stderr.write(self.style.SUCCESS('Регрессий нет'))
+
+    def reset(self):
+        """Пустые базы и кэш перед очередным набором данных."""
+        feeds.wait_for_fan_out()
+        for alias in used_databases():
+            call_command(
+                'flush', database=alias, interactive=False, verbosity=0
+            )
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def targets(self) -> dict:
+        """Запросы к вьюхам на засеянных данных: функция номера запроса
+        возвращает ответ."""
+        # Отдельным запросом: в подзапросе Django сгруппировал бы и по id
+        # подписки и вернул его вместо пользователя.
+        reader_id = Follow.objects.values('user').annotate(
+            total=Count('id')
+        ).order_by('-total').values_list('user', flat=True)[0]
+        author = Post.objects.values('author').annotate(
+            total=Count('id')
+        ).order_by('-total').values_list('author__username', flat=True)
+        group = Post.objects.filter(group__isnull=False).values(
+            'group'
+        ).annotate(total=Count('id')).order_by('-total').values_list(
+            'group__slug', flat=True
+        )
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        random.Random(self.options['seed']).shuffle(post_ids)
+        self.client = Client()
+        self.client.force_login(User.objects.get(pk=reader_id))
+        get = self.client.get
+
+        def any_post(number):
+            return post_ids[number % len(post_ids)]
+
+        return {
+            'index': lambda number: get(reverse('posts:index')),
+            'group_posts': lambda number: get(reverse(
+                'posts:group_list', kwargs={'slug': group[0]}
+            )),
+            'profile': lambda number: get(reverse(
+                'posts:profile', kwargs={'username': author[0]}
+            )),
+            'post_detail': lambda number: get(reverse(
+                'posts:post_detail', kwargs={'post_id': any_post(number)}
+            )),
+            'follow_index': lambda number: get(reverse('posts:follow_index')),
+            'post_create': lambda number: self.client.post(
+                reverse('posts:post_create'), {'text': f'Замер {number}'}
+            ),
+            'add_comment': lambda number: self.client.post(reverse(
+                'posts:add_comment', kwargs={'post_id': any_post(number)}
+            ), {'text': f'Замер {number}'}),
+        }
+
+    def request(self, view, send, number):
+        if self.options['cold']:
+            cache.clear()
+        response = send(number)
+        if response.status_code >= 400:
+            raise CommandError(f'{view}: ответ {response.status_code}')
+
+    def measure_views(self) -> dict:
+        targets = self.targets()
+        measured = {}
+        for view in self.options['views'] or VIEWS:
+            send = targets[view]
+            for number in range(self.options['warmup']):
+                self.request(view, send, number)
+            timings = []
+            for number in range(self.options['requests']):
+                started = time.perf_counter()
+                self.request(view, send, number)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries, peaks = [], []
+            for number in range(INSPECTED_REQUESTS):
+                tracemalloc.start()
+                with capture_queries() as log:
+                    self.request(view, send, number)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                queries.append(len(log))
+            measured[view] = {
+                **{
+                    f'p{percent}_ms': round(percentile(timings, percent), 3)
+                    for percent in PERCENTILES
+                },
+                'queries': max(queries),
+                'memory_kb': round(max(peaks) / 1024, 1),
+            }
+            self.stderr.write(
+                f'  {view}: p95 {measured[view]["p95_ms"]} мс, '
+                f'{measured[view]["queries"]} запросов'
+            )
+        return measured
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import caching
+from posts.bulk import batches
+from posts.models import Comment, FeedEntry, Group, Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Ищет посты, комментарии и записи лент, ссылающиеся на удалённых '
+        'авторов, группы и посты: у этих ссылок нет ограничений базы. '
+        'С --fix удаляет такие строки, а у постов с удалённой группой '
+        'убирает группу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true', help='Исправить найденное'
+        )
+
+    def handle(self, *args, **options):
+        self.fix = options['fix']
+        self.users = set(
+            User.objects.values_list('pk', flat=True).iterator()
+        )
+        self.groups = set(
+            Group.objects.values_list('pk', flat=True).iterator()
+        )
+        self.found = {'posts': 0, 'groups': 0, 'comments': 0, 'feeds': 0}
+        for alias in settings.POST_SHARDS:
+            self.check_posts(alias)
+            self.check_comments(alias)
+        self.check_feeds()
+        if self.fix and any(self.found.values()):
+            caching.bump_generation(caching.FEED_PAGES)
+        self.stdout.write(
+            f'Посты без автора: {self.found["posts"]}, '
+            f'с удалённой группой: {self.found["groups"]}, '
+            f'комментарии без автора: {self.found["comments"]}, '
+            f'записи лент без поста: {self.found["feeds"]}'
+        )
+        if self.fix:
+            self.stdout.write(self.style.SUCCESS('Исправлено'))
+
+    def check_posts(self, alias):
+        posts = Post.objects.using(alias)
+        for rows in batches(posts, ('author_id', 'group_id')):
+            orphans = [
+                pk for pk, author_id, _ in rows if author_id not in self.users
+            ]
+            ungrouped = [
+                pk for pk, _, group_id in rows
+                if group_id is not None and group_id not in self.groups
+            ]
+            self.found['posts'] += len(orphans)
+            self.found['groups'] += len(ungrouped)
+            if self.fix:
+                posts.filter(pk__in=orphans).delete()
+                posts.filter(pk__in=ungrouped).update(group=None)
+
+    def check_comments(self, alias):
+        comments = Comment.objects.using(alias)
+        for rows in batches(comments, ('author_id',)):
+            orphans = [
+                pk for pk, author_id in rows if author_id not in self.users
+            ]
+            self.found['comments'] += len(orphans)
+            if self.fix:
+                comments.filter(pk__in=orphans).delete()
+
+    def check_feeds(self):
+        for rows in batches(FeedEntry.objects.all(), ('post_id',)):
+            missing = {post_id for _, post_id in rows}
+            for alias in settings.POST_SHARDS:
+                missing -= set(Post.objects.using(alias).filter(
+                    pk__in=missing
+                ).values_list('pk', flat=True))
+            orphans = [pk for pk, post_id in rows if post_id in missing]
+            self.found['feeds'] += len(orphans)
+            if self.fix:
+                FeedEntry.objects.filter(pk__in=orphans).delete()
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает посты, комментарии или подписки всего сайта либо '
+        'одного пользователя в JSONL или CSV, потоком.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=export.KINDS)
+        parser.add_argument('--user', help='Только данные пользователя')
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='jsonl'
+        )
+        parser.add_argument(
+            '--gzip', action='store_true', help='Сжать выгрузку gzip'
+        )
+        parser.add_argument(
+            '--output', help='Файл выгрузки; по умолчанию stdout'
+        )
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            try:
+                user_id = User.objects.get(username=options['user']).pk
+            except User.DoesNotExist:
+                raise CommandError(f'Нет пользователя {options["user"]}')
+        parts = export.stream(
+            options['kind'], options['format'], options['gzip'], user_id,
+            options['chunk_size']
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for part in parts:
+                    output.write(part)
+        elif options['gzip']:
+            for part in parts:
+                sys.stdout.buffer.write(part)
+        else:
+            for part in parts:
+                self.stdout.write(part.decode(), ending='')
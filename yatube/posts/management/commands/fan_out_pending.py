@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.feeds import fan_out_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Раскладывает по лентам посты, которые фоновая очередь не '
+        'успела разложить до остановки процесса (отметки PendingFanOut). '
+        'Запускать после перезапуска воркеров и по расписанию.'
+    )
+
+    def handle(self, *args, **options):
+        total = fan_out_pending()
+        self.stdout.write(
+            self.style.SUCCESS(f'Разложено постов: {total}')
+        )
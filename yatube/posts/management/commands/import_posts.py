@@ -0,0 +1,160 @@
+import csv
+import gzip
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts.bulk import insert_posts
+from posts.models import Group, Post, User
+
+FORMATS = ('jsonl', 'csv')
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует посты из JSONL или CSV (поля author, text, group, '
+        'pub_date) пачками bulk_create. Файл читается потоком; после '
+        'каждой пачки пишется отметка, и повторный запуск после сбоя '
+        'продолжает с неё.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .jsonl или .csv, можно .gz')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Формат; по умолчанию по расширению файла'
+        )
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл отметки; по умолчанию <path>.checkpoint'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать сначала, не глядя на отметку'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        name = path[:-3] if path.endswith('.gz') else path
+        source_format = options['format'] or (
+            'csv' if name.endswith('.csv') else 'jsonl'
+        )
+        batch_size = options['batch_size'] or settings.BULK_BATCH_SIZE
+        self.verbosity = options['verbosity']
+        self.checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        state = {'offset': 0, 'imported': 0, 'skipped': 0}
+        if not options['restart'] and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint:
+                state = json.load(checkpoint)
+            self.stdout.write(
+                f'Продолжаем с отметки: {state["imported"]} уже загружено'
+            )
+        self.authors = dict(
+            User.objects.values_list('username', 'id').iterator()
+        )
+        self.groups = dict(Group.objects.values_list('slug', 'id').iterator())
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            stream = opener(path, 'rb')
+        except OSError as error:
+            raise CommandError(error)
+        started = time.monotonic()
+        imported = 0
+        with stream:
+            batch = []
+            for record, offset in self.records(
+                stream, source_format, state['offset']
+            ):
+                post = self.post(record)
+                if post is None:
+                    state['skipped'] += 1
+                else:
+                    batch.append(post)
+                if len(batch) == batch_size:
+                    imported += self.flush(batch, offset, state, started,
+                                           imported)
+                    batch = []
+            imported += self.flush(batch, stream.tell(), state, started,
+                                   imported)
+        os.remove(self.checkpoint)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено постов: {state["imported"]}, пропущено: '
+            f'{state["skipped"]}; {imported} за {elapsed:.1f} с, '
+            f'{imported / max(elapsed, 1e-9):.0f} строк/с'
+        ))
+
+    def records(self, stream, source_format, offset):
+        """(запись, смещение в файле сразу после неё).
+
+        Файл открыт в двоичном режиме: tell() текстового файла при
+        чтении строками недоступен. csv читает строки по мере надобности,
+        так что смещение после записи — текущее смещение файла.
+        """
+        if source_format == 'csv':
+            header = next(csv.reader([stream.readline().decode()]), [])
+        if offset:
+            stream.seek(offset)
+        if source_format == 'jsonl':
+            for number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line), stream.tell()
+                except ValueError as error:
+                    raise CommandError(
+                        f'Строка {number} после отметки: {error}'
+                    )
+            return
+        lines = (line.decode() for line in stream)
+        for row in csv.DictReader(lines, fieldnames=header):
+            yield row, stream.tell()
+
+    def post(self, record):
+        """Несохранённый пост или None, если автор или группа
+        неизвестны либо текст пуст."""
+        author_id = self.authors.get(record.get('author'))
+        group_id = None
+        if record.get('group'):
+            group_id = self.groups.get(record['group'])
+            if group_id is None:
+                return None
+        if author_id is None or not record.get('text'):
+            return None
+        pub_date = None
+        if record.get('pub_date'):
+            pub_date = parse_datetime(record['pub_date'])
+            if (pub_date is not None and settings.USE_TZ
+                    and timezone.is_naive(pub_date)):
+                pub_date = timezone.make_aware(pub_date)
+        return Post(
+            author_id=author_id,
+            group_id=group_id,
+            text=record['text'],
+            pub_date=pub_date,
+        )
+
+    def flush(self, batch, offset, state, started, imported) -> int:
+        """Сохраняет пачку и передвигает отметку. Сбой между коммитом
+        и записью отметки повторит при перезапуске одну пачку."""
+        insert_posts(batch)
+        state['offset'] = offset
+        state['imported'] += len(batch)
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(temporary, self.checkpoint)
+        if batch and self.verbosity > 1:
+            total = imported + len(batch)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{state["imported"]} загружено, '
+                f'{total / max(elapsed, 1e-9):.0f} строк/с'
+            )
+        return len(batch)
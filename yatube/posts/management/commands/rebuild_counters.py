@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import rebuild_counts
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов (всего, по авторам и группам)'
+
+    def handle(self, *args, **options):
+        total = rebuild_counts()
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитано счётчиков: {total}')
+        )
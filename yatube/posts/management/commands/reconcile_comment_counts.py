@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_comment_counts
+
+
+class Command(BaseCommand):
+    help = 'Сверяет Post.comment_count с числом комментариев и чинит'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = reconcile_comment_counts(options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Исправлено постов: {total}')
+        )
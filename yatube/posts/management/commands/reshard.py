@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import caching, timelines
+from posts.models import User
+from posts.shards import hashed_shard, move_author
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит посты автора и комментарии к ним на другой шард '
+        'из POST_SHARDS и закрепляет автора за ним.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument(
+            'alias', nargs='?',
+            help='Шард назначения; по умолчанию шард по хэшу автора'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--settle', type=float, default=1.0,
+            help='Пауза перед проверкой строк, дописанных на прежний '
+                 'шард после переключения, с'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет автора {options["username"]}')
+        target = options['alias'] or hashed_shard(author.pk)
+        if target not in settings.POST_SHARDS:
+            raise CommandError(f'{target} нет в POST_SHARDS')
+        source, posts, comments = move_author(
+            author.pk, target, options['batch_size'], options['settle']
+        )
+        if source == target:
+            self.stdout.write(f'{author.username} уже на {target}')
+            return
+        timelines.invalidate(author.pk)
+        caching.bump_generation(caching.FEED_PAGES)
+        caching.bump_generation(caching.author_version(author.pk))
+        self.stdout.write(self.style.SUCCESS(
+            f'{author.username}: {source} → {target}, '
+            f'постов {posts}, комментариев {comments}'
+        ))
@@ -0,0 +1,262 @@
+import random
+import time
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from faker import Faker
+
+from posts import caching, counters, feeds, shards
+from posts.bulk import insert_posts, insert_raw
+from posts.models import Comment, Follow, Group, Post, User
+
+# Тексты собираются из заранее созданного набора предложений: Faker
+# на каждый из миллиона постов и комментариев — минуты работы.
+SENTENCES: int = 5000
+NO_GROUP_SHARE: float = 0.3
+
+
+def zipf_weights(size, exponent) -> list:
+    """Накопленные веса закона Ципфа для рангов 1..size."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, группами, '
+        'постами, подписками и комментариями с перекосом как в жизни: '
+        'активность авторов по закону Ципфа и знаменитости с огромным '
+        'числом подписчиков. Одно и то же зерно — одни и те же данные.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows', type=int, default=10000,
+            help='Подписки обычных пользователей, без знаменитостей'
+        )
+        parser.add_argument('--celebrities', type=int, default=3)
+        parser.add_argument(
+            '--celebrity-reach', type=float, default=0.3,
+            help='Доля пользователей, подписанных на каждую знаменитость'
+        )
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Показатель закона Ципфа для авторов, групп и постов'
+        )
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument(
+            '--until', help='Дата последних постов; по умолчанию сегодня'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument(
+            '--feeds', action='store_true',
+            help='Разложить посты в ленты подписчиков (FeedEntry)'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.size = options['batch_size'] or settings.BULK_BATCH_SIZE
+        self.random = random.Random(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        until = timezone.localdate()
+        if options['until']:
+            until = parse_date(options['until'])
+            if until is None:
+                raise CommandError(f'Не дата: {options["until"]}')
+        self.until = timezone.make_aware(
+            datetime.combine(until + timedelta(days=1), datetime.min.time())
+        )
+        if options['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя')
+
+        users = self.stage('Пользователи', self.create_users)
+        # Ранг автора по активности — случайный, а не по порядку id.
+        self.authors = list(users)
+        self.random.shuffle(self.authors)
+        self.author_weights = zipf_weights(len(self.authors), options['zipf'])
+        self.users = users
+        self.groups = self.stage('Группы', self.create_groups)
+        self.stage('Посты', self.create_posts)
+        self.stage('Подписки', self.create_follows)
+        self.stage('Комментарии', self.create_comments)
+        if options['feeds']:
+            self.stage('Ленты', self.fill_feeds)
+        # Посты и комментарии сбросили свои кэши сами; остальной кэш
+        # сайта не трогаем.
+        caching.drop_generations(
+            [caching.group_version(group_id) for group_id in self.groups]
+        )
+        caching.bump_generation(caching.FEED_PAGES)
+
+    def stage(self, title, create):
+        started = time.monotonic()
+        result = create()
+        self.stdout.write(
+            f'{title}: {len(result)} за {time.monotonic() - started:.1f} с'
+        )
+        return result
+
+    def batches(self, total):
+        for start in range(0, total, self.size):
+            yield min(self.size, total - start)
+
+    def create_users(self) -> array:
+        password = make_password(None)
+        ids = array('q')
+        for number, size in enumerate(self.batches(self.options['users'])):
+            names = [
+                f'{self.fake.user_name()}_{number * self.size + i}'
+                for i in range(size)
+            ]
+            User.objects.bulk_create(
+                [User(username=name, password=password) for name in names],
+                ignore_conflicts=True
+            )
+            found = dict(User.objects.filter(
+                username__in=names
+            ).values_list('username', 'id'))
+            ids.extend(found[name] for name in names)
+        return ids
+
+    def create_groups(self) -> list:
+        seed = self.options['seed']
+        slugs = [f'seed-{seed}-{i}' for i in range(self.options['groups'])]
+        Group.objects.bulk_create([
+            Group(
+                title=self.fake.sentence(nb_words=3).rstrip('.'),
+                slug=slug,
+                description=self.fake.paragraph(),
+            )
+            for slug in slugs
+        ], ignore_conflicts=True)
+        found = dict(
+            Group.objects.filter(slug__in=slugs).values_list('slug', 'id')
+        )
+        return [found[slug] for slug in slugs]
+
+    def create_posts(self) -> array:
+        self.sentences = [self.fake.sentence() for _ in range(SENTENCES)]
+        group_weights = zipf_weights(len(self.groups), self.options['zipf'])
+        span = self.options['days'] * 24 * 60 * 60
+        self.post_ids = array('q')
+        self.post_authors = array('q')
+        self.post_dates = array('d')
+        for size in self.batches(self.options['posts']):
+            authors = self.random.choices(
+                self.authors, cum_weights=self.author_weights, k=size
+            )
+            posts = []
+            for author_id in authors:
+                group_id = None
+                if self.groups and self.random.random() >= NO_GROUP_SHARE:
+                    group_id = self.random.choices(
+                        self.groups, cum_weights=group_weights
+                    )[0]
+                posts.append(Post(
+                    author_id=author_id,
+                    group_id=group_id,
+                    text=' '.join(self.random.choices(
+                        self.sentences, k=self.random.randint(1, 8)
+                    )),
+                    pub_date=self.until - timedelta(
+                        seconds=self.random.uniform(0, span)
+                    ),
+                ))
+            insert_posts(posts)
+            for post in posts:
+                self.post_ids.append(post.pk)
+                self.post_authors.append(post.author_id)
+                self.post_dates.append(post.pub_date.timestamp())
+        return self.post_ids
+
+    def follow_pairs(self):
+        """(подписчик, автор): все охваченные пользователи у каждой
+        знаменитости, затем обычные подписки на авторов по Ципфу."""
+        celebrities = self.authors[:self.options['celebrities']]
+        reach = int(len(self.users) * self.options['celebrity_reach'])
+        for author_id in celebrities:
+            for user_id in self.random.sample(self.users, reach):
+                if user_id != author_id:
+                    yield user_id, author_id
+        for _ in range(self.options['follows']):
+            user_id = self.random.choice(self.users)
+            author_id = self.random.choices(
+                self.authors, cum_weights=self.author_weights
+            )[0]
+            if user_id != author_id:
+                yield user_id, author_id
+
+    def create_follows(self) -> range:
+        # Повторы пар отбрасывает уникальный индекс.
+        before = Follow.objects.count()
+        pairs = self.follow_pairs()
+        while True:
+            batch = [pair for _, pair in zip(range(self.size), pairs)]
+            if not batch:
+                break
+            Follow.objects.bulk_create([
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in batch
+            ], ignore_conflicts=True)
+        return range(Follow.objects.count() - before)
+
+    def create_comments(self) -> range:
+        if not self.post_ids:
+            return range(0)
+        # Обсуждаемость поста — тоже по Ципфу, ранг случайный.
+        ranked = list(range(len(self.post_ids)))
+        self.random.shuffle(ranked)
+        weights = zipf_weights(len(ranked), self.options['zipf'])
+        until = self.until.timestamp()
+        for size in self.batches(self.options['comments']):
+            by_shard = defaultdict(list)
+            for index in self.random.choices(
+                ranked, cum_weights=weights, k=size
+            ):
+                published = self.post_dates[index]
+                by_shard[shards.shard_for(self.post_authors[index])].append(
+                    Comment(
+                        post_id=self.post_ids[index],
+                        author_id=self.random.choice(self.users),
+                        text=self.random.choice(self.sentences),
+                        created=datetime.fromtimestamp(
+                            self.random.uniform(published, until),
+                            timezone.utc
+                        ),
+                    )
+                )
+            for alias, comments in by_shard.items():
+                with transaction.atomic(using=alias):
+                    # Сырая вставка: bulk_create заменил бы created
+                    # текущим временем (auto_now_add).
+                    insert_raw(comments, alias)
+                    per_post = Counter(
+                        comment.post_id for comment in comments
+                    )
+                    counters.change_comment_counts(per_post, alias)
+                caching.drop_generations(
+                    [caching.post_version(post_id) for post_id in per_post]
+                )
+        return range(self.options['comments'])
+
+    def fill_feeds(self) -> range:
+        follows = Follow.objects.values_list('user_id', 'author_id')
+        total = 0
+        for user_id, author_id in follows.iterator():
+            feeds.backfill(user_id, author_id)
+            total += 1
+        return range(total)
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.16 on 2026-10-18 09:10
+
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Одна схема при любом числе шардов: ссылки постов, комментариев и
+# записей лент без ограничений базы, целостность держит приложение
+# (manage.py check_references). Заменяет прежнюю 0015, ставившую
+# ограничения без шардов: здесь таблицы пересобираются ещё раз, и
+# оставленные ею ограничения пропадают.
+#
+# SQLite пересоздаёт таблицу постов при изменении поля, и триггеры
+# полнотекстового индекса пропадают вместе со старой таблицей.
+fts = import_module('posts.migrations.0014_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0014_post_fts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AlterField(
+            model_name='feedentry',
+            name='post',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='posts.Post', verbose_name='Запись'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='posts', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='group',
+            field=models.ForeignKey(blank=True, db_constraint=False, help_text='Элемент классификации постов', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='posts', to='posts.Group', verbose_name='Группа'),
+        ),
+        migrations.RunPython(fts.run(fts.SCHEMA), migrations.RunPython.noop),
+    ]
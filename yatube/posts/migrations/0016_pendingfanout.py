@@ -0,0 +1,21 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_foreign_keys_without_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingFanOut',
+            fields=[
+                ('post_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='Запись')),
+                ('author_id', models.IntegerField(verbose_name='Автор')),
+                ('pub_date', models.DateTimeField()),
+            ],
+        ),
+    ]
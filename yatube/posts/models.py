@@ -4,6 +4,17 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
+class ShardedQuerySet(models.QuerySet):
+    """create() без явной базы оставляет выбор шарда роутеру: тот
+    смотрит на сам объект, а не только на модель."""
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
 class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
@@ -20,7 +31,8 @@ class Post(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='posts',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_constraint=False
     )
     group = models.ForeignKey(
         Group,
@@ -28,6 +40,7 @@ class Post(models.Model):
         related_name='posts',
         blank=True,
         null=True,
+        db_constraint=False,
         verbose_name='Группа',
         help_text='Элемент классификации постов'
     )
@@ -36,13 +49,47 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Комментарии'
+    )
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        # comment_count сдвигают только UPDATE ... F() из counters:
+        # полное сохранение записало бы прочитанное раньше значение
+        # поверх чужих комментариев.
+        if not self._state.adding and not args and not kwargs.get(
+            'force_insert'
+        ) and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'comment_count'
+            ]
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     text = models.TextField(help_text='Введите текст комментария')
@@ -58,10 +105,19 @@ class Comment(models.Model):
         on_delete=models.CASCADE,
         related_name='comments',
         verbose_name='Автор',
+        db_constraint=False,
     )
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         ordering = ['created']
+        indexes = [
+            models.Index(
+                fields=['post', 'created', 'id'],
+                name='comment_post_created_idx'
+            ),
+        ]
 
 
 class Follow(models.Model):
@@ -85,3 +141,88 @@ class Follow(models.Model):
                 name='unique_following'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'
+            ),
+        ]
+
+
+class Counter(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    value = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f'{self.name}={self.value}'
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Запись',
+        db_constraint=False
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_user_pub_date_idx'
+            )
+        ]
+
+
+class PendingFanOut(models.Model):
+    """Пост, поставленный в очередь раскладки по лентам.
+
+    Пишется вместе с постом и удаляется после раскладки: посты, которые
+    очередь процесса потеряла при его остановке, раскладывает команда
+    fan_out_pending.
+    """
+    post_id = models.IntegerField(primary_key=True, verbose_name='Запись')
+    author_id = models.IntegerField(verbose_name='Автор')
+    pub_date = models.DateTimeField()
+
+
+class PostKey(models.Model):
+    """Глобальный id поста и его автор.
+
+    Живёт в основной базе: id постов уникальны на всех шардах, а шард
+    поста находится по автору без обхода шардов.
+    """
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+
+
+class ShardAssignment(models.Model):
+    """Шард автора, перенесённого командой reshard с шарда по хэшу."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    alias = models.CharField(max_length=64, verbose_name='База')
+
+    def __str__(self) -> str:
+        return f'{self.author_id}@{self.alias}'
@@ -0,0 +1,159 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .counters import get_count
+
+
+def encode_cursor(value, pk) -> str:
+    """Упаковывает ключ записи (дата, id) в непрозрачный токен."""
+    raw = f'{value.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен курсора, для испорченного токена вернёт None."""
+    if not token:
+        return None
+    try:
+        padding = '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(token + padding).decode()
+        value, pk = raw.rsplit('|', 1)
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if value is None:
+        return None
+    return value, pk
+
+
+class CursorPaginator(Paginator):
+    """Паджинатор по ключу (дата, id): страница любой глубины стоит
+    одного запроса с LIMIT, без COUNT(*) и OFFSET.
+
+    Нумерованные страницы от родительского Paginator остаются доступны.
+    """
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-id'), **kwargs):
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.descending = ordering[0].startswith('-')
+        super().__init__(object_list.order_by(*ordering), per_page, **kwargs)
+
+    def _seek(self, queryset, cursor, forward):
+        value, pk = cursor
+        date_field, pk_field = self.fields
+        lookup = 'lt' if forward == self.descending else 'gt'
+        # Нестрогое условие на дату отдельно от OR: так SQLite идёт
+        # диапазоном по индексу, а не объединяет два поиска с сортировкой.
+        return queryset.filter(
+            Q(**{f'{date_field}__{lookup}e': value}),
+            Q(**{f'{date_field}__{lookup}': value})
+            | Q(**{f'{pk_field}__{lookup}': pk}),
+        )
+
+    def cursor_of(self, obj) -> str:
+        date_field, pk_field = self.fields
+        return encode_cursor(getattr(obj, date_field), getattr(obj, pk_field))
+
+    def cursor_page(self, after=None, before=None) -> Page:
+        """Возвращает страницу после курсора after или перед before."""
+        after, before = decode_cursor(after), decode_cursor(before)
+        queryset = self.object_list
+        backwards = before is not None and after is None
+        if backwards:
+            reverse = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in self.ordering
+            ]
+            queryset = self._seek(queryset, before, forward=False)
+            queryset = queryset.order_by(*reverse)
+        elif after is not None:
+            queryset = self._seek(queryset, after, forward=True)
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else after is not None
+        return self.build_page(rows, has_next, has_previous)
+
+    def build_page(self, rows, has_next, has_previous) -> Page:
+        """Страница с курсорами на соседние страницы."""
+        page = Page(rows, 1, self)
+        page.is_cursor = True
+        page.next_cursor = (
+            self.cursor_of(rows[-1]) if has_next and rows else None
+        )
+        page.previous_cursor = (
+            self.cursor_of(rows[0]) if has_previous and rows else None
+        )
+        return page
+
+
+class CountedPaginator(CursorPaginator):
+    """Берёт число записей из счётчика count_key вместо COUNT(*)."""
+
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        self.count_key = count_key
+        super().__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        return get_count(self.count_key, self.object_list)
+
+
+def estimated_rows(queryset):
+    """Оценка числа строк таблицы без COUNT(*).
+
+    Большее из статистики ANALYZE (sqlite_stat1 в SQLite) и наибольшего
+    id: статистика не знает строк, добавленных после ANALYZE, а id
+    с удалёнными строками дают оценку сверху. Строки частичных
+    индексов считают не всю таблицу и не берутся.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    analyzed = None
+    if connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 '
+                    'WHERE tbl = %s AND (idx IS NULL OR idx IN ('
+                    'SELECT name FROM pragma_index_list(%s) '
+                    'WHERE NOT partial))',
+                    [table, table]
+                )
+                analyzed = cursor.fetchone()[0]
+        except DatabaseError:
+            pass
+    last = queryset.aggregate(last=Max('pk'))['last']
+    return max(analyzed or 0, last or 0)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Паджинатор списков админки без точного COUNT(*) по всей таблице.
+
+    Без фильтров число строк оценивается (estimated_rows), с фильтрами
+    считается не дальше ADMIN_COUNT_LIMIT строк: дальние страницы
+    длинной выборки в админке не нужны.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return estimated_rows(queryset)
+        return queryset.order_by()[:settings.ADMIN_COUNT_LIMIT].count()
@@ -0,0 +1,135 @@
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import shards
+from .models import Post
+
+FTS_TABLE: str = 'posts_post_fts'
+# Управляющие символы не встречаются в тексте постов: по ним после
+# экранирования сниппета ставится подсветка.
+MARK_START: str = '\x02'
+MARK_END: str = '\x03'
+SNIPPET_TOKENS: int = 24
+WORD_RE = re.compile(r'\w+')
+
+# Индекс с внешним содержимым (миграция 0014): текст хранится только
+# в posts_post, а триггеры обновляют индекс при любой записи, включая
+# bulk_create() и update(). Пересоздание таблицы posts_post миграцией
+# SQLite сносит триггеры — их наличие проверяет тест.
+TRIGGERS = tuple(
+    f'{FTS_TABLE}_{action}' for action in ('insert', 'delete', 'update')
+)
+
+
+def is_available(using) -> bool:
+    return connections[using].vendor == 'sqlite'
+
+
+def match_expression(query) -> str:
+    """Запрос FTS5 из слов пользователя: все слова, каждое как префикс.
+
+    Слова берутся в кавычки, так что синтаксис FTS5 из запроса
+    (OR, NEAR, *) не работает и не ломает MATCH.
+    """
+    return ' '.join(
+        f'"{word}"*' for word in WORD_RE.findall(query.lower())
+    )
+
+
+def highlight(snippet) -> str:
+    return mark_safe(
+        escape(snippet).replace(MARK_START, '<mark>').replace(
+            MARK_END, '</mark>'
+        )
+    )
+
+
+class SearchResults:
+    """Посты одной базы, найденные по индексу, по убыванию релевантности.
+
+    Понимает count() и срезы, поэтому отдаётся обычному Paginator.
+    У постов среза есть rank (bm25, меньше — лучше) и snippet — отрывок
+    текста с подсвеченными совпадениями.
+    """
+    model = Post
+    ordered = True
+
+    def __init__(self, query, using):
+        self.expression = match_expression(query)
+        self.using = using
+
+    def count(self) -> int:
+        if not self.expression:
+            return 0
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE}'
+                f' WHERE {FTS_TABLE} MATCH %s',
+                [self.expression]
+            )
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('SearchResults поддерживает только срезы')
+        start = key.start or 0
+        if not self.expression or (key.stop is not None
+                                   and key.stop <= start):
+            return []
+        limit = -1 if key.stop is None else key.stop - start
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, rank,'
+                f' snippet({FTS_TABLE}, 0, %s, %s, %s, %s)'
+                f' FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+                ' ORDER BY rank, rowid LIMIT %s OFFSET %s',
+                [MARK_START, MARK_END, '…', SNIPPET_TOKENS,
+                 self.expression, limit, start]
+            )
+            rows = cursor.fetchall()
+        posts = shards.with_related(
+            Post.objects.using(self.using), 'author', 'group'
+        ).in_bulk([post_id for post_id, _, _ in rows])
+        found = []
+        for post_id, rank, snippet in rows:
+            post = posts.get(post_id)
+            if post is not None:
+                post.rank = rank
+                post.snippet = highlight(snippet)
+                found.append(post)
+        return found
+
+
+def find_posts(query):
+    """Результаты поиска по всем шардам постов.
+
+    Ранги bm25 разных шардов считаются по своей статистике и при
+    слиянии сравниваются как есть. Без SQLite — поиск подстроки.
+    """
+    if not shards.is_sharded():
+        using = router.db_for_read(Post)
+        if not is_available(using):
+            return Post.objects.filter(text__icontains=query)
+        return SearchResults(query, using)
+    return shards.FanOut(
+        [SearchResults(query, alias) for alias in settings.POST_SHARDS],
+        ordering=('rank', 'id')
+    )
+
+
+def match_condition(query):
+    """Условие WHERE «пост подходит под запрос» и его параметры — для
+    queryset.extra() по таблице постов.
+
+    RawSQL тут не годится: в pk__in он получает вторые скобки, и SQLite
+    читает подзапрос как скалярный — только первую строку.
+    """
+    return (
+        f'{Post._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE}'
+        f' WHERE {FTS_TABLE} MATCH %s)',
+        [match_expression(query)],
+    )
@@ -0,0 +1,359 @@
+import hashlib
+import heapq
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.db import chunks, last_ids
+from core.writes import writer_lock
+from .models import (
+    Comment, FeedEntry, Post, PostKey, ShardAssignment, User
+)
+
+ASSIGNMENTS_KEY: str = 'shards:assignments'
+SHARDED_MODELS = (Post, Comment)
+
+
+def is_sharded() -> bool:
+    return len(settings.POST_SHARDS) > 1
+
+
+def hashed_shard(author_id) -> str:
+    """Шард автора по rendezvous-хэшу: у каждого шарда свой стабильный
+    хэш id автора (hash() меняется от запуска к запуску), выигрывает
+    наибольший. Новый шард забирает у прежних лишь свою долю авторов."""
+    def weight(alias) -> int:
+        digest = hashlib.md5(f'{alias}:{author_id}'.encode()).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    return max(settings.POST_SHARDS, key=weight)
+
+
+def assignments() -> dict:
+    """Перенесённые авторы: {author_id: шард}."""
+    assigned = cache.get(ASSIGNMENTS_KEY)
+    if assigned is None:
+        assigned = dict(ShardAssignment.objects.using(
+            DEFAULT_DB_ALIAS
+        ).values_list('author_id', 'alias'))
+        cache.set(ASSIGNMENTS_KEY, assigned, None)
+    return assigned
+
+
+def assign(author_id, alias) -> None:
+    ShardAssignment.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        author_id=author_id, defaults={'alias': alias}
+    )
+    cache.delete(ASSIGNMENTS_KEY)
+
+
+def shard_for(author_id) -> str:
+    """Шард, на котором лежат посты автора и комментарии к ним."""
+    if not is_sharded():
+        return settings.POST_SHARDS[0]
+    alias = assignments().get(author_id)
+    if alias in settings.POST_SHARDS:
+        return alias
+    return hashed_shard(author_id)
+
+
+def post_shard(post_id):
+    """Шард поста по его ключу. None, если шард один: тогда базу
+    выбирает роутер (и чтение может уйти на реплику)."""
+    if not is_sharded():
+        return None
+    author_id = PostKey.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk=post_id
+    ).values_list('author_id', flat=True).first()
+    if author_id is None:
+        return settings.POST_SHARDS[0]
+    return shard_for(author_id)
+
+
+def allocate_post_id(author_id) -> int:
+    return PostKey.objects.using(DEFAULT_DB_ALIAS).create(
+        author_id=author_id
+    ).pk
+
+
+def allocate_post_ids(author_ids) -> list:
+    """Ключи для многих новых постов разом, id в порядке author_ids."""
+    keys = [PostKey(author_id=author_id) for author_id in author_ids]
+    connection = connections[DEFAULT_DB_ALIAS]
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        PostKey.objects.using(DEFAULT_DB_ALIAS).bulk_create(keys)
+        if connection.features.can_return_ids_from_bulk_insert:
+            return [key.pk for key in keys]
+        return last_ids(PostKey.objects.using(DEFAULT_DB_ALIAS), len(keys))
+
+
+def register_post_key(post_id, author_id) -> None:
+    """Заводит ключ посту, сохранённому с заданным заранее id."""
+    PostKey.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        pk=post_id, defaults={'author_id': author_id}
+    )
+
+
+def forget_post(post_id) -> None:
+    """Убирает ключ удалённого поста и его записи в лентах подписчиков:
+    каскад из базы шарда до них не дотягивается. Без шардов ключей нет,
+    а записи удаляет каскад."""
+    if is_sharded():
+        PostKey.objects.using(DEFAULT_DB_ALIAS).filter(pk=post_id).delete()
+        FeedEntry.objects.filter(post_id=post_id).delete()
+
+
+def author_post_ids(author_id):
+    """Подзапрос id постов автора, пригодный в запросах к основной
+    базе."""
+    if is_sharded():
+        return PostKey.objects.filter(author_id=author_id).values('id')
+    return Post.objects.filter(author_id=author_id).values('id')
+
+
+def with_related(queryset, *fields):
+    """Подгружает связи: JOIN на одной базе, отдельными запросами к
+    основной, если посты лежат на шардах."""
+    if is_sharded():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def posts_in_bulk(post_ids) -> dict:
+    """{id: пост} с авторами и группами, по запросу на шард."""
+    if not is_sharded():
+        return with_related(Post.objects, 'author', 'group').in_bulk(
+            post_ids
+        )
+    by_shard = defaultdict(list)
+    keys = PostKey.objects.filter(pk__in=post_ids).values_list(
+        'id', 'author_id'
+    )
+    for post_id, author_id in keys:
+        by_shard[shard_for(author_id)].append(post_id)
+    posts = {}
+    for alias, ids in by_shard.items():
+        posts.update(with_related(
+            Post.objects.using(alias), 'author', 'group'
+        ).in_bulk(ids))
+    return posts
+
+
+def _block_writes(using) -> None:
+    """Не пускает в базу using чужие записи до конца транзакции: в
+    SQLite блокировку записи берёт первая же, даже пустая, запись."""
+    if connections[using].vendor == 'sqlite':
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Post._meta.db_table} SET id = id WHERE 0'
+            )
+
+
+def _move_rows(author_id, source, target, post_ids, batch_size,
+               switch=False):
+    """Один проход переноса: посты автора, оставшиеся на source, и
+    комментарии к ним и к уже перенесённым постам post_ids копируются
+    на target и удаляются с source. Пока идёт проход, запись на source
+    закрыта и для других процессов, а в этом — и на target. switch —
+    первый проход: сначала убрать остатки прерванного переноса, в конце
+    закрепить автора за target. Вернёт (id перенесённых постов, число
+    комментариев)."""
+    # bulk сам импортирует этот модуль.
+    from .bulk import insert_raw
+
+    posts = Post.objects.using(source).filter(author_id=author_id)
+    moved_ids = []
+    moved_comments = 0
+    with ExitStack() as stack:
+        for alias in sorted({source, target}):
+            stack.enter_context(writer_lock(alias))
+        stack.enter_context(transaction.atomic(using=source))
+        _block_writes(source)
+        with transaction.atomic(using=target):
+            if switch:
+                # Остатки прерванного переноса: посты сохраняют свои id.
+                Comment.objects.using(target).filter(
+                    post__author_id=author_id
+                )._raw_delete(target)
+                Post.objects.using(target).filter(
+                    author_id=author_id
+                )._raw_delete(target)
+            # Сырая вставка: bulk_create заменил бы pub_date и created
+            # текущим временем (auto_now_add).
+            for batch in chunks(posts.order_by('pk').iterator(),
+                                batch_size):
+                insert_raw(batch, target)
+                moved_ids += [post.pk for post in batch]
+            for ids in chunks([*post_ids, *moved_ids], batch_size):
+                comments = Comment.objects.using(source).filter(
+                    post_id__in=ids
+                )
+                for batch in chunks(comments.order_by('pk').iterator(),
+                                    batch_size):
+                    # id комментариев уникальны лишь в пределах шарда:
+                    # занятые на target выдаются заново, прочие остаются.
+                    taken = set(Comment.objects.using(target).filter(
+                        pk__in=[comment.pk for comment in batch]
+                    ).values_list('pk', flat=True))
+                    for comment in batch:
+                        if comment.pk in taken:
+                            comment.pk = None
+                    insert_raw(batch, target)
+                    moved_comments += len(batch)
+                comments._raw_delete(source)
+        if switch:
+            assign(author_id, target)
+        posts._raw_delete(source)
+    return moved_ids, moved_comments
+
+
+def move_author(author_id, target, batch_size=500, settle=1.0):
+    """Переносит посты автора и комментарии к ним на шард target.
+
+    Строки копируются на target, автор закрепляется за target, и строки
+    удаляются с прежнего шарда — без сигналов, чтобы не тронуть
+    счётчики. Всё это время запись на прежний шард закрыта. Сбой до
+    переключения оставляет автора на месте; повторный запуск перенесёт
+    всё заново. Запросы, выбравшие шард до переключения, могут дописать
+    строки на прежний шард уже после него: такие строки переносятся
+    повторными проходами через settle секунд, пока не кончатся.
+    Вернёт (source, число постов, число комментариев).
+    """
+    source = shard_for(author_id)
+    if source == target:
+        return source, 0, 0
+    post_ids, moved_comments = _move_rows(
+        author_id, source, target, [], batch_size, switch=True
+    )
+    while True:
+        time.sleep(settle)
+        late_ids, late_comments = _move_rows(
+            author_id, source, target, post_ids, batch_size
+        )
+        if not late_ids and not late_comments:
+            return source, len(post_ids), moved_comments
+        post_ids += late_ids
+        moved_comments += late_comments
+
+
+class FanOut:
+    """Один и тот же запрос ко всем шардам, слитый по порядку сортировки.
+
+    Понимает то, что нужно паджинаторам: order_by(), filter(), count()
+    и срезы. Срез [a:b] читает до b строк с каждого шарда, так что
+    глубокие нумерованные страницы дороги — курсорные стоят LIMIT.
+    """
+    ordered = True
+    db = None
+
+    def __init__(self, querysets, ordering=()):
+        self.querysets = querysets
+        self.ordering = ordering
+        self.model = querysets[0].model
+
+    def _clone(self, querysets, ordering=None):
+        return FanOut(querysets, self.ordering if ordering is None
+                      else ordering)
+
+    def order_by(self, *ordering):
+        return self._clone(
+            [queryset.order_by(*ordering) for queryset in self.querysets],
+            ordering
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._clone(
+            [queryset.filter(*args, **kwargs) for queryset in self.querysets]
+        )
+
+    def count(self) -> int:
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def _key(self, obj):
+        return tuple(
+            getattr(obj, field.lstrip('-')) for field in self.ordering
+        )
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('FanOut поддерживает только срезы без шага')
+        start = key.start or 0
+        if key.stop is None:
+            parts = [list(queryset) for queryset in self.querysets]
+        else:
+            parts = [list(queryset[:key.stop]) for queryset in self.querysets]
+        descending = bool(self.ordering) and self.ordering[0].startswith('-')
+        merged = heapq.merge(*parts, key=self._key, reverse=descending)
+        return list(islice(merged, start, key.stop))
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+def across_shards(queryset):
+    """Запрос ко всем шардам постов или сам queryset, если шард один."""
+    if not is_sharded():
+        return queryset
+    return FanOut([queryset.using(alias) for alias in settings.POST_SHARDS])
+
+
+def _author_of(model, instance):
+    if isinstance(instance, User):
+        return instance.pk if model is Post else None
+    if isinstance(instance, Post):
+        return instance.author_id
+    if isinstance(instance, Comment):
+        if Comment._meta.get_field('post').is_cached(instance):
+            return instance.post.author_id
+        return PostKey.objects.filter(pk=instance.post_id).values_list(
+            'author_id', flat=True
+        ).first()
+    return None
+
+
+class ShardRouter:
+    """Посты и комментарии — на шард автора поста (POST_SHARDS).
+
+    Шард находится по объекту из подсказок роутеру: по посту,
+    комментарию или, для постов, по автору. Без объекта запрос идёт
+    в основную базу, поэтому чтения по всем шардам делаются явно через
+    using() или across_shards(). Прочие модели остаются следующему
+    роутеру; пока шард один, роутер ничего не решает. Базы, кроме
+    основной и реплик, получают при migrate только таблицы приложения
+    posts.
+    """
+
+    def _shard(self, model, **hints):
+        if not is_sharded() or model not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        author_id = None
+        if instance is not None:
+            author_id = _author_of(model, instance)
+        if author_id is None:
+            return DEFAULT_DB_ALIAS
+        return shard_for(author_id)
+
+    db_for_read = _shard
+    db_for_write = _shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {
+            DEFAULT_DB_ALIAS,
+            *settings.POST_SHARDS,
+            *settings.DATABASE_REPLICAS,
+        }
+        if is_sharded() and {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == DEFAULT_DB_ALIAS or db in settings.DATABASE_REPLICAS:
+            return None
+        # Прочие базы — шарды: им нужны только таблицы постов.
+        return app_label == 'posts'
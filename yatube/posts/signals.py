@@ -0,0 +1,140 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, counters, feeds, shards, timelines
+from .models import Comment, Follow, Group, Post
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_keys(sender, instance, using=None, **kwargs):
+    instance._old_counter_keys = []
+    instance._old_author_id = None
+    if instance.pk is None:
+        return
+    old = Post.objects.using(using).filter(pk=instance.pk).values(
+        'author_id', 'group_id'
+    ).first()
+    if old is not None:
+        instance._old_author_id = old['author_id']
+        instance._old_counter_keys = counters.post_keys(
+            old['author_id'], old['group_id']
+        )
+
+
+@receiver(pre_save, sender=Post)
+def allocate_post_key(sender, instance, raw=False, **kwargs):
+    # После remember_post_keys: тот по пустому pk узнаёт новый пост.
+    instance._post_key_allocated = (
+        instance.pk is None and not raw and shards.is_sharded()
+    )
+    if instance._post_key_allocated:
+        instance.pk = shards.allocate_post_id(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def register_post_key(sender, instance, created, **kwargs):
+    if (created and shards.is_sharded()
+            and not getattr(instance, '_post_key_allocated', False)):
+        shards.register_post_key(instance.pk, instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def forget_post_key(sender, instance, **kwargs):
+    shards.forget_post(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    keys = counters.post_keys(instance.author_id, instance.group_id)
+    old_keys = getattr(instance, '_old_counter_keys', [])
+    if created or not old_keys:
+        counters.change_count(keys, 1)
+        return
+    counters.change_count(set(old_keys) - set(keys), -1)
+    counters.change_count(set(keys) - set(old_keys), 1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.schedule_fan_out(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_timeline(sender, instance, **kwargs):
+    timelines.invalidate(instance.author_id)
+    old_author_id = getattr(instance, '_old_author_id', None)
+    if old_author_id not in (None, instance.author_id):
+        timelines.invalidate(old_author_id)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_count(
+        counters.post_keys(instance.author_id, instance.group_id), -1
+    )
+
+
+@receiver(post_delete, sender=Group)
+def drop_group_count(sender, instance, **kwargs):
+    counters.drop_count(counters.group_key(instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, using=None,
+                        **kwargs):
+    if created and not raw:
+        counters.change_comment_count(instance.post_id, 1, using)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, using=None, **kwargs):
+    counters.change_comment_count(instance.post_id, -1, using)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_feed(sender, instance, **kwargs):
+    feeds.trim(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_feed_pages(sender, **kwargs):
+    caching.bump_generation(caching.FEED_PAGES)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_versions(sender, instance, **kwargs):
+    caching.bump_generation(caching.post_version(instance.pk))
+    caching.bump_generation(caching.author_version(instance.author_id))
+    old_author_id = getattr(instance, '_old_author_id', None)
+    if old_author_id not in (None, instance.author_id):
+        caching.bump_generation(caching.author_version(old_author_id))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_commented_post_version(sender, instance, **kwargs):
+    caching.bump_generation(caching.post_version(instance.post_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_group_version(sender, instance, **kwargs):
+    caching.bump_generation(caching.group_version(instance.pk))
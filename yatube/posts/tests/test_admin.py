@@ -0,0 +1,226 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.queries import capture_queries
+from ..caching import FEED_PAGES, get_generation
+from ..counters import author_key, get_count, group_key
+from ..models import Comment, FeedEntry, Follow, Group, Post
+from ..paginators import estimated_rows
+
+
+User = get_user_model()
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        cls.authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(5)
+        ]
+        groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'group-{i}', description='Текст'
+            )
+            for i in range(3)
+        ]
+        posts = [
+            Post.objects.create(
+                author=author, group=groups[i % 3], text=f'Пост {i}'
+            )
+            for i, author in enumerate(cls.authors * 4)
+        ]
+        Comment.objects.bulk_create([
+            Comment(post=post, author=cls.admin, text='Комментарий')
+            for post in posts
+        ])
+        Follow.objects.bulk_create([
+            Follow(user=user, author=author)
+            for user in cls.authors for author in cls.authors
+            if user != author
+        ])
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(AdminChangelistTest.admin)
+
+    def changelist(self, model, **params):
+        with capture_queries() as log:
+            response = self.client.get(
+                reverse(f'admin:posts_{model}_changelist'), params
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, log
+
+    def test_changelists_avoid_n_plus_one(self):
+        """Списки не делают запросов на строку и точного COUNT(*)."""
+        for model in ('post', 'comment', 'follow'):
+            with self.subTest(model=model):
+                response, log = self.changelist(model)
+                self.assertGreaterEqual(
+                    len(response.context['cl'].result_list), 20
+                )
+                self.assertFalse(log.repeated(3), log.report(3))
+                self.assertFalse([
+                    sql for _, sql, _ in log.statements
+                    if sql.startswith('SELECT COUNT(*)')
+                ])
+
+    @skipUnless(connection.vendor == 'sqlite', 'sqlite_stat1 из SQLite')
+    def test_estimate_skips_stale_and_partial_stats(self):
+        """Оценка не ниже наибольшего id и не берёт частичный индекс."""
+        comments = Comment.objects.all()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE INDEX comment_partial ON posts_comment (post_id) '
+                'WHERE id < 0'
+            )
+            cursor.execute('ANALYZE posts_comment')
+            cursor.execute(
+                "UPDATE sqlite_stat1 SET stat = CASE idx "
+                "WHEN 'comment_partial' THEN '1000 1' ELSE '5 1' END "
+                "WHERE tbl = 'posts_comment'"
+            )
+        last = comments.aggregate(last=Max('pk'))['last']
+        self.assertEqual(estimated_rows(comments), last)
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_filtered_count_is_capped(self):
+        """С фильтром считается не больше ADMIN_COUNT_LIMIT строк."""
+        response, _ = self.changelist('post', q='пост')
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_username_filter(self):
+        """Фильтр подписок по имени — поле ввода, а не список людей."""
+        response, _ = self.changelist('follow', author='author_1')
+        follows = response.context['cl'].result_list
+        self.assertEqual(len(follows), 4)
+        self.assertTrue(all(
+            follow.author.username == 'author_1' for follow in follows
+        ))
+        self.assertContains(response, 'name="author" value="author_1"')
+        self.assertNotContains(response, '?user=')
+
+
+@override_settings(BULK_BATCH_SIZE=3)
+class BulkActionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.source = Group.objects.create(
+            title='Откуда', slug='source', description='Текст'
+        )
+        cls.target = Group.objects.create(
+            title='Куда', slug='target', description='Текст'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author, group=cls.source, text=f'Пост {i}'
+            )
+            for i in range(7)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(BulkActionTest.admin)
+
+    def act(self, model, action, selected, **data):
+        return self.client.post(
+            reverse(f'admin:posts_{model}_changelist'),
+            {'action': action, '_selected_action': selected, **data},
+            follow=True,
+        )
+
+    def group_count(self, group) -> int:
+        return get_count(group_key(group.pk), group.posts.all())
+
+    def test_move_to_group(self):
+        """Посты переносятся в группу, счётчики групп сходятся."""
+        self.assertEqual(self.group_count(self.source), 7)
+        self.assertEqual(self.group_count(self.target), 0)
+        generation = get_generation(FEED_PAGES)
+        self.act(
+            'post', 'move_to_group',
+            [post.pk for post in self.posts[:5]], group=self.target.pk
+        )
+        self.assertEqual(self.target.posts.count(), 5)
+        self.assertEqual(self.group_count(self.source), 2)
+        self.assertEqual(self.group_count(self.target), 5)
+        self.assertGreater(get_generation(FEED_PAGES), generation)
+
+    def test_purge_comments_by_author(self):
+        """Удаляются все комментарии автора, comment_count поправлен."""
+        spammer = User.objects.create_user(username='spammer')
+        for post in self.posts:
+            Comment.objects.create(post=post, author=spammer, text='Спам')
+            Comment.objects.create(post=post, author=self.reader, text='Ок')
+        selected = Comment.objects.filter(author=spammer).first()
+        self.act('comment', 'purge_by_authors', [selected.pk])
+        self.assertFalse(Comment.objects.filter(author=spammer).exists())
+        self.assertEqual(Comment.objects.count(), 7)
+        self.assertEqual(
+            set(Post.objects.values_list('comment_count', flat=True)), {1}
+        )
+
+    def test_remove_follows(self):
+        """Подписки удаляются вместе с записями в лентах."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        other = User.objects.create_user(username='other')
+        kept = Follow.objects.create(user=other, author=self.author)
+        self.assertEqual(FeedEntry.objects.count(), 14)
+        removed = Follow.objects.filter(user=self.reader)
+        self.act('follow', 'remove_follows', list(
+            removed.values_list('pk', flat=True)
+        ))
+        self.assertEqual(list(Follow.objects.all()), [kept])
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(FeedEntry.objects.filter(user=other).count(), 7)
+
+    def test_delete_posts(self):
+        """Посты удаляются пачками с комментариями, лентами и
+        счётчиками; поштучного delete_selected нет."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        for post in self.posts:
+            Comment.objects.create(post=post, author=self.reader, text='Ок')
+        self.assertEqual(self.group_count(self.source), 7)
+        response = self.act(
+            'post', 'delete_posts', [post.pk for post in self.posts[:5]]
+        )
+        self.assertNotContains(response, 'value="delete_selected"')
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertEqual(FeedEntry.objects.count(), 2)
+        self.assertEqual(self.group_count(self.source), 2)
+        self.assertEqual(
+            get_count(author_key(self.author.pk), self.author.posts.all()), 2
+        )
+
+    def test_delete_comments(self):
+        """Выбранные комментарии удаляются, comment_count поправлен."""
+        comments = [
+            Comment.objects.create(post=post, author=self.reader, text='Ок')
+            for post in self.posts[:4]
+        ]
+        self.act('comment', 'delete_comments', [
+            comment.pk for comment in comments[:3]
+        ])
+        self.assertEqual(list(Comment.objects.all()), comments[3:])
+        self.assertEqual(
+            list(Post.objects.filter(comment_count=1)), [self.posts[3]]
+        )
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+MANAGE: str = os.path.join(settings.BASE_DIR, 'manage.py')
+
+
+def benchmark(*args):
+    """Замер в отдельном процессе: он сам поднимает временные базы."""
+    return subprocess.run(
+        [sys.executable, MANAGE, 'benchmark_views', '--scales', '50',
+         '--requests', '3', '--warmup', '0', *args],
+        capture_output=True, text=True, timeout=300,
+    )
+
+
+class BenchmarkViewsTest(SimpleTestCase):
+    def test_report_and_compare(self):
+        """Замер отдаёт процентили и запросы, сравнение ловит рост."""
+        result = benchmark()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        report = json.loads(result.stdout)
+        views = report['results']['50']
+        self.assertEqual(len(views), 7)
+        self.assertEqual(
+            set(views['index']),
+            {'p50_ms', 'p95_ms', 'p99_ms', 'queries', 'memory_kb'}
+        )
+        self.assertLessEqual(
+            views['index']['p50_ms'], views['index']['p99_ms']
+        )
+        for metrics in views.values():
+            metrics['queries'] -= 1
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            with open(baseline, 'w') as output:
+                json.dump(report, output)
+            result = benchmark(
+                '--views', 'index', '--compare', baseline,
+                '--threshold', '100'
+            )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('queries', result.stderr)
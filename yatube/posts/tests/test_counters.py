@@ -0,0 +1,167 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..counters import (POSTS_KEY, author_key, change_comment_counts,
+                        get_count, group_key)
+from ..models import Comment, Counter, Group, Post
+
+
+User = get_user_model()
+
+
+class CounterTest(TestCase):
+    databases = {'default', 'shard_1'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.create(author=cls.author, text='Пост', group=cls.group)
+
+    def counts(self) -> dict:
+        return {
+            POSTS_KEY: get_count(POSTS_KEY, Post.objects.all()),
+            'author': get_count(
+                author_key(self.author.pk), self.author.posts.all()
+            ),
+            'group': get_count(group_key(self.group.pk), self.group.posts),
+            'other': get_count(
+                group_key(self.other_group.pk), self.other_group.posts
+            ),
+        }
+
+    def test_signals_keep_counters(self):
+        """Счётчики следуют за созданием, правкой и удалением постов."""
+        self.assertEqual(
+            self.counts(),
+            {POSTS_KEY: 1, 'author': 1, 'group': 1, 'other': 0}
+        )
+        post = Post.objects.create(
+            author=self.author, text='Ещё пост', group=self.group
+        )
+        self.assertEqual(
+            self.counts(),
+            {POSTS_KEY: 2, 'author': 2, 'group': 2, 'other': 0}
+        )
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(
+            self.counts(),
+            {POSTS_KEY: 2, 'author': 2, 'group': 1, 'other': 1}
+        )
+        post.delete()
+        self.assertEqual(
+            self.counts(),
+            {POSTS_KEY: 1, 'author': 1, 'group': 1, 'other': 0}
+        )
+
+    def test_rebuild_counters_command(self):
+        """Команда rebuild_counters чинит разошедшиеся счётчики."""
+        self.counts()
+        Counter.objects.filter(name=POSTS_KEY).update(value=100)
+        Post.objects.bulk_create(
+            [Post(author=self.author, text='Пост') for _ in range(3)]
+        )
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(
+            self.counts(),
+            {POSTS_KEY: 4, 'author': 4, 'group': 1, 'other': 0}
+        )
+
+    def test_missing_counter_filled_by_one_insert(self):
+        """Отсутствующий счётчик заводится одним INSERT ... SELECT."""
+        with self.assertNumQueries(3):
+            self.assertEqual(get_count(POSTS_KEY, Post.objects.all()), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_count(POSTS_KEY, Post.objects.all()), 1)
+        self.assertEqual(Counter.objects.get(name=POSTS_KEY).value, 1)
+
+    def test_missing_counter_read_back_from_primary(self):
+        """Счётчик, заведённый при чтении с реплики, сразу читается."""
+        # Пустой шард изображает реплику, ещё не видевшую счётчика.
+        with override_settings(DATABASE_REPLICAS=['shard_1']), \
+                mock.patch('core.routers.local', alias='shard_1'):
+            self.assertEqual(get_count(POSTS_KEY, Post.objects.all()), 1)
+
+    def test_profile_reads_counter(self):
+        """Профиль и пост показывают число постов из счётчика."""
+        self.counts()
+        Counter.objects.filter(
+            name=author_key(self.author.pk)
+        ).update(value=42)
+        client = Client()
+        response = client.get(
+            reverse('posts:profile', kwargs={'username': 'author'})
+        )
+        self.assertEqual(response.context['posts_count'], 42)
+        self.assertEqual(response.context['page_obj'].paginator.count, 42)
+
+
+class CommentCountTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(CommentCountTest.author)
+
+    def comment_count(self) -> int:
+        self.post.refresh_from_db(fields=['comment_count'])
+        return self.post.comment_count
+
+    def test_comment_count_follows_comments(self):
+        """Число комментариев растёт с add_comment и падает при удалении."""
+        for _ in range(2):
+            self.client.post(
+                reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+                {'text': 'Комментарий'}
+            )
+        self.assertEqual(self.comment_count(), 2)
+        Comment.objects.filter(post=self.post).first().delete()
+        self.assertEqual(self.comment_count(), 1)
+
+    def test_comment_count_stops_at_zero(self):
+        """Сдвиг больше счётчика опускает его до нуля, а не пропускается."""
+        Post.objects.filter(pk=self.post.pk).update(comment_count=1)
+        change_comment_counts({self.post.pk: -3})
+        self.assertEqual(self.comment_count(), 0)
+
+    def test_post_save_keeps_comment_count(self):
+        """Сохранение поста не затирает число комментариев."""
+        post = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=post, author=self.author, text='Текст')
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(self.comment_count(), 1)
+
+    def test_reconcile_comment_counts_command(self):
+        """Команда reconcile_comment_counts чинит разошедшееся число."""
+        Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.author, text='Комментарий')
+            for _ in range(3)
+        ])
+        self.assertEqual(self.comment_count(), 0)
+        out = StringIO()
+        call_command('reconcile_comment_counts', stdout=out)
+        self.assertEqual(self.comment_count(), 3)
+        self.assertIn('1', out.getvalue())
+        Comment.objects.filter(post=self.post).delete()
+        self.assertEqual(self.comment_count(), 0)
@@ -0,0 +1,104 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+
+User = get_user_model()
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        for i in range(5):
+            post = Post.objects.create(
+                author=cls.author, text=f'Пост, "{i}"\nстрока',
+                group=cls.group if i % 2 else None,
+            )
+        Post.objects.create(author=cls.reader, text='Пост читателя')
+        Comment.objects.create(post=post, author=cls.reader, text='Ответ')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(ExportTest.staff)
+
+    def export(self, kind, **options) -> str:
+        out = StringIO()
+        call_command('export', kind, stdout=out, chunk_size=2, **options)
+        return out.getvalue()
+
+    def test_command_streams_jsonl_and_csv(self):
+        """Команда выгружает строки в JSONL и CSV с именами и slug."""
+        lines = self.export('posts', user='author').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(
+            {record['author'] for record in records}, {'author'}
+        )
+        self.assertEqual(records[1]['group'], 'group-slug')
+        self.assertIsNone(records[0]['group'])
+        rows = list(csv.DictReader(StringIO(self.export(
+            'follows', format='csv'
+        ))))
+        self.assertEqual(
+            [(row['user'], row['author']) for row in rows],
+            [('reader', 'author')]
+        )
+        comments = list(csv.DictReader(StringIO(self.export(
+            'comments', format='csv'
+        ))))
+        self.assertEqual(comments[0]['author'], 'reader')
+
+    def test_export_imports_back(self):
+        """Выгрузку постов принимает import_posts."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.csv.gz')
+            call_command(
+                'export', 'posts', format='csv', gzip=True, output=path
+            )
+            texts = sorted(Post.objects.values_list('text', flat=True))
+            Post.objects.all().delete()
+            call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)), texts
+        )
+        self.assertEqual(self.group.posts.count(), 2)
+
+    def test_view_streams_for_staff_only(self):
+        """Вьюха отдаёт выгрузку потоком и только персоналу."""
+        url = reverse('posts:export', kwargs={'kind': 'posts'})
+        response = self.client.get(url, {'gzip': 1})
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="posts.jsonl.gz"'
+        )
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(content.decode().splitlines()), 6)
+        response = self.client.get(url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+        self.client.force_login(ExportTest.author)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.streaming)
@@ -0,0 +1,119 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from ..counters import POSTS_KEY, author_key, get_count, group_key
+from ..models import FeedEntry, Follow, Group, Post, PostKey
+
+
+User = get_user_model()
+
+
+class ImportPostsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Счётчики заведены до импорта: импорт должен их сдвинуть.
+        self.assertEqual(self.counts(), [0, 0, 0])
+
+    def counts(self) -> list:
+        return [
+            get_count(POSTS_KEY, Post.objects.all()),
+            get_count(author_key(self.author.pk), self.author.posts.all()),
+            get_count(group_key(self.group.pk), self.group.posts.all()),
+        ]
+
+    def write(self, name, lines) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as source:
+            source.write(''.join(f'{line}\n' for line in lines))
+        return path
+
+    def import_posts(self, path, **options) -> str:
+        out = StringIO()
+        call_command('import_posts', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_jsonl(self):
+        """Посты из JSONL получают ключи, даты, счётчики и ленты."""
+        records = [
+            {'author': 'author', 'text': f'Пост {i}', 'group': 'group-slug',
+             'pub_date': f'2020-01-0{i + 1}T10:00:00+00:00'}
+            for i in range(5)
+        ]
+        records.append({'author': 'nobody', 'text': 'Чужой'})
+        records.append({'author': 'author', 'text': 'Без группы'})
+        path = self.write('posts.jsonl', map(json.dumps, records))
+        output = self.import_posts(path, batch_size=2)
+        self.assertIn('Загружено постов: 6, пропущено: 1', output)
+        self.assertIn('строк/с', output)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+        post = Post.objects.get(text='Пост 3')
+        self.assertEqual(
+            post.pub_date, datetime(2020, 1, 4, 10, tzinfo=timezone.utc)
+        )
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(self.counts(), [6, 6, 5])
+        self.assertFalse(PostKey.objects.exists())
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 6)
+
+    def test_import_csv(self):
+        """CSV с заголовком и многострочными полями."""
+        path = self.write('posts.csv', [
+            'author,text,group',
+            'author,"Первая строка',
+            'вторая строка",',
+            'author,Просто пост,unknown-group',
+            'author,Ещё пост,group-slug',
+        ])
+        output = self.import_posts(path)
+        self.assertIn('Загружено постов: 2, пропущено: 1', output)
+        self.assertEqual(
+            set(Post.objects.values_list('text', flat=True)),
+            {'Первая строка\nвторая строка', 'Ещё пост'}
+        )
+        self.assertEqual(self.counts(), [2, 2, 1])
+
+    def test_resume_from_checkpoint(self):
+        """После сбоя импорт продолжается с отметки, без дублей."""
+        lines = [
+            json.dumps({'author': 'author', 'text': f'Пост {i}'})
+            for i in range(4)
+        ]
+        path = self.write('posts.jsonl', [*lines, '{не json'])
+        with self.assertRaises(CommandError):
+            self.import_posts(path, batch_size=2)
+        self.assertEqual(Post.objects.count(), 4)
+        self.assertTrue(os.path.exists(f'{path}.checkpoint'))
+        # Испорченная строка исправлена, строки до неё не тронуты.
+        self.write('posts.jsonl', [
+            *lines, json.dumps({'author': 'author', 'text': 'Пост 4'})
+        ])
+        output = self.import_posts(path, batch_size=2)
+        self.assertIn('Продолжаем с отметки: 4', output)
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)),
+            [f'Пост {i}' for i in range(5)]
+        )
+        self.assertEqual(self.counts()[:2], [5, 5])
@@ -0,0 +1,141 @@
+import re
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core.queries import capture_queries
+from ..counters import rebuild_counts
+from ..models import Comment, Follow, Group, Post
+
+
+User = get_user_model()
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)( USING)?')
+
+
+def query_plan(alias, sql, params) -> list:
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def is_full_scan(step, tables, filtered) -> bool:
+    """Полный просмотр таблицы или, при условии WHERE, её индекса.
+
+    Просмотр индекса без условий — это чтение первых строк по порядку
+    индекса (с LIMIT) или COUNT(*) всей таблицы.
+    """
+    match = SCAN_RE.match(step)
+    return bool(match) and match.group(1) in tables and (
+        filtered or not match.group(2)
+    )
+
+
+def plan_problems(sql, plan, tables) -> list:
+    """Шаги плана с полным просмотром или временной сортировкой."""
+    filtered = ' WHERE ' in sql
+    return [
+        step for step in plan
+        if 'USE TEMP B-TREE' in step or is_full_scan(step, tables, filtered)
+    ]
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN из SQLite')
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(3)
+        ]
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        for i in range(45):
+            post = Post.objects.create(
+                author=cls.authors[i % 3],
+                text=f'Пост {i}',
+                group=cls.group,
+            )
+        Comment.objects.bulk_create([
+            Comment(post=post, author=cls.reader, text=f'Комментарий {i}')
+            for i in range(60)
+        ])
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.post = post
+        # Счётчики уже заведены, как на живом сайте: нумерованные
+        # страницы укладываются в бюджет запросов.
+        rebuild_counts()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(QueryPlanTest.reader)
+
+    def assertIndexedPlans(self, path, cursor_context=None):
+        """Все SELECT страницы (и следующей по курсору) идут по индексам.
+
+        cursor_context — имя объекта страницы в контексте; с ним
+        проверяется и переход на следующую страницу.
+        """
+        tables = set(connection.introspection.table_names())
+        with capture_queries() as log:
+            response = self.client.get(path)
+            if cursor_context is not None:
+                page = response.context[cursor_context]
+                self.assertIsNotNone(page.next_cursor)
+                self.client.get(path, {'after': page.next_cursor})
+        self.assertTrue(log.statements)
+        for alias, sql, params in log.statements:
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            plan = query_plan(alias, sql, params)
+            problems = plan_problems(sql, plan, tables)
+            self.assertFalse(
+                problems, f'{path}: {sql}\nплан: {plan}'
+            )
+
+    def test_feed_plans(self):
+        """Ленты читаются по составным индексам без сортировки."""
+        paths = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'group-slug'}),
+            reverse('posts:profile', kwargs={'username': 'author_0'}),
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertIndexedPlans(path, 'page_obj')
+            with self.subTest(path=path, page=2):
+                self.assertIndexedPlans(f'{path}?page=2')
+
+    def test_post_detail_plans(self):
+        """Пост и его комментарии читаются по индексам."""
+        self.assertIndexedPlans(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        self.assertIndexedPlans(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            'comments_page'
+        )
+
+    def test_follow_feed_plans(self):
+        """Лента подписок обоих движков читается по индексам.
+
+        Нумерованные страницы движка merge строятся JOIN по подпискам;
+        порядок постов разных авторов там даёт только сортировка, поэтому
+        для merge проверяются курсорные страницы.
+        """
+        path = reverse('posts:follow_index')
+        with self.settings(FOLLOW_FEED_ENGINE='fanout'):
+            self.assertIndexedPlans(path, 'page_obj')
+            self.assertIndexedPlans(f'{path}?page=2')
+        with self.settings(FOLLOW_FEED_ENGINE='merge'):
+            self.assertIndexedPlans(path, 'page_obj')
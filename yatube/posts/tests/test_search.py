@@ -0,0 +1,97 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core.queries import capture_queries
+from ..models import Post
+from ..search import FTS_TABLE, TRIGGERS
+
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 из SQLite')
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        cls.ranked = Post.objects.create(
+            author=cls.author, text='Кошка и кошка: <b>кошки</b> повсюду'
+        )
+        cls.other = Post.objects.create(
+            author=cls.author, text='Собака видела одну кошку'
+        )
+        Post.objects.bulk_create([
+            Post(author=cls.author, text=f'Заметка о погоде {i}')
+            for i in range(15)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def found(self, query, **params) -> list:
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        return list(response.context['page_obj'].object_list)
+
+    def test_index_is_kept_by_triggers(self):
+        """Триггеры индекса на месте после всех миграций."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+            )
+            triggers = {row[0] for row in cursor.fetchall()}
+        self.assertLessEqual(set(TRIGGERS), triggers)
+        self.assertIn(FTS_TABLE, connection.introspection.table_names())
+
+    def test_search_ranks_and_highlights(self):
+        """Лучшее совпадение первым, отрывок подсвечен и экранирован."""
+        posts = self.found('кошк')
+        self.assertEqual(posts, [self.ranked, self.other])
+        snippet = posts[0].snippet
+        self.assertIn('<mark>Кошка</mark>', snippet)
+        self.assertIn('&lt;b&gt;<mark>кошки</mark>&lt;/b&gt;', snippet)
+        self.assertEqual(self.found('собака кошку'), [self.other])
+        self.assertEqual(self.found('OR NEAR *'), [])
+        self.assertEqual(self.found(''), [])
+
+    def test_index_follows_writes(self):
+        """Правка, удаление и bulk_create сразу видны в поиске."""
+        self.assertEqual(len(self.found('погоде', page=2)), 5)
+        post = Post.objects.get(pk=self.other.pk)
+        Post.objects.filter(pk=post.pk).update(text='Про лису')
+        self.assertEqual(self.found('кошк'), [self.ranked])
+        self.assertEqual(self.found('лису'), [post])
+        post.delete()
+        self.assertEqual(self.found('лису'), [])
+
+    def test_pages_keep_query(self):
+        """Ссылки паджинатора сохраняют поисковый запрос."""
+        response = self.client.get(reverse('posts:search'), {'q': 'погоде'})
+        self.assertContains(response, 'href="?q=%D0%BF%D0%BE%D0%B3%D0%BE'
+                                      '%D0%B4%D0%B5&amp;page=2"')
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по индексу, а не по LIKE."""
+        self.client.force_login(SearchTest.admin)
+        with capture_queries() as log:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'кошк'}
+            )
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {self.ranked, self.other}
+        )
+        statements = [sql for _, sql, _ in log.statements]
+        self.assertTrue(any(FTS_TABLE in sql for sql in statements))
+        self.assertFalse(any(' LIKE ' in sql for sql in statements))
@@ -0,0 +1,72 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.test import TestCase
+
+from ..counters import POSTS_KEY, get_count
+from ..models import Comment, FeedEntry, Follow, Post, PostKey
+
+
+User = get_user_model()
+OPTIONS = {
+    'users': 60, 'groups': 4, 'posts': 600, 'comments': 300,
+    'follows': 100, 'celebrities': 2, 'celebrity_reach': 0.5,
+    'until': '2024-01-31', 'batch_size': 128,
+}
+
+
+class SeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def seed(self, **options) -> str:
+        out = StringIO()
+        call_command('seed', stdout=out, **{**OPTIONS, **options})
+        return out.getvalue()
+
+    def snapshot(self) -> dict:
+        return {
+            'posts': list(Post.objects.order_by('pk').values_list(
+                'author__username', 'group__slug', 'text', 'pub_date'
+            )),
+            'follows': set(Follow.objects.values_list(
+                'user__username', 'author__username'
+            )),
+            'comments': list(Comment.objects.order_by('pk').values_list(
+                'post__text', 'author__username', 'created'
+            )),
+        }
+
+    def test_seed_is_skewed_and_consistent(self):
+        """Данные с перекосом, а ключи и счётчики сходятся."""
+        output = self.seed(feeds=True)
+        self.assertIn('Посты: 600', output)
+        self.assertFalse(PostKey.objects.exists())
+        self.assertEqual(get_count(POSTS_KEY, Post.objects.all()), 600)
+        self.assertEqual(
+            Post.objects.aggregate(total=Sum('comment_count'))['total'], 300
+        )
+        per_author = sorted(User.objects.annotate(
+            total=Count('posts')
+        ).values_list('total', flat=True), reverse=True)
+        self.assertGreater(per_author[0], 10 * per_author[30])
+        followers = sorted(User.objects.annotate(
+            total=Count('following')
+        ).values_list('total', flat=True), reverse=True)
+        self.assertGreaterEqual(followers[1], 29)
+        self.assertTrue(FeedEntry.objects.exists())
+
+    def test_seed_is_deterministic(self):
+        """Одно зерно — одни и те же данные, другое — другие."""
+        snapshots = []
+        for seed in (7, 7, 8):
+            with transaction.atomic():
+                self.seed(seed=seed)
+                snapshots.append(self.snapshot())
+                transaction.set_rollback(True)
+        self.assertEqual(snapshots[0], snapshots[1])
+        self.assertNotEqual(snapshots[0]['posts'], snapshots[2]['posts'])
@@ -0,0 +1,278 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.queries import capture_queries
+from ..bulk import delete_posts, insert_posts, move_posts
+from ..models import Comment, FeedEntry, Group, Post, PostKey
+from ..shards import hashed_shard, shard_for
+
+
+User = get_user_model()
+SHARDS = ['default', 'shard_1']
+
+
+# QUERY_BUDGETS посчитаны на один шард: лента читает каждый шард
+# своими запросами.
+@override_settings(POST_SHARDS=SHARDS, QUERY_BUDGET_STRICT=False)
+class ShardingTest(TestCase):
+    databases = {'default', 'shard_1'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache.clear()
+        cls.authors = {}
+        number = 0
+        while len(cls.authors) < len(SHARDS):
+            user = User.objects.create_user(username=f'author_{number}')
+            cls.authors.setdefault(hashed_shard(user.pk), user)
+            number += 1
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        for i in range(12):
+            Post.objects.create(
+                author=cls.authors[SHARDS[i % 2]],
+                text=f'Пост {i}',
+                group=cls.group,
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(ShardingTest.reader)
+
+    def texts(self, page) -> list:
+        return [post.text for post in page.object_list]
+
+    def test_posts_live_on_author_shard(self):
+        """Посты лежат на шарде автора, id уникальны на всех шардах."""
+        ids = []
+        for alias, author in self.authors.items():
+            with self.subTest(alias=alias):
+                posts = Post.objects.using(alias)
+                self.assertEqual(posts.filter(author=author).count(), 6)
+                self.assertEqual(posts.exclude(author=author).count(), 0)
+                ids += posts.values_list('id', flat=True)
+        self.assertEqual(len(set(ids)), 12)
+
+    def test_feeds_merge_shards(self):
+        """Главная и группа сливают шарды по дате публикации."""
+        newest = [f'Пост {i}' for i in range(11, 1, -1)]
+        paths = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'group-slug'}),
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                page = self.client.get(path).context['page_obj']
+                self.assertEqual(self.texts(page), newest)
+                self.assertEqual(page.paginator.count, 12)
+                following = self.client.get(
+                    path, {'after': page.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(self.texts(following), ['Пост 1', 'Пост 0'])
+                numbered = self.client.get(
+                    path, {'page': 2}
+                ).context['page_obj']
+                self.assertEqual(self.texts(numbered), ['Пост 1', 'Пост 0'])
+
+    def test_author_pages_read_one_shard(self):
+        """Профиль и пост читают посты и комментарии с одного шарда."""
+        author = self.authors['shard_1']
+        post = Post.objects.using('shard_1').filter(author=author).first()
+        self.client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            {'text': 'Комментарий'},
+        )
+        comment = Comment.objects.using('shard_1').get(post_id=post.pk)
+        self.assertEqual(comment.author, self.reader)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        paths = [
+            reverse('posts:profile', kwargs={'username': author.username}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                cache.clear()
+                with capture_queries() as log:
+                    response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                aliases = {
+                    alias for alias, sql, _ in log.statements
+                    if '"posts_post"' in sql or '"posts_comment"' in sql
+                }
+                self.assertEqual(aliases, {'shard_1'})
+        self.assertEqual(
+            list(response.context['comments']), [comment]
+        )
+
+    def test_reshard_moves_author(self):
+        """reshard переносит посты и комментарии автора на другой шард."""
+        author = self.authors['shard_1']
+        post = Post.objects.using('shard_1').filter(author=author).first()
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        call_command(
+            'reshard', author.username, 'default', settle=0, stdout=StringIO()
+        )
+        self.assertEqual(shard_for(author.pk), 'default')
+        self.assertFalse(Post.objects.using('shard_1').exists())
+        self.assertFalse(Comment.objects.using('shard_1').exists())
+        self.assertEqual(
+            Post.objects.using('default').filter(author=author).count(), 6
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        )
+        self.assertEqual(response.context['post'], post)
+        self.assertEqual(len(response.context['comments']), 1)
+        page = self.client.get(reverse('posts:index')).context['page_obj']
+        self.assertEqual(len(page.object_list), 10)
+
+    def test_reshard_keeps_dates_and_ids(self):
+        """reshard сохраняет даты постов и комментариев и свободные id."""
+        author = self.authors['shard_1']
+        post = Post.objects.using('shard_1').filter(author=author).first()
+        kept, clashing = [
+            Comment.objects.create(post=post, author=self.reader, text=text)
+            for text in ('Свободный id', 'Занятый id')
+        ]
+        Comment.objects.create(
+            pk=clashing.pk,
+            post=Post.objects.using('default').first(),
+            author=self.reader,
+            text='Чужой комментарий',
+        )
+        dated = Post.objects.using('shard_1').filter(author=author)
+        dates = dict(dated.values_list('pk', 'pub_date'))
+        created = dict(Comment.objects.using('shard_1').values_list(
+            'text', 'created'
+        ))
+        call_command(
+            'reshard', author.username, 'default', settle=0, stdout=StringIO()
+        )
+        self.assertEqual(dict(Post.objects.using('default').filter(
+            author=author
+        ).values_list('pk', 'pub_date')), dates)
+        moved = Comment.objects.using('default').filter(post=post)
+        self.assertEqual(
+            dict(moved.values_list('text', 'created')), created
+        )
+        self.assertEqual(moved.get(text='Свободный id').pk, kept.pk)
+        self.assertNotEqual(moved.get(text='Занятый id').pk, clashing.pk)
+
+    def test_new_shard_takes_only_its_authors(self):
+        """Новый шард забирает авторов только себе, не тасуя прочих."""
+        before = {author_id: hashed_shard(author_id)
+                  for author_id in range(1000)}
+        with override_settings(POST_SHARDS=[*SHARDS, 'shard_2']):
+            after = {author_id: hashed_shard(author_id)
+                     for author_id in range(1000)}
+        moved = {author_id for author_id in before
+                 if before[author_id] != after[author_id]}
+        self.assertEqual({after[author_id] for author_id in moved},
+                         {'shard_2'})
+        self.assertLess(len(moved), 500)
+
+    def test_move_posts_on_all_shards(self):
+        """Перенос в группу меняет посты на всех шардах."""
+        target = Group.objects.create(
+            title='Другая группа', slug='other-slug', description='Текст'
+        )
+        moved = move_posts(Post.objects.all(), target)
+        self.assertEqual(moved, 12)
+        for alias in SHARDS:
+            with self.subTest(alias=alias):
+                self.assertEqual(
+                    Post.objects.using(alias).filter(group=target).count(), 6
+                )
+
+    def test_delete_posts_on_all_shards(self):
+        """Удаление пачкой убирает посты и их ключи на всех шардах."""
+        deleted = delete_posts(
+            Post.objects.filter(text__in=['Пост 0', 'Пост 1'])
+        )
+        self.assertEqual(deleted, 2)
+        self.assertEqual(PostKey.objects.count(), 10)
+        self.assertEqual(
+            sum(Post.objects.using(alias).count() for alias in SHARDS), 10
+        )
+
+    def test_search_fans_out(self):
+        """Поиск находит посты со всех шардов."""
+        response = self.client.get(reverse('posts:search'), {'q': 'пост'})
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 12)
+        self.assertEqual(
+            {post.author for post in page.object_list},
+            set(self.authors.values())
+        )
+
+    def test_insert_posts_places_on_author_shards(self):
+        """Пачка постов ложится на шарды авторов с общими ключами."""
+        posts = insert_posts([
+            Post(author=author, text=f'Импорт {alias}')
+            for alias, author in self.authors.items()
+        ])
+        for alias, post in zip(self.authors, posts):
+            with self.subTest(alias=alias):
+                self.assertEqual(
+                    Post.objects.using(alias).get(pk=post.pk).text,
+                    f'Импорт {alias}'
+                )
+        self.assertEqual(PostKey.objects.count(), 14)
+        page = self.client.get(reverse('posts:index')).context['page_obj']
+        self.assertEqual(
+            {post.text for post in page.object_list[:2]},
+            {f'Импорт {alias}' for alias in SHARDS}
+        )
+
+    def test_check_references_command(self):
+        """check_references чинит ссылки на удалённых авторов, группы
+        и посты: ограничений базы у них нет."""
+        author = self.authors['shard_1']
+        ghost = User.objects.create_user(username='ghost')
+        group = Group.objects.create(
+            title='Удаляемая группа', slug='gone', description='Описание'
+        )
+        post = Post.objects.create(author=author, text='Пост', group=group)
+        ghost_post = Post.objects.create(author=ghost, text='Пост')
+        comment = Comment.objects.create(post=post, author=ghost, text='Текст')
+        FeedEntry.objects.create(
+            user=self.reader, post_id=10 ** 6, pub_date=post.pub_date
+        )
+        User.objects.filter(pk=ghost.pk)._raw_delete('default')
+        Group.objects.filter(pk=group.pk)._raw_delete('default')
+        out = StringIO()
+        call_command('check_references', '--fix', stdout=out)
+        self.assertIn(
+            'Посты без автора: 1, с удалённой группой: 1, '
+            'комментарии без автора: 1, записи лент без поста: 1',
+            out.getvalue()
+        )
+        for alias in SHARDS:
+            with self.subTest(alias=alias):
+                self.assertFalse(Post.objects.using(alias).filter(
+                    pk=ghost_post.pk
+                ).exists())
+                self.assertFalse(Comment.objects.using(alias).filter(
+                    pk=comment.pk
+                ).exists())
+        self.assertIsNone(
+            Post.objects.using('shard_1').get(pk=post.pk).group_id
+        )
+        self.assertFalse(FeedEntry.objects.filter(post_id=10 ** 6).exists())
+        out = StringIO()
+        call_command('check_references', stdout=out)
+        self.assertIn(
+            'Посты без автора: 0, с удалённой группой: 0', out.getvalue()
+        )
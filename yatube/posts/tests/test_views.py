@@ -1,16 +1,24 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 
 from xmlrpc.client import Boolean
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django import forms
-from django.test import Client, TestCase, override_settings
+from django.db import transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
-from django.core.cache import cache
-from ..models import Post, Group, Follow, Comment
+from django.core.cache import cache, caches
+from core.queries import capture_queries
+from core.testing import QueryBudgetMixin
+from .. import caching, feeds, timelines, views
+from ..models import Post, Group, Follow, Comment, FeedEntry, PendingFanOut
 
 
 User = get_user_model()
@@ -92,6 +100,19 @@ class PostPagesTests(TestCase):
                 response = self.auth_client.get(reverse_name)
                 self.assertTemplateUsed(response, template)
 
+    def test_thumbnails_do_not_query_database(self):
+        """Миниатюры картинок не читают и не пишут базу."""
+        caches['thumbnails'].clear()
+        for _ in range(2):
+            with capture_queries() as log:
+                response = self.guest_client.get(reverse('posts:index'))
+            self.assertContains(response, '<img')
+            self.assertFalse([
+                sql for _, sql, _ in log.statements
+                if 'thumbnail_kvstore' in sql
+            ])
+            cache.clear()
+
     def test_pages_show_correct_context(self):
         """Шаблоны сформированы с правильным контекстом."""
         pages_names_context = {
@@ -210,6 +231,39 @@ class PaginatorViewsTest(TestCase):
                 response = self.client.get(reverse_name + '?page=2')
                 self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cursor_pages_contains(self):
+        """Курсорный паджинатор листает ленту вперёд и назад."""
+        reverse_name = reverse('posts:index')
+        first_page = self.client.get(reverse_name).context['page_obj']
+        self.assertIsNone(first_page.previous_cursor)
+        self.assertIsNotNone(first_page.next_cursor)
+
+        second_page = self.client.get(
+            reverse_name + '?after=' + first_page.next_cursor
+        ).context['page_obj']
+        self.assertEqual(len(second_page), 3)
+        self.assertIsNone(second_page.next_cursor)
+        self.assertEqual(
+            [post.id for post in second_page],
+            [post.id for post in Post.objects.order_by('-pub_date', '-id')][
+                10:
+            ],
+        )
+
+        back_page = self.client.get(
+            reverse_name + '?before=' + second_page.previous_cursor
+        ).context['page_obj']
+        self.assertEqual(
+            [post.id for post in back_page],
+            [post.id for post in first_page],
+        )
+        self.assertIsNone(back_page.previous_cursor)
+
+    def test_cursor_broken_token(self):
+        """Испорченный курсор открывает первую страницу."""
+        response = self.client.get(reverse('posts:index') + '?after=%%%')
+        self.assertEqual(len(response.context['page_obj']), 10)
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -339,6 +393,173 @@ class FollowViewsTest(TestCase):
         first_object = response.context['page_obj'].object_list
         self.assertEqual(0, len(first_object))
 
+    @override_settings(FEED_FANOUT_BATCH_SIZE=2, FEED_FANOUT_ASYNC=False)
+    def test_new_post_fan_out(self):
+        """Новый пост попадает в ленты всех подписчиков пачками."""
+        followers = [
+            User.objects.create_user(username=f'follower_{i}')
+            for i in range(5)
+        ]
+        Follow.objects.bulk_create([
+            Follow(user=follower, author=FollowViewsTest.new_author)
+            for follower in followers
+        ])
+        post = Post.objects.create(
+            author=FollowViewsTest.new_author,
+            text='Новый пост'
+        )
+        self.assertEqual(
+            FeedEntry.objects.filter(post=post).count(), len(followers)
+        )
+        client = Client()
+        client.force_login(followers[0])
+        response = client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post])
+
+    @override_settings(TIMELINE_LENGTH=2)
+    def test_follow_backfills_recent_posts(self):
+        """Новый подписчик получает лишь последние посты автора."""
+        posts = [
+            Post.objects.create(
+                author=FollowViewsTest.new_author, text=f'Пост {i}'
+            )
+            for i in range(3)
+        ]
+        self.auth_client.post(reverse(
+            'posts:profile_follow', kwargs={'username': 'new_author'}
+        ))
+        self.assertEqual(
+            set(FeedEntry.objects.filter(
+                user=FollowViewsTest.auth_user,
+                post__author=FollowViewsTest.new_author
+            ).values_list('post', flat=True)),
+            {posts[1].pk, posts[2].pk}
+        )
+
+    def test_unfollow_trims_feed(self):
+        """Отписка убирает посты автора из ленты."""
+        self.assertTrue(
+            FeedEntry.objects.filter(user=FollowViewsTest.auth_user).exists()
+        )
+        self.auth_client.post(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': 'author'}
+        ))
+        self.assertFalse(
+            FeedEntry.objects.filter(user=FollowViewsTest.auth_user).exists()
+        )
+
+
+@override_settings(FEED_FANOUT_ASYNC=True)
+class QueuedFanOutTest(TransactionTestCase):
+    def test_fan_out_after_commit(self):
+        """В фоне пост раскладывается только после коммита."""
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        with transaction.atomic():
+            post = Post.objects.create(author=author, text='Пост')
+            self.assertFalse(FeedEntry.objects.exists())
+        feeds.wait_for_fan_out()
+        self.assertTrue(
+            FeedEntry.objects.filter(user=reader, post=post).exists()
+        )
+        self.assertFalse(PendingFanOut.objects.exists())
+
+    def test_lost_queue_fanned_out_by_command(self):
+        """Пост, потерянный очередью процесса, раскладывает команда."""
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        with mock.patch.object(feeds, '_enqueue'):
+            post = Post.objects.create(author=author, text='Пост')
+        PendingFanOut.objects.create(
+            post_id=post.pk + 1, author_id=author.pk, pub_date=post.pub_date
+        )
+        self.assertFalse(FeedEntry.objects.exists())
+        out = StringIO()
+        call_command('fan_out_pending', stdout=out)
+        self.assertIn('Разложено постов: 1', out.getvalue())
+        self.assertEqual(
+            list(FeedEntry.objects.values_list('post_id', flat=True)),
+            [post.pk]
+        )
+        self.assertFalse(PendingFanOut.objects.exists())
+
+
+@override_settings(FOLLOW_FEED_ENGINE='merge')
+class MergedFollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.auth_user = User.objects.create_user(username='auth_user')
+        cls.authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(3)
+        ]
+        for i in range(21):
+            Post.objects.create(
+                author=cls.authors[i % 3],
+                text='Пост' + str(i),
+            )
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.auth_user, author=author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(MergedFollowFeedTest.auth_user)
+
+    def expected_ids(self):
+        return list(Post.objects.filter(
+            author__in=MergedFollowFeedTest.authors[:2]
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def test_merged_feed_pages(self):
+        """Слияние лент авторов совпадает с запросом к базе."""
+        url = reverse('posts:follow_index')
+        for length in (200, 4):
+            with self.subTest(length=length), self.settings(
+                TIMELINE_LENGTH=length
+            ):
+                cache.clear()
+                ids = []
+                page_obj = self.client.get(url).context['page_obj']
+                ids += [post.id for post in page_obj]
+                while page_obj.next_cursor:
+                    page_obj = self.client.get(
+                        url + '?after=' + page_obj.next_cursor
+                    ).context['page_obj']
+                    ids += [post.id for post in page_obj]
+                self.assertEqual(ids, self.expected_ids())
+
+    def test_timeline_invalidated(self):
+        """Новый пост сразу попадает в собранную слиянием ленту."""
+        url = reverse('posts:follow_index')
+        self.client.get(url)
+        post = Post.objects.create(
+            author=MergedFollowFeedTest.authors[1],
+            text='Свежий пост',
+        )
+        page_obj = self.client.get(url).context['page_obj']
+        self.assertEqual(page_obj[0], post)
+
+    def test_invalidate_during_load_not_lost(self):
+        """Пост, созданный во время чтения ленты, не теряется в кэше."""
+        author = MergedFollowFeedTest.authors[0]
+        load = timelines._load
+        created = []
+
+        def racing_load(author_ids):
+            loaded = load(author_ids)
+            created.append(Post.objects.create(author=author, text='Гонка'))
+            return loaded
+
+        with mock.patch.object(timelines, '_load', racing_load):
+            timelines.get_timelines([author.pk])
+        timeline = timelines.get_timelines([author.pk])[author.pk]
+        self.assertEqual(timeline[0][1], created[0].pk)
+
 
 class CommentViewsTest(TestCase):
     @classmethod
@@ -358,6 +579,7 @@ class CommentViewsTest(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.client = Client()
 
     def test_add_comment_correct_context(self):
@@ -371,6 +593,169 @@ class CommentViewsTest(TestCase):
         self.assertEqual(comment_author_0, CommentViewsTest.auth_user)
         self.assertEqual(comment_text_0, 'Тестовый текст')
 
+    def test_comments_paginated(self):
+        """Комментарии отдаются пачками, следующая — фрагментом."""
+        Comment.objects.bulk_create([
+            Comment(
+                post=CommentViewsTest.post,
+                author=CommentViewsTest.auth_user,
+                text=f'Комментарий {i}'
+            )
+            for i in range(views.number_of_comments * 2)
+        ])
+        expected = list(CommentViewsTest.post.comments.order_by(
+            'created', 'id'
+        ).values_list('id', flat=True))
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': 1})
+        )
+        page = response.context['comments_page']
+        seen = [comment.id for comment in page.object_list]
+        while page.next_cursor:
+            response = self.client.get(
+                reverse('posts:post_comments', kwargs={'post_id': 1}),
+                {'after': page.next_cursor}
+            )
+            self.assertTemplateNotUsed(response, 'base.html')
+            page = response.context['comments_page']
+            self.assertLessEqual(
+                len(page.object_list), views.number_of_comments
+            )
+            seen += [comment.id for comment in page.object_list]
+        self.assertEqual(seen, expected)
+
+    def test_comments_fragment_unknown_post(self):
+        """Фрагмент комментариев несуществующего поста — 404."""
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 999})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [
+            User.objects.create_user(username=f'author_{i}')
+            for i in range(4)
+        ]
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        for i in range(12):
+            post = Post.objects.create(
+                author=cls.authors[i % 4],
+                text=f'Пост {i}',
+                group=cls.group,
+            )
+            for author in cls.authors:
+                Comment.objects.create(
+                    post=post, author=author, text='Комментарий'
+                )
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.post = post
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(QueryBudgetTest.reader)
+
+    def test_pages_within_query_budget(self):
+        """Страницы укладываются в бюджет запросов и не делают N+1."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'group-slug'}),
+            reverse('posts:profile', kwargs={'username': 'author_0'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+        clients = {'guest': Client(), 'reader': self.authorized_client}
+        for name, client in clients.items():
+            for url in urls:
+                with self.subTest(client=name, url=url):
+                    cache.clear()
+                    response = self.assertWithinBudget(client, url)
+                    self.assertEqual(response.status_code, 200)
+
+    def test_follow_index_within_query_budget(self):
+        """Лента подписок обоих движков укладывается в бюджет."""
+        for engine in ('fanout', 'merge'):
+            with self.subTest(engine=engine), self.settings(
+                FOLLOW_FEED_ENGINE=engine
+            ):
+                cache.clear()
+                response = self.assertWithinBudget(
+                    self.authorized_client, reverse('posts:follow_index')
+                )
+                self.assertEqual(len(response.context['page_obj']), 10)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый текст',
+            author=cls.user,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(ConditionalGetTest.user)
+
+    def test_unchanged_pages_not_modified(self):
+        """Неизменённые страницы отдают 304 без рендера шаблона."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'group-slug'}),
+            reverse('posts:profile', kwargs={'username': 'user'}),
+            reverse(
+                'posts:post_detail',
+                kwargs={'post_id': ConditionalGetTest.post.pk}
+            ),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertIsNone(response.context)
+
+    def test_edit_and_comment_change_etag(self):
+        """Правка поста и новый комментарий меняют ETag поста."""
+        post = ConditionalGetTest.post
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        actions = {
+            'edit': lambda: self.client.post(
+                reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+                {'text': 'Новый текст'}
+            ),
+            'comment': lambda: self.client.post(
+                reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+                {'text': 'Комментарий'}
+            ),
+        }
+        for name, action in actions.items():
+            with self.subTest(action=name):
+                etag = self.client.get(url)['ETag']
+                action()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
 
 class CachePagesTest(TestCase):
     @classmethod
@@ -379,17 +764,68 @@ class CachePagesTest(TestCase):
         cls.user = User.objects.create_user(username='user')
 
     def setUp(self):
+        cache.clear()
         self.client = Client()
 
     def test_index_page_have_cache(self):
         """Шаблон index хранится в кэше."""
-        posts = self.client.get(reverse('posts:index')).content
-        Post.objects.create(
+        post = Post.objects.create(
             text='Тестовый текст',
             author=CachePagesTest.user,
         )
+        posts = self.client.get(reverse('posts:index')).content
+        Post.objects.filter(pk=post.pk).update(text='Текст без сигнала')
         old_posts = self.client.get(reverse('posts:index')).content
         self.assertEqual(old_posts, posts)
         cache.clear()
         new_posts = self.client.get(reverse('posts:index')).content
         self.assertNotEqual(old_posts, new_posts)
+
+    def test_index_page_cache_invalidated(self):
+        """Изменение постов, групп и комментариев сбрасывает кэш index."""
+        post = Post.objects.create(
+            text='Тестовый текст',
+            author=CachePagesTest.user,
+        )
+        changes = {
+            'post': lambda: Post.objects.create(
+                text='Новый пост', author=CachePagesTest.user
+            ),
+            'group': lambda: Group.objects.create(
+                title='Группа', slug='new-group', description='Описание'
+            ),
+            'comment': lambda: Comment.objects.create(
+                text='Комментарий', post=post, author=CachePagesTest.user
+            ),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                self.client.get(reverse('posts:index'))
+                response = self.client.get(reverse('posts:index'))
+                self.assertIsNone(response.context)
+                change()
+                response = self.client.get(reverse('posts:index'))
+                self.assertIsNotNone(response.context)
+
+    def test_stale_page_while_rebuilding(self):
+        """Пока страницу пересобирает другой запрос, отдаётся старая копия."""
+        url = reverse('posts:profile', kwargs={'username': 'user'})
+        old_page = self.client.get(url).content
+        Post.objects.create(text='Новый пост', author=CachePagesTest.user)
+        stale = caching.stats['stale']
+        with mock.patch.object(caching.cache, 'add', return_value=False):
+            response = self.client.get(url)
+        self.assertEqual(response.content, old_page)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(caching.stats['stale'], stale + 1)
+        response = self.client.get(url)
+        self.assertContains(response, 'Новый пост')
+
+    def test_no_stale_page_waits_for_lock(self):
+        """Без старой копии запрос ждёт блокировку и строит страницу."""
+        url = reverse('posts:index')
+        waits = caching.stats['wait']
+        with mock.patch.object(caching.cache, 'add', return_value=False):
+            response = self.client.get(url)
+        self.assertIsNotNone(response.context)
+        self.assertEqual(caching.stats['wait'], waits + 1)
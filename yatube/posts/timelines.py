@@ -0,0 +1,149 @@
+import heapq
+from collections import defaultdict
+from itertools import dropwhile, islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from core.db import chunks
+from . import caching, shards
+from .models import Post
+
+# SQLite до 3.32 не принимает больше 999 параметров в одном запросе.
+AUTHORS_PER_QUERY: int = 500
+
+RECENT_POSTS_SQL: str = '''
+    SELECT id, author_id, pub_date FROM (
+        SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+        ) AS position
+        FROM posts_post
+        WHERE author_id IN ({placeholders})
+    ) WHERE position <= %s
+'''
+
+
+def timeline_key(author_id) -> str:
+    return f'timeline:{author_id}'
+
+
+def invalidate(author_id) -> None:
+    caching.bump_generation(timeline_key(author_id))
+
+
+def invalidate_many(author_ids) -> None:
+    caching.drop_generations(
+        [timeline_key(author_id) for author_id in author_ids]
+    )
+
+
+def _pub_date_converters(connection):
+    field = Post._meta.get_field('pub_date')
+    column = field.get_col(Post._meta.db_table)
+    return [
+        *connection.ops.get_db_converters(column),
+        *field.get_db_converters(connection),
+    ], column
+
+
+def _load_from(connection, author_ids, timelines) -> None:
+    converters, column = _pub_date_converters(connection)
+    with connection.cursor() as cursor:
+        for chunk in chunks(author_ids, AUTHORS_PER_QUERY):
+            cursor.execute(
+                RECENT_POSTS_SQL.format(
+                    placeholders=', '.join(['%s'] * len(chunk))
+                ),
+                [*chunk, settings.TIMELINE_LENGTH]
+            )
+            for post_id, author_id, pub_date in cursor.fetchall():
+                for converter in converters:
+                    pub_date = converter(pub_date, column, connection)
+                timelines[author_id].append((pub_date, post_id))
+
+
+def _load(author_ids) -> dict:
+    timelines = {author_id: [] for author_id in author_ids}
+    by_shard = defaultdict(list)
+    for author_id in author_ids:
+        by_shard[shards.shard_for(author_id)].append(author_id)
+    for alias, shard_authors in by_shard.items():
+        _load_from(connections[alias], shard_authors, timelines)
+    for timeline in timelines.values():
+        timeline.sort(reverse=True)
+    return timelines
+
+
+def get_timelines(author_ids) -> dict:
+    """Последние посты авторов как списки (pub_date, id) по убыванию.
+
+    Отсутствующие в кэше ленты читаются оконным запросом пачками.
+    Лента хранится с поколением, прочитанным до запроса к базе: если
+    invalidate() пришёл во время чтения, записанная копия уже
+    устарела и будет перечитана.
+    """
+    keys = {timeline_key(author_id): author_id for author_id in author_ids}
+    generations = dict(zip(author_ids, caching.get_generations(*keys)))
+    timelines = {}
+    for key, (generation, timeline) in cache.get_many(keys).items():
+        if generation == generations[keys[key]]:
+            timelines[keys[key]] = timeline
+    missing = [
+        author_id for author_id in author_ids if author_id not in timelines
+    ]
+    if missing:
+        loaded = _load(missing)
+        cache.set_many(
+            {timeline_key(author_id): (generations[author_id], timeline)
+             for author_id, timeline in loaded.items()},
+            settings.TIMELINE_TIMEOUT
+        )
+        timelines.update(loaded)
+    return timelines
+
+
+def merged_page(paginator, author_ids, after=None, before=None):
+    """Собирает страницу ленты k-way слиянием лент авторов.
+
+    Возвращает None, если страница уходит глубже закэшированных лент:
+    тогда её нужно строить запросом к базе.
+    """
+    timelines = get_timelines(author_ids).values()
+    # Глубже самой свежей «обрезанной» ленты данные неполные.
+    horizon = max(
+        (timeline[-1] for timeline in timelines
+         if len(timeline) >= settings.TIMELINE_LENGTH),
+        default=None
+    )
+    size = paginator.per_page
+    backwards = before is not None and after is None
+    if backwards:
+        if horizon is not None and before < horizon:
+            return None
+        newer = [
+            list(reversed([key for key in timeline if key > before]))
+            for timeline in timelines
+        ]
+        keys = list(islice(heapq.merge(*newer), size + 1))
+        has_more = len(keys) > size
+        keys = list(reversed(keys[:size]))
+    else:
+        if after is not None:
+            timelines = [
+                dropwhile(lambda key: key >= after, timeline)
+                for timeline in timelines
+            ]
+        keys = list(islice(heapq.merge(*timelines, reverse=True), size + 1))
+        has_more = len(keys) > size
+        if horizon is not None and (
+            len(keys) < size + 1 or keys[-1] < horizon
+        ):
+            return None
+        keys = keys[:size]
+
+    posts = shards.posts_in_bulk([post_id for _, post_id in keys])
+    rows = [posts[post_id] for _, post_id in keys if post_id in posts]
+    has_next = True if backwards else has_more
+    has_previous = has_more if backwards else after is not None
+    return paginator.build_page(rows, has_next, has_previous)
@@ -1,35 +1,65 @@
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
+from django.core.paginator import Paginator
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Group, Post, User, Follow
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from core.routers import read_from_replica
+from core.writes import serialized_write
+from .models import Comment, FeedEntry, Group, Post, User, Follow
 from .forms import PostForm, CommentForm
+from . import export, shards
+from .caching import content_generation, feed_etag, post_etag
+from .counters import POSTS_KEY, author_key, get_count, group_key
+from .paginators import CountedPaginator, CursorPaginator, decode_cursor
+from .search import find_posts
+from .timelines import merged_page
 
 number_of_last_records: int = 10
+number_of_comments: int = 50
 template_create_edit_post: str = 'posts/create_edit_post.html'
 
 
-def get_paginator(request, selection):
-    paginator = Paginator(selection, number_of_last_records)
+def get_paginator(request, selection, count_key=None, **kwargs):
+    paginator = CountedPaginator(
+        selection, number_of_last_records, count_key=count_key, **kwargs
+    )
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None or settings.POSTS_NUMBERED_PAGES:
+        return paginator.get_page(page_number)
+    return paginator.cursor_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
 
 
-@cache_page(20, key_prefix='index_page')
+@read_from_replica
+@condition(etag_func=feed_etag)
 def index(request):
-    post_list = Post.objects.select_related('author', 'group').all()
-    page_obj = get_paginator(request, post_list)
+    post_list = shards.across_shards(
+        shards.with_related(Post.objects.all(), 'author', 'group')
+    )
+    page_obj = get_paginator(request, post_list, POSTS_KEY)
     context = {
         'page_obj': page_obj,
+        'cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        'cache_generation': content_generation(request),
     }
     return render(request, 'posts/index.html', context)
 
 
+@read_from_replica
+@condition(etag_func=feed_etag)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.select_related('author', 'group').all()
-    page_obj = get_paginator(request, post_list)
+    post_list = shards.across_shards(shards.with_related(
+        Post.objects.filter(group=group), 'author', 'group'
+    ))
+    page_obj = get_paginator(request, post_list, group_key(group.pk))
     context = {
         'page_obj': page_obj,
         'group': group
@@ -37,33 +67,86 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@read_from_replica
+@condition(etag_func=feed_etag)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.select_related('author', 'group').all()
-    page_obj = get_paginator(request, post_list)
+    post_list = shards.with_related(author.posts.all(), 'author', 'group')
+    page_obj = get_paginator(request, post_list, author_key(author.pk))
     context = {
         'page_obj': page_obj,
         'username': author,
-        'following': request.user.is_authenticated and Follow.objects.filter(
-            user=request.user,
-            author=author
-        ).exists()
+        'posts_count': get_count(author_key(author.pk), author.posts.all()),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@read_from_replica
+@condition(etag_func=feed_etag)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    results = find_posts(query)
+    page_obj = Paginator(results, number_of_last_records).get_page(
+        request.GET.get('page')
+    )
+    context = {
+        'page_obj': page_obj,
+        'query': query,
+        'page_query': f'{urlencode({"q": query})}&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def get_comments_page(post_id, after=None, using=None):
+    comment_list = shards.with_related(
+        Comment.objects.using(using).filter(post_id=post_id), 'author'
+    )
+    paginator = CursorPaginator(
+        comment_list, number_of_comments, ordering=('created', 'id')
+    )
+    return paginator.cursor_page(after=after)
+
+
+@read_from_replica
+@condition(etag_func=post_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all()
+    using = shards.post_shard(post_id)
+    post = get_object_or_404(shards.with_related(
+        Post.objects.using(using), 'author', 'group'
+    ), id=post_id)
+    comments_page = get_comments_page(post.id, using=using)
     context = {
         'post': post,
+        'posts_count': get_count(
+            author_key(post.author_id),
+            Post.objects.using(using).filter(author_id=post.author_id)
+        ),
         'form': CommentForm(),
-        'comments': comments,
+        'comments': comments_page.object_list,
+        'comments_page': comments_page,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@read_from_replica
+@condition(etag_func=post_etag)
+def post_comments(request, post_id):
+    using = shards.post_shard(post_id)
+    if not Post.objects.using(using).filter(id=post_id).exists():
+        raise Http404
+    comments_page = get_comments_page(
+        post_id, request.GET.get('after'), using
+    )
+    context = {
+        'post_id': post_id,
+        'comments': comments_page.object_list,
+        'comments_page': comments_page,
+    }
+    return render(request, 'posts/includes/comments_batch.html', context)
+
+
 @login_required
+@serialized_write(methods=('POST',))
 def post_create(request):
     if request.method != 'POST':
         form = PostForm()
@@ -88,8 +171,11 @@ def post_create(request):
 
 
 @login_required
+@serialized_write(methods=('POST',))
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.using(shards.post_shard(post_id)), id=post_id
+    )
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post.id)
 
@@ -115,8 +201,11 @@ def post_edit(request, post_id):
 
 
 @login_required
+@serialized_write
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.using(shards.post_shard(post_id)), id=post_id
+    )
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -126,10 +215,61 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+def get_fanout_page(request):
+    entries = FeedEntry.objects.filter(user=request.user)
+    if not shards.is_sharded():
+        entries = entries.select_related('post__author', 'post__group')
+    page_obj = get_paginator(
+        request, entries, ordering=('-pub_date', '-post_id')
+    )
+    if shards.is_sharded():
+        posts = shards.posts_in_bulk(
+            [entry.post_id for entry in page_obj.object_list]
+        )
+        page_obj.object_list = [
+            posts[entry.post_id] for entry in page_obj.object_list
+            if entry.post_id in posts
+        ]
+    else:
+        page_obj.object_list = [entry.post for entry in page_obj.object_list]
+    return page_obj
+
+
+def get_merged_page(request):
+    author_ids = Follow.objects.filter(user=request.user).values_list(
+        'author_id', flat=True
+    )
+    if shards.is_sharded():
+        # JOIN с подписками возможен только в основной базе.
+        post_list = Post.objects.filter(author_id__in=list(author_ids))
+    else:
+        post_list = Post.objects.filter(author__following__user=request.user)
+    post_list = shards.across_shards(
+        shards.with_related(post_list, 'author', 'group')
+    )
+    if request.GET.get('page') is None and not settings.POSTS_NUMBERED_PAGES:
+        page_obj = merged_page(
+            CursorPaginator(post_list, number_of_last_records),
+            list(author_ids),
+            after=decode_cursor(request.GET.get('after')),
+            before=decode_cursor(request.GET.get('before')),
+        )
+        if page_obj is not None:
+            return page_obj
+    return get_paginator(request, post_list)
+
+
+FOLLOW_FEED_ENGINES = {
+    'fanout': get_fanout_page,
+    'merge': get_merged_page,
+}
+
+
+@read_from_replica
 @login_required
+@cache_control(private=True)
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_paginator(request, post_list)
+    page_obj = FOLLOW_FEED_ENGINES[settings.FOLLOW_FEED_ENGINE](request)
     context = {
         'page_obj': page_obj,
     }
@@ -137,6 +277,7 @@ def follow_index(request):
 
 
 @login_required
+@serialized_write
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author and not Follow.objects.filter(
@@ -151,6 +292,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@serialized_write
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(
@@ -158,3 +300,24 @@ def profile_unfollow(request, username):
         author=author
     ).delete()
     return redirect('posts:profile', username=username)
+
+
+@staff_member_required
+def export_rows(request, kind):
+    output_format = request.GET.get('format', 'jsonl')
+    if kind not in export.KINDS or output_format not in export.FORMATS:
+        raise Http404
+    user_id = None
+    if request.GET.get('user'):
+        user_id = get_object_or_404(User, username=request.GET['user']).pk
+    compress = 'gzip' in request.GET
+    name = export.filename(kind, output_format, compress)
+    response = StreamingHttpResponse(
+        export.stream(kind, output_format, compress, user_id),
+        content_type=(
+            'application/gzip' if compress
+            else export.CONTENT_TYPES[output_format]
+        ),
+    )
+    response['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
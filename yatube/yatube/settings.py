@@ -11,10 +11,15 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# "manage.py test" or pytest.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
@@ -50,12 +55,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.PageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -85,13 +93,90 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Applied by core.db to every new SQLite connection. In WAL mode readers
+# do not wait for the writer, and synchronous=NORMAL only loses the last
+# transactions on power loss. mmap_size is in bytes, a negative
+# cache_size in KiB, busy_timeout in milliseconds. A database may set
+# its own PRAGMAS.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 60,
+    },
+    # Local stand-in for a read replica, copied from default by
+    # "manage.py refresh_replica".
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'PRAGMAS': {**SQLITE_PRAGMAS, 'query_only': 1},
+        'TEST': {'MIRROR': 'default'},
+    },
+    # Second local shard for posts; enabled by listing it in POST_SHARDS.
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard_1.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    },
 }
 
+# GET views marked with core.routers.read_from_replica read from one of
+# DATABASE_REPLICAS once it has been refreshed. After a POST the user is
+# pinned to default for REPLICA_PIN_SECONDS to see their own writes.
+DATABASE_ROUTERS = [
+    'posts.shards.ShardRouter',
+    'core.routers.ReplicaRouter',
+]
+DATABASE_REPLICAS = ['replica']
+REPLICA_PIN_SECONDS = 30
+# A replica that missed writes still serves reads for REPLICA_MAX_LAG
+# seconds after its refresh; after that reads go to default until the
+# next refresh.
+REPLICA_MAX_LAG = 5
+
+# Posts and their comments are spread over POST_SHARDS by a rendezvous
+# hash of the author id (posts.shards), so a new shard only takes its
+# share of authors; "manage.py reshard" moves an author to another
+# shard. Post ids come from one table (PostKey) in default, so they are
+# unique across shards. Every shard is migrated with
+# "manage.py migrate --database <alias>". A single shard keeps
+# everything in default and skips PostKey.
+POST_SHARDS = ['default']
+# Foreign keys from posts, comments and feed entries may point into
+# another database, so they never have database constraints, with one
+# shard or many; "manage.py check_references" finds and removes rows
+# whose author, group or post is gone.
+
+# Admin changelists (posts.paginators.EstimatedCountPaginator) estimate
+# the size of an unfiltered table and count at most ADMIN_COUNT_LIMIT
+# rows of a filtered one.
+ADMIN_COUNT_LIMIT = 10000
+# Admin bulk actions (posts.bulk) change rows with one UPDATE/DELETE per
+# batch of this many and invalidate caches once per batch.
+BULK_BATCH_SIZE = 500
+
+# Exports (posts.export) read rows through a cursor and send them to the
+# client in parts of this many rows.
+EXPORT_CHUNK_SIZE = 2000
+
+# Writing views (core.writes.serialized_write) take one in-process lock
+# per database and, on "database is locked" from another process, retry
+# up to WRITE_RETRIES times after a random pause of up to
+# WRITE_RETRY_BACKOFF * 2 ** attempt (at most WRITE_RETRY_BACKOFF_MAX)
+# seconds.
+WRITE_RETRIES = 5
+WRITE_RETRY_BACKOFF = 0.05
+WRITE_RETRY_BACKOFF_MAX = 1.0
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -150,8 +235,97 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Per-process LRU in front of a SQLite file shared by all workers; every
+# write logs its keys, and other workers drop just those keys from their
+# LRU when they read the log, at most every CHECK_INTERVAL seconds.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TwoTierCache',
+        # Tests get their own file instead of the site's cache.
+        'LOCATION': os.path.join(
+            tempfile.gettempdir(), 'yatube-test-cache.sqlite3'
+        ) if TESTING else os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'CHECK_INTERVAL': 1,
+        },
     }
 }
+
+# sorl-thumbnail keeps what it knows about images and thumbnails in this
+# cache (core.thumbnails) instead of a table, so rendering a page never
+# queries the database for them; a lost entry is rebuilt from the file.
+CACHES['thumbnails'] = {
+    'BACKEND': 'core.cache.TwoTierCache',
+    'LOCATION': os.path.join(
+        tempfile.gettempdir(), 'yatube-test-thumbnails.sqlite3'
+    ) if TESTING else os.path.join(BASE_DIR, 'thumbnails.sqlite3'),
+    'TIMEOUT': None,
+    'OPTIONS': {
+        'MAX_ENTRIES': 1000000,
+        'LOCAL_MAX_ENTRIES': 10000,
+        'LOCAL_TIMEOUT': 60,
+    },
+}
+THUMBNAIL_KVSTORE = 'core.thumbnails.KVStore'
+THUMBNAIL_CACHE = 'thumbnails'
+
+# Cached pages are dropped by bumping their generation from model signals,
+# so the timeout only bounds how long an unused entry occupies memory.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Feed pages older than FEED_CACHE_FRESH seconds or from an old generation
+# are rebuilt by the one request holding the lock; the rest get the stale
+# copy, or wait up to FEED_CACHE_LOCK_WAIT seconds when there is none.
+FEED_CACHE_FRESH = 60
+FEED_CACHE_LOCK_TIMEOUT = 10
+FEED_CACHE_LOCK_WAIT = 2
+
+# Whole GET pages are cached once for anonymous and once for logged-in
+# users by core.middleware.PageCacheMiddleware, except under these paths.
+PAGE_CACHE_EXCLUDE = ['/admin/', '/static/', '/media/', '/export/']
+
+# Pagination
+
+# Numbered pages (?page=N) cost COUNT(*) and OFFSET, feeds use cursors
+# (?after=/?before=) unless this is switched on or ?page= is requested.
+POSTS_NUMBERED_PAGES = False
+
+# Follow feed
+
+# New posts are copied into followers' FeedEntry rows in batches of this
+# size. With FEED_FANOUT_ASYNC the copy is queued after commit and done
+# by a background thread, one short write per batch; without it the copy
+# is made inline, in the post's transaction. The queue lives in process
+# memory: posts it loses on a restart or crash keep a PendingFanOut row
+# and are copied by "manage.py fan_out_pending" (run it after deploys
+# and from cron).
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_FANOUT_ASYNC = True
+
+# 'fanout' reads the materialized FeedEntry table, 'merge' merges cached
+# per-author timelines of the last TIMELINE_LENGTH posts. A new follower
+# gets the author's last TIMELINE_LENGTH posts in FeedEntry.
+FOLLOW_FEED_ENGINE = 'fanout'
+TIMELINE_LENGTH = 200
+TIMELINE_TIMEOUT = 60 * 60
+
+# Query inspection
+
+# core.middleware.QueryBudgetMiddleware logs queries of one shape repeated
+# QUERY_REPEAT_THRESHOLD times in a request (N+1) and requests over the
+# budget of their URL name; with QUERY_BUDGET_STRICT (on in tests) it
+# raises instead.
+# Tests check the same budgets with core.testing.QueryBudgetMixin.
+QUERY_INSPECTION = DEBUG or TESTING
+QUERY_BUDGET_STRICT = TESTING
+QUERY_REPEAT_THRESHOLD = 3
+QUERY_BUDGETS = {
+    'posts:index': 4,
+    'posts:group_list': 5,
+    'posts:profile': 8,
+    'posts:post_detail': 9,
+    'posts:follow_index': 5,
+}